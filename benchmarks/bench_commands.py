@@ -0,0 +1,124 @@
+#
+# bench_commands.py
+#
+# Per-command cost of encoding and writing the high-rate OI commands,
+# comparing the original byte-at-a-time encoding with the precompiled
+# encoders in create_serial.commands.
+#
+# Usage: python benchmarks/bench_commands.py [iterations]
+
+import sys
+import timeit
+
+from create_serial.commands import CommandEncoder
+from create_serial.create import (
+    DRIVE,
+    DRIVEDIRECT,
+    LEDS,
+    MOTORS,
+    SONG,
+    _toTwosComplement2Bytes,
+)
+
+
+class NullPort:
+    """ stands in for the serial port; counts writes and bytes """
+
+    def __init__(self):
+        self.writes = 0
+        self.nbytes = 0
+
+    def write(self, data):
+        self.writes += 1
+        self.nbytes += len(data)
+
+
+# the encoding the Create methods used before commands.py, one
+# bytes([x]) object and one write per byte
+
+def legacy_drive(port, vel, radius):
+    vel = max(-500, min(500, int(vel)))
+    radius = int(radius)
+    if radius < -2000 or radius > 2000:
+        radius = 32768
+    vh, vl = _toTwosComplement2Bytes(vel)
+    rh, rl = _toTwosComplement2Bytes(radius)
+    port.write(DRIVE)
+    port.write(bytes([vh]))
+    port.write(bytes([vl]))
+    port.write(bytes([rh]))
+    port.write(bytes([rl]))
+
+
+def legacy_drive_direct(port, left, right):
+    lh, ll = _toTwosComplement2Bytes(int(left))
+    rh, rl = _toTwosComplement2Bytes(int(right))
+    port.write(DRIVEDIRECT)
+    port.write(bytes([rh]))
+    port.write(bytes([rl]))
+    port.write(bytes([lh]))
+    port.write(bytes([ll]))
+
+
+def legacy_leds(port, color, power, play, advance):
+    port.write(LEDS)
+    port.write(bytes([(advance << 3) | (play << 1)]))
+    port.write(bytes([color]))
+    port.write(bytes([power]))
+
+
+def legacy_motors(port, side, main, vacuum):
+    port.write(MOTORS)
+    port.write(bytes([(16 if main < 0 else 0) | (8 if side < 0 else 0) |
+                      (4 if main != 0 else 0) | (2 if vacuum != 0 else 0) |
+                      (1 if side > 0 else 0)]))
+
+
+def legacy_song(port, number, notes):
+    port.write(SONG)
+    port.write(bytes([number]))
+    port.write(bytes([len(notes)]))
+    for note, duration in notes:
+        port.write(bytes([note]))
+        port.write(bytes([duration]))
+
+
+SONG_NOTES = [(60 + i, 16) for i in range(16)]
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    enc = CommandEncoder()
+
+    cases = [
+        ('DRIVE',
+         lambda p: legacy_drive(p, 250.0, 1000.0),
+         lambda p: p.write(enc.drive(250.0, 1000.0))),
+        ('DRIVEDIRECT',
+         lambda p: legacy_drive_direct(p, 250.0, -250.0),
+         lambda p: p.write(enc.drive_direct(250.0, -250.0))),
+        ('LEDS',
+         lambda p: legacy_leds(p, 128, 255, 1, 0),
+         lambda p: p.write(enc.leds(128, 255, 1, 0))),
+        ('MOTORS',
+         lambda p: legacy_motors(p, 1, -1, 1),
+         lambda p: p.write(enc.motors(1, -1, 1))),
+        ('SONG x16',
+         lambda p: legacy_song(p, 1, SONG_NOTES),
+         lambda p: p.write(enc.song(1, SONG_NOTES))),
+    ]
+
+    print('{:<12} {:>14} {:>14} {:>8} {:>15}'.format(
+        'command', 'legacy ns/cmd', 'encoder ns/cmd', 'speedup', 'writes/cmd'))
+    for name, legacy, fast in cases:
+        legacy_port = NullPort()
+        fast_port = NullPort()
+        t_legacy = min(timeit.repeat(lambda: legacy(legacy_port), number=n, repeat=3))
+        t_fast = min(timeit.repeat(lambda: fast(fast_port), number=n, repeat=3))
+        print('{:<12} {:>14.0f} {:>14.0f} {:>7.1f}x {:>7d} -> {:<5d}'.format(
+            name, t_legacy / n * 1e9, t_fast / n * 1e9, t_legacy / t_fast,
+            legacy_port.writes // (3 * n), fast_port.writes // (3 * n)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#
+# bench_decode.py
+#
+# Per-reply cost of decoding sensor replies into sensord, comparing the
+# original packet-at-a-time interpreter with the compiled decoders in
+# create_serial.decoders, and a LazyFrame of the same reply of which
+# only two fields are read. With NumPy installed it also times the
+# batch decoder in create_serial.batch on a million replies.
+#
+# Usage: python benchmarks/bench_decode.py [iterations]
+
+import sys
+import timeit
+from unittest.mock import patch
+
+from create_serial.create import (
+    Create,
+    PASSIVE_MODE,
+    SENSOR_DATA_WIDTH,
+    SENSOR_GROUPS,
+    POSE,
+    BUMPS_AND_WHEEL_DROPS,
+    LSD_AND_OVERCURRENTS,
+    BUTTONS,
+    LEFT_BUMP,
+    RIGHT_BUMP,
+    LEFT_WHEEL_DROP,
+    RIGHT_WHEEL_DROP,
+    CENTER_WHEEL_DROP,
+    LEFT_WHEEL_OVERCURRENT,
+    RIGHT_WHEEL_OVERCURRENT,
+    ADVANCE_BUTTON,
+    PLAY_BUTTON,
+    ENCODER_LEFT,
+    ENCODER_RIGHT,
+    _bitOfByte,
+    _twosComplementInt1byte,
+    _twosComplementInt2bytes,
+    queryPlan,
+)
+from create_serial.decoders import PACKET_KINDS
+from create_serial.transport import LoopbackTransport
+
+
+# the interpreter _readSensorList used before decoders.py: one getter
+# call per packet, bitfields rebuilt bit by bit
+
+def _lower5(r):
+    return [_bitOfByte(4, r), _bitOfByte(3, r), _bitOfByte(2, r), _bitOfByte(1, r), _bitOfByte(0, r)]
+
+
+_GETTERS = {
+    'bit': lambda r: 1 if r == 1 else 0,
+    'lower5': _lower5,
+    'buttons': lambda r: [_bitOfByte(2, r), _bitOfByte(0, r)],
+    'B': lambda r: r,
+    'b': _twosComplementInt1byte,
+    'H': lambda r1, r2: r1 << 8 | r2,
+    'h': _twosComplementInt2bytes,
+}
+
+
+def legacy_decode(robot, packets, r):
+    interpreter = [_GETTERS.get(kind) for kind in PACKET_KINDS]
+    d = robot.sensord
+    start = 0
+    update_pose = False
+    for sensorNum in packets:
+        width = SENSOR_DATA_WIDTH[sensorNum]
+        value = 0
+        if width == 1:
+            value = interpreter[sensorNum](r[start])
+        elif width == 2:
+            value = interpreter[sensorNum](r[start], r[start + 1])
+        d[sensorNum] = value
+        if sensorNum == BUMPS_AND_WHEEL_DROPS:
+            (d[CENTER_WHEEL_DROP], d[LEFT_WHEEL_DROP], d[RIGHT_WHEEL_DROP],
+             d[LEFT_BUMP], d[RIGHT_BUMP]) = value
+        if sensorNum == LSD_AND_OVERCURRENTS:
+            d[LEFT_WHEEL_OVERCURRENT], d[RIGHT_WHEEL_OVERCURRENT] = value[:2]
+        if sensorNum == BUTTONS:
+            d[ADVANCE_BUTTON], d[PLAY_BUTTON] = value
+        if sensorNum == ENCODER_LEFT:
+            robot.leftEncoder = value
+            update_pose = True
+        if sensorNum == ENCODER_RIGHT:
+            robot.rightEncoder = value
+            update_pose = True
+        start += width
+    if update_pose:
+        robot._integrateNextEncoderStep()
+    d[POSE] = robot.getPose(dist='cm')
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    with patch('create_serial.create.time.sleep'):
+        robot = Create(LoopbackTransport(), startingMode=PASSIVE_MODE)
+
+    cases = [
+        ('encoders', [ENCODER_LEFT, ENCODER_RIGHT]),
+        ('group 3', list(SENSOR_GROUPS[3])),
+        ('group 6', list(SENSOR_GROUPS[6])),
+        ('7..51', list(range(7, 52))),
+    ]
+
+    print('{:<10} {:>6} {:>16} {:>18} {:>8} {:>16}'.format(
+        'query', 'bytes', 'legacy ns/reply', 'compiled ns/reply', 'speedup', 'lazy+2 ns/reply'))
+    for name, packets in cases:
+        size = sum(SENSOR_DATA_WIDTH[i] for i in packets)
+        reply = bytes(range(size))
+        decoder = queryPlan(packets).decoder
+        first, second = packets[:2]
+
+        def lazy():
+            frame = decoder.frame(robot, reply)
+            frame[first]
+            frame[second]
+
+        t_legacy = min(timeit.repeat(lambda: legacy_decode(robot, packets, reply), number=n, repeat=3))
+        t_fast = min(timeit.repeat(lambda: robot._readSensorList(packets, reply), number=n, repeat=3))
+        t_lazy = min(timeit.repeat(lazy, number=n, repeat=3))
+        print('{:<10} {:>6d} {:>16.0f} {:>18.0f} {:>7.1f}x {:>16.0f}'.format(
+            name, size, t_legacy / n * 1e9, t_fast / n * 1e9, t_legacy / t_fast, t_lazy / n * 1e9))
+
+    try:
+        from create_serial.batch import decodeReplies
+    except ImportError:
+        return
+    print()
+    print('{:<10} {:>6} {:>16}'.format('batch', 'bytes', 'replies/s'))
+    for name, packets in cases:
+        size = sum(SENSOR_DATA_WIDTH[i] for i in packets)
+        data = bytes(range(256)) * (size * 1000000 // 256) + bytes(size * 1000000 % 256)
+        t = min(timeit.repeat(lambda: decodeReplies(data, packets), number=1, repeat=3))
+        print('{:<10} {:>6d} {:>16.0f}'.format(name, size, 1000000 / t))
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,9 @@
 from .create import (
     Create,
     SensorFrame,
+    SensorQuery,
+    QueryPlan,
+    queryPlan,
     find_port,
     modeStr,
     # OI opcodes
@@ -83,6 +86,13 @@ from .create import (
     LIGHTBUMP_CENTER_RIGHT,
     LIGHTBUMP_FRONT_RIGHT,
     LIGHTBUMP_RIGHT,
+    INFRARED_CHARACTER_LEFT,
+    INFRARED_CHARACTER_RIGHT,
+    LEFT_MOTOR_CURRENT,
+    RIGHT_MOTOR_CURRENT,
+    MAIN_BRUSH_MOTOR_CURRENT,
+    SIDE_BRUSH_MOTOR_CURRENT,
+    STASIS,
     # Composite sensor aliases
     POSE,
     LEFT_BUMP,
@@ -96,10 +106,33 @@ from .create import (
     PLAY_BUTTON,
     # Physical constants
     SENSOR_DATA_WIDTH,
+    SENSOR_GROUPS,
     WHEEL_SPAN,
     WHEEL_DIAMETER,
     TICK_PER_REVOLUTION,
     TICK_PER_MM,
 )
 
+from .transport import (
+    Transport,
+    SerialTransport,
+    PosixTTYTransport,
+    TCPTransport,
+    LoopbackTransport,
+    openTransport,
+)
+
+from .registry import SensorSpec, encodePacket, encodeReply
+from .snapshot import SensorSnapshot
+from .decoders import LazyFrame
+
+from .aio import AsyncCreate
+
+from .recorder import (
+    RecordingTransport,
+    ReplayTransport,
+    SessionLog,
+    replaySession,
+)
+
 __version__ = "0.2.1"
@@ -0,0 +1,380 @@
+#
+# aio.py
+#
+# An asyncio version of Create.
+#
+# AsyncCreate reads the port from the event loop (loop.add_reader on its
+# file descriptor) instead of blocking in ser.read, and every wait --
+# sensor replies, the pauses between mode changes, scripted moves -- is
+# an await, so many robots and other I/O can share one loop without
+# threads or run_in_executor.
+#
+#   robot = await AsyncCreate.open('/dev/ttyUSB0')
+#   d = await robot.sensors([POSE, BUMPS_AND_WHEEL_DROPS])
+#   await robot.move(50)
+#   await robot.startStream([ENCODER_LEFT, ENCODER_RIGHT])
+#   async for d in robot.streamFrames():
+#       ...
+#   await robot.close()
+
+import asyncio
+import io
+import math
+import time
+
+from .create import (
+    Create, PASSIVE_MODE, SAFE_MODE, FULL_MODE, POSE, OI_MODE, ENCODER_LEFT, ENCODER_RIGHT,
+    START, SAFE, FULL, SENSORS, QUERYLIST, STREAM, PAUSERESUME, ENDSCRIPT,
+    SENSOR_DATA_WIDTH, READY_TIMEOUT, READY_PROBE_INTERVAL, MODE_TIMEOUT,
+    modeStr,
+    queryPlan, _expandAliases,
+)
+from .stream import STREAM_PERIOD
+
+# how often a transport without a file descriptor (a LoopbackTransport)
+# is checked for incoming bytes
+POLL_INTERVAL = 0.002
+
+# frames an unread streamFrames() iterator holds before dropping the oldest
+STREAM_BACKLOG = 64
+
+
+class AsyncCreate(Create):
+    """ Create for asyncio programs. Open one with
+    await AsyncCreate.open(PORT, startingMode=SAFE_MODE); PORT is
+    anything Create accepts.
+
+    sensors(), the mode changes, move(), turn(), drive(), stop(),
+    startStream(), changeStream(), stopStream() and close() are
+    coroutines. The commands that only send bytes (go_differential,
+    setLEDs, motors, playSong, ...) are inherited unchanged; they never
+    wait. The blocking helpers built
+    on the synchronous sensors() (printSensors, senseFunc, sleepTill,
+    sensors_many) are not for use here.
+    """
+
+    def __init__(self, PORT=None, BAUD_RATE=115200):
+        """ opens the port without talking to the robot; open() does
+        both, and is what programs normally call
+        """
+        self._openPort(PORT, BAUD_RATE)
+        self._initState(BAUD_RATE)
+        self.timeout = 0.5          # seconds a sensor reply may take
+        self._loop = None
+        self._fd = None
+        self._pollTask = None
+        self._subscribers = []      # asyncio.Queue per streamFrames()
+
+    @classmethod
+    async def open(cls, PORT=None, BAUD_RATE=115200, startingMode=SAFE_MODE):
+        """ connects and puts the robot in startingMode """
+        robot = cls(PORT, BAUD_RATE)
+        await robot.connect(startingMode)
+        return robot
+
+    async def connect(self, startingMode=SAFE_MODE):
+        """ attaches to the running event loop, then starts the OI the
+        way the Create constructor does
+        """
+        self._loop = asyncio.get_running_loop()
+        try:
+            self._fd = self.ser.fileno()
+            self._loop.add_reader(self._fd, self._onReadable)
+        except (io.UnsupportedOperation, AttributeError, OSError, NotImplementedError):
+            # no selectable descriptor; check for bytes on a timer
+            self._fd = None
+            self._pollTask = self._loop.create_task(self._pollPort())
+
+        await self._waitReady()
+        if startingMode == SAFE_MODE:
+            await self.toSafeMode()
+        elif startingMode == FULL_MODE:
+            await self.toFullMode()
+        self.setPose(0, 0, 0)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    # reading
+
+    def _onReadable(self):
+        self.process_io()
+
+    async def _pollPort(self):
+        while True:
+            self.process_io()
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def _applyStreamFrames(self, frames):
+        results = Create._applyStreamFrames(self, frames)
+        for result in results:
+            self._publish(result.copy() if result is self.sensord else result)
+        return results
+
+    def _publish(self, frame):
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(frame)
+
+    async def _query(self, request, packets, size, timeout=-1.0):
+        """ submits a request and waits for process_io to finish it;
+        raises asyncio.TimeoutError if the reply takes longer than
+        timeout seconds (self.timeout by default, None waits forever)
+        """
+        if timeout is not None and timeout < 0:
+            timeout = self.timeout
+        future = self._loop.create_future()
+
+        def finished(query):
+            if future.done():
+                return
+            if query.timedOut:
+                future.set_exception(asyncio.TimeoutError())
+            else:
+                future.set_result(query)
+
+        query = self._submit(request, packets, size, finished, timeout)
+        wait = timeout
+        if self._staleUntil is not None:
+            # held until the rest of a timed-out reply has been thrown
+            # away; see Create._completeQueries
+            held = max(0.0, self._staleUntil - time.monotonic())
+            self._loop.call_later(held + 0.001, self.process_io)
+            if wait is not None:
+                wait += held
+        if wait is not None:
+            # make sure the timeout is noticed even if nothing arrives
+            self._loop.call_later(wait + 0.001, self.process_io)
+        return await future
+
+    def _settle(self):
+        # commands go out at once, since only sensor requests could be
+        # answered into a lost reply's leftovers, and _submit holds those
+        pass
+
+    async def sensors(self, list_of_sensors_to_poll=6):
+        """ the awaitable version of Create.sensors """
+        if self._streaming:
+            return self.sensord
+        plan = queryPlan(list_of_sensors_to_poll)
+        await self._query(plan.request, plan.packets, plan.size)
+        return self.sensord
+
+    # commands
+
+    async def drive(self, cm_per_sec=0, rad_per_sec=0):
+        """ go_differential, then lets other tasks run """
+        self.go_differential(cm_per_sec, rad_per_sec)
+        await asyncio.sleep(0)
+
+    async def stop(self):
+        """ stops the wheels and updates the pose """
+        self.go_differential(0, 0)
+        await self.sensors([POSE])
+
+    async def _start(self):
+        self._write( START )
+        self.sciMode = PASSIVE_MODE
+        await asyncio.sleep(0.02)
+
+    async def _waitReady(self, timeout=READY_TIMEOUT):
+        """ the awaitable version of Create._waitReady """
+        deadline = self._loop.time() + timeout
+        while True:
+            try:
+                await self._query(START + SENSORS + bytes([OI_MODE]), (OI_MODE,),
+                                  SENSOR_DATA_WIDTH[OI_MODE], READY_PROBE_INTERVAL)
+            except asyncio.TimeoutError:
+                if self._loop.time() >= deadline:
+                    print('The robot did not answer within', timeout, 'seconds;')
+                    print('  carrying on as if it had.')
+                    return None
+                continue
+            mode = self.sensord[OI_MODE]
+            if mode <= FULL_MODE:
+                self.sciMode = mode
+                return mode
+            return None
+
+    async def toSafeMode(self, timeout=MODE_TIMEOUT):
+        await self._start()
+        self._write( SAFE )
+        self.sciMode = SAFE_MODE
+        return await self._confirmMode(SAFE_MODE, timeout)
+
+    async def toFullMode(self, timeout=MODE_TIMEOUT):
+        await self._start()
+        self._write( FULL )
+        self.sciMode = FULL_MODE
+        return await self._confirmMode(FULL_MODE, timeout)
+
+    async def _confirmMode(self, mode, timeout=MODE_TIMEOUT):
+        """ the awaitable version of Create._confirmMode """
+        if self._streaming and OI_MODE not in self.streamPackets:
+            return None
+        deadline = self._loop.time() + timeout
+        while True:
+            if self._streaming:
+                await asyncio.sleep(STREAM_PERIOD)
+            else:
+                try:
+                    await self._query(SENSORS + bytes([OI_MODE]), (OI_MODE,),
+                                      SENSOR_DATA_WIDTH[OI_MODE],
+                                      self._replyTimeout(SENSOR_DATA_WIDTH[OI_MODE]))
+                except asyncio.TimeoutError:
+                    pass
+            if self.reportedMode == mode:
+                return True
+            if self._loop.time() >= deadline:
+                print('The robot did not report', modeStr(mode), 'within', timeout, 'seconds')
+                return False
+            if not self._streaming:
+                await asyncio.sleep(STREAM_PERIOD)
+
+    async def _endScript(self, timeout=-1.0):
+        """ runs the script and returns once it has finished: True, or
+        False if timeout seconds (if not negative) went by first. The
+        robot does not answer the SENSORS query sent after it until then.
+        """
+        if self._streaming:
+            # the reply would be taken from among the frames; the stream
+            # is paused for the script, without ending streamFrames()
+            self._pauseStream()
+            await asyncio.sleep(STREAM_PERIOD)
+            self._streamPaused()
+            try:
+                return await self._endScript(timeout)
+            finally:
+                self._resumeStream()
+        self._write( ENDSCRIPT )
+        try:
+            await self._query(SENSORS + bytes([7]), None, SENSOR_DATA_WIDTH[7],
+                              None if timeout < 0 else timeout)
+        except asyncio.TimeoutError:
+            print('The script did not finish within', timeout, 'seconds')
+            return False
+        return True
+
+    async def turn(self, angle_rad, rad_per_sec=math.radians(20)):
+        if angle_rad == 0:
+            return
+        if rad_per_sec == 0:
+            rad_per_sec = math.radians(20)
+        if (angle_rad < 0 and rad_per_sec > 0) or (angle_rad > 0 and rad_per_sec < 0):
+            rad_per_sec = -rad_per_sec
+        with self.batch():
+            self._startScript(13)
+            self.go_differential(0, rad_per_sec)
+            self._waitForAngle(int(math.degrees(angle_rad)))
+            self.go_differential(0, 0)
+        await self._endScript()
+
+    async def move(self, distance_cm, cm_per_sec=10):
+        if distance_cm == 0:
+            return
+        if cm_per_sec == 0:
+            cm_per_sec = 10
+        if (distance_cm < 0 and cm_per_sec > 0) or (distance_cm > 0 and cm_per_sec < 0):
+            cm_per_sec = -cm_per_sec
+        with self.batch():
+            self._startScript(13)
+            self.go_differential(cm_per_sec, 0)
+            self._waitForDistance(distance_cm*10)
+            self.go_differential(0, 0)
+        await self._endScript()
+
+    # streaming
+
+    async def startStream(self, list_of_sensors_to_stream):
+        """ asks the robot to send the listed sensors every 15 ms;
+        sensord and the pose follow the stream, and streamFrames()
+        yields every frame
+        """
+        if self._streaming:
+            await self.stopStream()
+        packets = _expandAliases(list_of_sensors_to_stream)
+        self._checkStreamFits(packets)
+        self.streamPackets = packets
+        self._streamParser.reset()
+        self._streaming = True
+        self._write( STREAM + bytes([len(packets)]) + bytes(packets) )
+
+    def _startStreamReader(self):
+        # process_io reads the frames on the event loop
+        pass
+
+    async def changeStream(self, list_of_sensors_to_stream, keepOdometry=True):
+        """ the awaitable version of Create.changeStream; streamFrames()
+        iterators carry on with the frames of the new list
+        """
+        if not self._streaming:
+            return await self.startStream(list_of_sensors_to_stream)
+        packets = _expandAliases(list_of_sensors_to_stream)
+        if keepOdometry:
+            for encoder in (ENCODER_LEFT, ENCODER_RIGHT):
+                if encoder in self.streamPackets and encoder not in packets:
+                    packets.append(encoder)
+        self._checkStreamFits(packets)
+        self._write( PAUSERESUME + bytes([0]) )
+        # let a frame already on the wire arrive and be parsed
+        await asyncio.sleep(STREAM_PERIOD)
+        self._streamParser.reset()
+        self.streamPackets = packets
+        with self.batch():
+            self._write( STREAM + bytes([len(packets)]) + bytes(packets) )
+            self._write( PAUSERESUME + bytes([1]) )
+
+    async def stopStream(self):
+        """ pauses the stream and ends the streamFrames() iterators """
+        if not self._streaming:
+            return
+        self._pauseStream()
+        # let a frame already on the wire arrive and be parsed
+        await asyncio.sleep(STREAM_PERIOD)
+        self._streamPaused()
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+    async def streamFrames(self):
+        """ async iterator over the streamed frames: yields a copy of
+        sensord after each frame until stopStream. A consumer that falls
+        more than STREAM_BACKLOG frames behind loses the oldest ones.
+        """
+        queue = asyncio.Queue(STREAM_BACKLOG)
+        self._subscribers.append(queue)
+        try:
+            while self._streaming or not queue.empty():
+                frame = await queue.get()
+                if frame is None:
+                    break
+                yield frame
+        finally:
+            self._subscribers.remove(queue)
+
+    async def close(self):
+        """ stops any stream, clears the odometry counters, returns the
+        robot to passive mode and closes the port
+        """
+        await self.stopStream()
+        try:
+            # clear the distance and angle counters
+            # (read but not decoded, so the pose is left alone)
+            await self._query(QUERYLIST + bytes([2, 19, 20]), None, 4)
+        except asyncio.TimeoutError:
+            pass
+        await asyncio.sleep(0.1)
+        await self._start()
+        await asyncio.sleep(0.1)
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+        if self._pollTask is not None:
+            self._pollTask.cancel()
+        self.ser.close()
+        if self._emulator is not None:
+            self._emulator.stop()
@@ -0,0 +1,113 @@
+#
+# batch.py
+#
+# Vectorized decoding of many sensor replies at once, with NumPy.
+#
+# N replies to the same packet list laid end to end are an N-row
+# structured array (history.replyDtype), so the whole buffer is decoded
+# by viewing it and converting each field once; bitfields are expanded
+# with array shifts. The result is a dict of columns named as in
+# SensorSnapshot, plus the derived bits (leftBump, playButton, ...):
+#
+#   cols = decodeReplies(data, [BUMPS_AND_WHEEL_DROPS, ENCODER_LEFT])
+#   cols['encoderLeft'], cols['leftBump']
+#
+# decodeStreamFrames does the same for stream frames of one packet list
+# (as the robot sent them, headers and checksums included), and
+# columns() for rows already in a structured array, such as a
+# SensorHistory window.
+#
+# Needs NumPy (pip install create-serial[numpy]).
+
+import numpy as np
+
+from .decoders import PACKET_KINDS
+from .history import _NUMPY_TYPE, replyDtype
+from .registry import DERIVED_BITS
+from .snapshot import FIELD_NAMES
+from .stream import STREAM_HEADER
+
+
+def columns(rows, packets):
+    """ the columns of rows, a structured array whose fields follow
+    replyDtype(packets): every packet converted to native byte order,
+    the 'bit' packets as 0/1 (1 only for a byte of exactly 1, as
+    sensors() does), the derived bits of the bitfield packets, and any
+    other fields of rows (t, x, y, th) as they are
+    """
+    cols = {}
+    for sensornum in packets:
+        kind = PACKET_KINDS[sensornum]
+        name = FIELD_NAMES.get(sensornum)
+        if kind is None or name in cols:
+            continue
+        values = rows[name]
+        if kind == 'bit':
+            cols[name] = (values == 1).view(np.uint8)
+            continue
+        cols[name] = values.astype(np.dtype(_NUMPY_TYPE[kind]).newbyteorder('='))
+        for derived, _, bit in DERIVED_BITS.get(sensornum, ()):
+            cols[FIELD_NAMES[derived]] = (values >> bit) & 1
+    for name in rows.dtype.names:
+        if name not in cols:
+            cols[name] = rows[name]
+    return cols
+
+
+def decodeReplies(data, packets):
+    """ decodes data, a bytes-like holding N complete replies to a
+    QUERYLIST of packets, into columns of N values each
+    """
+    dtype = replyDtype(packets, trailer=False)
+    if len(data) % dtype.itemsize:
+        raise ValueError('%d bytes is not a whole number of %d byte replies'
+                         % (len(data), dtype.itemsize))
+    return columns(np.frombuffer(data, dtype=dtype), packets)
+
+
+def streamFrameDtype(packets):
+    """ the structured dtype of one stream frame of packets: header,
+    count, the reply fields (each after its id byte) and checksum
+    """
+    names, formats, offsets = ['header', 'count'], ['u1', 'u1'], [0, 1]
+    position = 2
+    for sensornum in packets:
+        kind = PACKET_KINDS[sensornum]
+        position += 1       # the packet id
+        if kind is None:
+            continue
+        name = FIELD_NAMES[sensornum]
+        fmt = _NUMPY_TYPE[kind]
+        if name not in names:
+            names.append(name)
+            formats.append(fmt)
+            offsets.append(position)
+        position += np.dtype(fmt).itemsize
+    names.append('checksum')
+    formats.append('u1')
+    offsets.append(position)
+    return np.dtype({'names': names, 'formats': formats,
+                     'offsets': offsets, 'itemsize': position + 1})
+
+
+def decodeStreamFrames(data, packets):
+    """ decodes data, back-to-back stream frames that all carry
+    packets, into columns. Frames with a wrong header, count or
+    checksum are left out.
+    """
+    dtype = streamFrameDtype(packets)
+    size = dtype.itemsize
+    if len(data) % size:
+        raise ValueError('%d bytes is not a whole number of %d byte frames'
+                         % (len(data), size))
+    raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, size)
+    good = ((raw.sum(axis=1, dtype=np.uint32) & 0xFF) == 0)
+    good &= raw[:, 0] == STREAM_HEADER
+    good &= raw[:, 1] == size - 3
+    rows = np.frombuffer(data, dtype=dtype)
+    if not good.all():
+        rows = rows[good]
+    cols = columns(rows, packets)
+    for name in ('header', 'count', 'checksum'):
+        del cols[name]
+    return cols
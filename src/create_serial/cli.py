@@ -8,6 +8,7 @@
 #   port is optional - auto-detects if not provided.
 # Control the Roomba with keyboard keys.
 # Only stdlib modules are used (no curses, no pygame).
+import io
 import math
 import select
 import sys
@@ -45,6 +46,8 @@ SENSORS_TO_POLL = [
     create.DIRT_DETECTED,
 ]
 
+POLL_INTERVAL = 0.2   # seconds between sensor polls
+
 
 def print_help():
     print("\n--- Roomba CLI Controller ---")
@@ -64,7 +67,6 @@ def main():
     port = sys.argv[1] if len(sys.argv) > 1 else None
 
     robot = create.Create(port)
-    robot.toSafeMode()
     robot.resetPose()
 
     fwd_speed = MAX_FORWARD / 2
@@ -77,6 +79,16 @@ def main():
     vacuum = 0
 
     prev_senses = {}
+    query = None
+    next_poll = 0.0
+
+    # the robot's port goes in the select() next to stdin; a transport
+    # without a descriptor is checked on every pass instead
+    try:
+        robot_fd = robot.fileno()
+    except (OSError, ValueError, io.UnsupportedOperation):
+        robot_fd = None
+    inputs = [sys.stdin] if robot_fd is None else [sys.stdin, robot_fd]
 
     print_help()
     print("Speed: fwd={:.0f} rot={:.0f}".format(fwd_speed, rot_speed))
@@ -86,9 +98,15 @@ def main():
         tty.setraw(sys.stdin.fileno())
 
         while True:
-            # Check for keypress with timeout so sensor loop continues
-            ready, _, _ = select.select([sys.stdin], [], [], 0.2)
-            if ready:
+            now = time.monotonic()
+            if query is None and now >= next_poll:
+                # ask for the sensors; the reply is picked up below
+                query = robot.submit_query(SENSORS_TO_POLL)
+                next_poll = now + POLL_INTERVAL
+
+            # wait for a keypress or sensor bytes, whichever comes first
+            ready, _, _ = select.select(inputs, [], [], 0.05)
+            if sys.stdin in ready:
                 key = sys.stdin.read(1)
                 update_roomba = False
 
@@ -143,17 +161,21 @@ def main():
                     tty.setraw(sys.stdin.fileno())
 
                 if update_roomba:
-                    robot.go_differential(robot_dir * fwd_speed, robot_rot * rot_speed)
-                    robot.motors(side_brush, main_brush, vacuum)
-                    time.sleep(0.1)
-
-            # Poll sensors
-            try:
-                senses = robot.sensors(list(SENSORS_TO_POLL))
-            except Exception:
+                    with robot.batch():
+                        robot.go_differential(robot_dir * fwd_speed, robot_rot * rot_speed)
+                        robot.motors(side_brush, main_brush, vacuum)
+
+            # Pick up sensor replies without blocking
+            robot.process_io()
+            if query is None or not query.done:
+                continue
+            timedOut = query.timedOut
+            query = None
+            if timedOut:
                 sys.stdout.write("\r\n! Sensor read error\r\n")
                 sys.stdout.flush()
                 continue
+            senses = robot.sensord
 
             # Print only changed values
             changed = []
@@ -165,7 +187,7 @@ def main():
             if changed:
                 sys.stdout.write("\r\n" + "  ".join(changed) + "\r\n")
                 sys.stdout.flush()
-            prev_senses = dict(senses)
+            prev_senses = senses.copy()
 
     except Exception as err:
         termios.tcsetattr(sys.stdin, termios.TCSADRAIN, old_settings)
@@ -0,0 +1,164 @@
+#
+# commands.py
+#
+# Precompiled encoders for the OI commands that are sent at high rates
+# (DRIVE, DRIVEDIRECT, LEDS, MOTORS and SONG).
+#
+# Each encoder packs opcode and payload into one reusable bytearray with
+# a precompiled struct.Struct and returns a memoryview of the finished
+# command, so a 50 Hz teleop loop does not allocate per command. The
+# returned view is only valid until the next call on the same encoder;
+# write it out (or copy it) before encoding the next command. For the
+# same reason an encoder belongs to one thread; Create keeps one per
+# thread.
+
+import struct
+
+DRIVE_OPCODE = 137
+MOTORS_OPCODE = 138
+LEDS_OPCODE = 139
+SONG_OPCODE = 140
+DRIVEDIRECT_OPCODE = 145
+
+# payload length of every OI opcode; None means the length is given
+# in the payload itself (SONG, STREAM, QUERYLIST, SCRIPT)
+PAYLOAD_LENGTH = {
+    128: 0,     # START
+    129: 1,     # BAUD
+    130: 0,     # CONTROL
+    131: 0,     # SAFE
+    132: 0,     # FULL
+    133: 0,     # POWER
+    134: 0,     # SPOT
+    135: 0,     # CLEAN / COVER
+    136: 1,     # DEMO (the Roomba MAX command takes none; Create sends one)
+    137: 4,     # DRIVE
+    138: 1,     # MOTORS
+    139: 3,     # LEDS
+    140: None,  # SONG: number, length, 2 bytes per note
+    141: 1,     # PLAY
+    142: 1,     # SENSORS
+    143: 0,     # FORCESEEKINGDOCK
+    144: 3,     # PWM motors
+    145: 4,     # DRIVEDIRECT
+    146: 4,     # DRIVE PWM
+    147: 1,     # digital outputs
+    148: None,  # STREAM: count, ids
+    149: None,  # QUERYLIST: count, ids
+    150: 1,     # PAUSERESUME
+    151: 1,     # send IR
+    152: None,  # SCRIPT: count, bytes
+    153: 0,     # play script (ENDSCRIPT)
+    154: 0,     # show script
+    155: 1,     # WAIT TIME (tenths of a second)
+    156: 2,     # WAITDIST (mm)
+    157: 2,     # WAITANGLE (degrees)
+    158: 1,     # WAIT EVENT
+    162: 2,     # scheduling LEDs
+    163: 4,     # digit LEDs raw
+    164: 4,     # digit LEDs ascii
+    165: 1,     # buttons
+    167: 15,    # schedule
+    168: 3,     # set day/time (CHANGE_TIME)
+    173: 0,     # STOP
+}
+
+# opcode, velocity (mm/s), radius (mm) -- big-endian signed 16-bit
+_DRIVE = struct.Struct('>Bhh')
+# opcode, right velocity (mm/s), left velocity (mm/s)
+_DRIVEDIRECT = struct.Struct('>Bhh')
+# opcode, LED bits, power color, power intensity
+_LEDS = struct.Struct('>BBBB')
+# opcode, motor bits
+_MOTORS = struct.Struct('>BB')
+# opcode, song number, song length -- followed by (note, duration) pairs
+_SONG_HEADER = struct.Struct('>BBB')
+
+MAX_SONG_NOTES = 16
+
+# the radius the OI treats as "drive straight" (0x8000)
+STRAIGHT_RADIUS = -32768
+
+
+class CommandEncoder:
+    """ packs OI commands into a single reusable buffer
+
+    the methods clamp their inputs the same way the Create methods
+    always have and return a memoryview of the encoded command
+    """
+
+    def __init__(self):
+        self._buf = bytearray(_SONG_HEADER.size + 2*MAX_SONG_NOTES)
+        view = memoryview(self._buf)
+        # one view per possible command length, so returning a
+        # command never has to slice (and allocate) a new view
+        self._views = [view[:n] for n in range(len(self._buf) + 1)]
+
+    def drive(self, mm_sec, radius_mm, turn_dir='CCW'):
+        """ DRIVE: velocity is capped at +-500 mm/sec, a radius beyond
+        +-2000 mm means straight, and a radius of 0 turns in place
+        in the turn_dir direction ('CW' or 'CCW')
+        """
+        mm_sec = int(mm_sec)
+        radius_mm = int(radius_mm)
+        mm_sec = -500 if mm_sec < -500 else (500 if mm_sec > 500 else mm_sec)
+        if radius_mm < -2000 or radius_mm > 2000:
+            radius_mm = STRAIGHT_RADIUS
+        elif radius_mm == 0:
+            radius_mm = -1 if turn_dir == 'CW' else 1
+        _DRIVE.pack_into(self._buf, 0, DRIVE_OPCODE, mm_sec, radius_mm)
+        return self._views[5]
+
+    def drive_direct(self, left_mm_sec, right_mm_sec):
+        """ DRIVEDIRECT: each wheel velocity is capped at +-500 mm/sec """
+        left_mm_sec = int(left_mm_sec)
+        right_mm_sec = int(right_mm_sec)
+        left_mm_sec = -500 if left_mm_sec < -500 else (500 if left_mm_sec > 500 else left_mm_sec)
+        right_mm_sec = -500 if right_mm_sec < -500 else (500 if right_mm_sec > 500 else right_mm_sec)
+        _DRIVEDIRECT.pack_into(self._buf, 0, DRIVEDIRECT_OPCODE, right_mm_sec, left_mm_sec)
+        return self._views[5]
+
+    def leds(self, power_color, power_intensity, play, advance):
+        """ LEDS: power color and intensity are capped to 0-255,
+        play and advance are on for any non-zero value
+        """
+        bits = (8 if advance else 0) | (2 if play else 0)
+        power_color = 0 if power_color < 0 else (255 if power_color > 255 else power_color)
+        power_intensity = 0 if power_intensity < 0 else (255 if power_intensity > 255 else power_intensity)
+        _LEDS.pack_into(self._buf, 0, LEDS_OPCODE, bits, power_color, power_intensity)
+        return self._views[4]
+
+    def motors(self, side_brush=0, main_brush=0, vacuum=0):
+        """ MOTORS: brushes take -1 (reverse), 0 (off) or 1 (forward),
+        the vacuum is on for any positive value
+        """
+        bits = ((16 if main_brush < 0 else 0) |
+                (8 if side_brush < 0 else 0) |
+                (4 if main_brush != 0 else 0) |
+                (2 if vacuum > 0 else 0) |
+                (1 if side_brush > 0 else 0))
+        _MOTORS.pack_into(self._buf, 0, MOTORS_OPCODE, bits)
+        return self._views[2]
+
+    def song(self, songNumber, songDataList):
+        """ SONG: songNumber is capped to 0-15 and at most 16
+        (note, duration) pairs are stored; anything in the list that is
+        not a tuple becomes a quarter-second rest
+        """
+        songNumber = 0 if songNumber < 0 else (15 if songNumber > 15 else songNumber)
+        L = len(songDataList)
+        if L > MAX_SONG_NOTES:
+            L = MAX_SONG_NOTES
+        buf = self._buf
+        _SONG_HEADER.pack_into(buf, 0, SONG_OPCODE, songNumber, L)
+        i = _SONG_HEADER.size
+        for k in range(L):
+            note = songDataList[k]
+            if isinstance(note, tuple):
+                buf[i] = note[0]     # note number
+                buf[i+1] = note[1]   # duration
+            else:
+                buf[i] = 30          # a rest note
+                buf[i+1] = 16        # 1/4 of a second
+            i += 2
+        return self._views[i]
@@ -23,13 +23,25 @@
 # Ported to Python 3 - Feb 2026
 
 import serial
+import contextlib
 import glob
 import math
 import sys
 import time
+import bisect
+import collections
+import functools
+import itertools
 import datetime
 import threading
 
+from .commands import CommandEncoder
+from .decoders import compileDecoder
+from .registry import SENSOR_DATA_WIDTH, BITS, PRINTED_SENSORS, formatSensors
+from .snapshot import SensorSnapshot
+from .stream import StreamParser, STREAM_PERIOD
+from .transport import openTransport
+
 
 def find_port():
     """Scan /dev/ for a likely Roomba serial port.
@@ -93,7 +105,7 @@ PASSIVE_MODE = 1
 SAFE_MODE = 2
 FULL_MODE = 3
 
-# the sensors
+# the sensors (their sizes, kinds and snapshot fields are in registry.py)
 BUMPS_AND_WHEEL_DROPS = 7
 WALL_IR_SENSOR = 8
 CLIFF_LEFT = 9
@@ -138,6 +150,13 @@ LIGHTBUMP_CENTER_LEFT = 48
 LIGHTBUMP_CENTER_RIGHT = 49
 LIGHTBUMP_FRONT_RIGHT = 50
 LIGHTBUMP_RIGHT = 51
+INFRARED_CHARACTER_LEFT = 52
+INFRARED_CHARACTER_RIGHT = 53
+LEFT_MOTOR_CURRENT = 54
+RIGHT_MOTOR_CURRENT = 55
+MAIN_BRUSH_MOTOR_CURRENT = 56
+SIDE_BRUSH_MOTOR_CURRENT = 57
+STASIS = 58
 
 # others just for easy access to particular parts of the data
 POSE = 100
@@ -151,8 +170,22 @@ RIGHT_WHEEL_OVERCURRENT = 107
 ADVANCE_BUTTON = 108
 PLAY_BUTTON = 109
 
-#                    0 1 2 3 4 5 6 7 8 9101112131415161718192021222324252627282930313233343536373839404142434445464748495051
-SENSOR_DATA_WIDTH = [0,0,0,0,0,0,0,1,1,1,1,1,1,1,1,1,1,1,1,2,2,1,2,2,1,2,2,2,2,2,2,2,1,2,1,1,1,1,1,2,2,2,2,2,2,1,2,2,2,2,2,2]
+# the packet ids the robot answers with for the group packets 0-6 and
+# the Create 2 groups 100-107. sensors() takes these numbers alone, as
+# a frame; in a list, 100-109 are the aliases above (POSE, ...).
+SENSOR_GROUPS = {
+    0: range(7, 27),
+    1: range(7, 17),
+    2: range(17, 21),
+    3: range(21, 27),
+    4: range(27, 35),
+    5: range(35, 43),
+    6: range(7, 43),
+    100: range(7, 59),
+    101: range(43, 59),
+    106: range(46, 52),
+    107: range(54, 59),
+}
 
 # Distance between wheels in mm. The Create 2 spec says 235mm.
 # To calibrate for your specific robot: have it spin 360 degrees and
@@ -163,6 +196,27 @@ WHEEL_DIAMETER = 72.0
 TICK_PER_REVOLUTION = 508.8 # original 508.8
 TICK_PER_MM = TICK_PER_REVOLUTION/(math.pi*WHEEL_DIAMETER)
 
+# odometry steps getPoseAt can always look back over
+POSE_HISTORY_LENGTH = 4096
+
+# how long a new connection waits for the robot to answer, and how
+# often it asks
+READY_TIMEOUT = 1.0
+READY_PROBE_INTERVAL = 0.05
+
+# how long toSafeMode/toFullMode wait for the robot to report the new mode
+MODE_TIMEOUT = 0.5
+
+# how long a reply may take to start coming back: the robot's turnaround
+# plus a USB adapter's latency timer (16 ms on FTDI parts). The time the
+# reply itself spends on the wire is added per read; see _replyTimeout
+REPLY_LATENCY = 0.05
+
+# how many sensor requests sensors_many keeps in flight. The OI takes
+# requests from a small input buffer one at a time, so a few queued
+# behind the one being answered keep the link busy
+PIPELINE_DEPTH = 4
+
 # for printing the SCI modes
 def modeStr( mode ):
     """ prints a string representing the input SCI mode """
@@ -256,6 +310,33 @@ def _toTwosComplement2Bytes( value ):
 
     return ( (eqBitVal >> 8) & 0xFF, eqBitVal & 0xFF )
 
+
+def _interpolatePose( pose0, pose1, alpha ):
+    """ the pose a fraction alpha of the way from pose0 to pose1 along
+    the constant-curvature arc joining them (SE(2) interpolation);
+    poses are (x, y, th)
+    """
+    x0, y0, th0 = pose0
+    x1, y1, th1 = pose1
+    dth = math.atan2(math.sin(th1 - th0), math.cos(th1 - th0))
+    # the step in pose0's frame
+    c = math.cos(th0); s = math.sin(th0)
+    dx = c*(x1 - x0) + s*(y1 - y0)
+    dy = -s*(x1 - x0) + c*(y1 - y0)
+    phi = alpha * dth
+    if abs(dth) < 1e-9:
+        tx = alpha * dx; ty = alpha * dy
+    else:
+        # the arc's translational velocity, then a fraction of the arc
+        a = math.sin(dth)/dth; b = (1 - math.cos(dth))/dth
+        det = a*a + b*b
+        ux = (a*dx + b*dy)/det; uy = (-b*dx + a*dy)/det
+        a = math.sin(phi)/dth; b = (1 - math.cos(phi))/dth
+        tx = a*ux - b*uy; ty = b*ux + a*uy
+    th = th0 + phi
+    return (x0 + c*tx - s*ty, y0 + s*tx + c*ty, math.atan2(math.sin(th), math.cos(th)))
+
+
 #
 # this class represents a snapshot of the robot's data
 #
@@ -444,6 +525,163 @@ class SensorFrame:
 
 
 
+class SensorQuery:
+    """ a sensor request sent with Create.submit_query
+
+    done becomes True once process_io has decoded the reply into
+    sensord, or given up on it after timeout seconds, in which case
+    timedOut is True as well
+    """
+
+    __slots__ = ('packets', 'size', 'deadline', 'callback', 'done', 'timedOut')
+
+    def __init__(self, packets, size, deadline, callback):
+        self.packets = packets      # None: the reply is read but not decoded
+        self.size = size
+        self.deadline = deadline
+        self.callback = callback
+        self.done = False
+        self.timedOut = False
+
+
+# the composite ids sensors() accepts, and the packets that carry them
+_SENSOR_ALIASES = ((POSE, (DISTANCE, ANGLE)),) + tuple(
+    (sensornum, (packet,)) for sensornum, _, _, packet, _ in BITS)
+
+
+def _expandAliases( sensor_ids ):
+    """ returns a new list of sensor_ids with the composite aliases
+    (POSE, LEFT_BUMP, ...) replaced by the packets that carry them
+    """
+    packets = list(sensor_ids)
+    for alias, carriers in _SENSOR_ALIASES:
+        if alias in packets:
+            packets = [p for p in packets if p != alias]
+            for carrier in carriers:
+                if carrier not in packets:
+                    packets.append(carrier)
+    return packets
+
+
+class QueryPlan:
+    """ everything a sensor query needs that depends only on what is
+    asked for: the packets the robot sends back, the request that asks
+    for them, the reply length and the decoder for the reply
+    """
+
+    __slots__ = ('packets', 'request', 'size', 'decoder')
+
+    def __init__(self, packets, request):
+        self.packets = packets
+        self.request = request
+        self.decoder = compileDecoder(packets)
+        self.size = self.decoder.size
+
+    def wireBytes(self):
+        """ the bytes on the wire, request plus reply """
+        return len(self.request) + self.size
+
+    def wireTime(self, baudRate):
+        """ the seconds the request and reply take at baudRate
+        (10 bits per byte)
+        """
+        return self.wireBytes() * 10.0 / baudRate
+
+
+def _replyWidth( packet ):
+    """ the reply bytes of a packet id, counting groups as their members """
+    if packet in SENSOR_GROUPS:
+        return sum(SENSOR_DATA_WIDTH[p] for p in SENSOR_GROUPS[packet])
+    if packet < len(SENSOR_DATA_WIDTH):
+        return SENSOR_DATA_WIDTH[packet]
+    return 0
+
+
+def _requestFor( ids ):
+    """ the request for a list of packet ids: SENSORS for a lone
+    group, QUERYLIST otherwise
+    """
+    if len(ids) == 1 and ids[0] in SENSOR_GROUPS:
+        return SENSORS + bytes(ids)
+    return QUERYLIST + bytes([len(ids)]) + bytes(ids)
+
+
+# packets the robot zeroes each time it sends them
+_RESET_ON_READ = frozenset((DISTANCE, ANGLE))
+
+
+def _cheapestIds( packets ):
+    """ the packet ids to ask for to get every one of packets back with
+    the fewest request-plus-reply bytes: packets itself, or some group
+    packets plus the packets they leave out. Groups also send packets
+    nobody asked for, so they only win when those cost less than the
+    id bytes they save. Ties go to packets as given. A group that would
+    read DISTANCE or ANGLE unasked is never used: reading them clears
+    the robot's counters, and the odometry would lose that motion.
+    """
+    wanted = set(packets)
+    candidates = [g for g in SENSOR_GROUPS
+                  if wanted.intersection(SENSOR_GROUPS[g])
+                  and wanted.issuperset(_RESET_ON_READ.intersection(SENSOR_GROUPS[g]))]
+    best = list(packets)
+    bestCost = len(_requestFor(best)) + sum(_replyWidth(p) for p in best)
+    for n in range(1, len(candidates) + 1):
+        for groups in itertools.combinations(candidates, n):
+            covered = set()
+            for g in groups:
+                covered.update(SENSOR_GROUPS[g])
+            ids = list(groups) + [p for p in packets if p not in covered]
+            cost = len(_requestFor(ids)) + sum(_replyWidth(p) for p in ids)
+            if cost < bestCost:
+                best, bestCost = ids, cost
+    return best
+
+
+@functools.lru_cache(maxsize=256)
+def _listPlan( sensor_ids ):
+    ids = _cheapestIds(_expandAliases(sensor_ids))
+    packets = []
+    for p in ids:
+        packets.extend(SENSOR_GROUPS.get(p, (p,)))
+    return QueryPlan(tuple(packets), _requestFor(ids))
+
+
+def _byteRanges( layout, packets ):
+    """ where each of packets sits in a reply laid out as layout: a list
+    of (start, end) byte ranges, or None if layout lacks one of them
+    """
+    offsets = {}
+    offset = 0
+    for sensornum in layout:
+        offsets.setdefault(sensornum, offset)
+        offset += SENSOR_DATA_WIDTH[sensornum]
+    ranges = []
+    for sensornum in packets:
+        if sensornum not in offsets:
+            return None
+        start = offsets[sensornum]
+        ranges.append((start, start + SENSOR_DATA_WIDTH[sensornum]))
+    return ranges
+
+
+@functools.lru_cache(maxsize=None)
+def _groupPlan( frameNumber ):
+    return QueryPlan(tuple(SENSOR_GROUPS[frameNumber]), SENSORS + bytes([frameNumber]))
+
+
+def queryPlan( list_of_sensors_to_poll=6 ):
+    """ the cached QueryPlan for a sensors() argument: a list (or tuple)
+    of sensor ids and aliases, or a group packet number. A list is asked
+    for with whatever mix of group packets and single packets puts the
+    fewest bytes on the wire (see _cheapestIds).
+    """
+    if isinstance(list_of_sensors_to_poll, (list, tuple)):
+        return _listPlan(tuple(list_of_sensors_to_poll))
+    if list_of_sensors_to_poll not in SENSOR_GROUPS:
+        list_of_sensors_to_poll = 6
+    return _groupPlan(list_of_sensors_to_poll)
+
+
 #
 # the robot class
 #
@@ -461,8 +699,31 @@ class Create:
         """ the constructor which tries to open the
         connection to the robot at port PORT.
         If PORT is None, auto-detect the serial port.
+        PORT may also be a transport URL (socket://host:port,
+        posix:/dev/ttyUSB0, loop://) or an already open transport
+        object such as a LoopbackTransport.
         """
         _debug = False
+        self._openPort(PORT, BAUD_RATE)
+        self._initState(BAUD_RATE)
+
+        # go to passive mode - want to do this regardless of the
+        # final mode we'd like to be in...
+        self._waitReady()
+
+        if (startingMode == SAFE_MODE):
+            print('Putting the robot into safe mode...')
+            self.toSafeMode()
+
+        if (startingMode == FULL_MODE):
+            print('Putting the robot into full mode...')
+            self.toFullMode()
+
+        self.setPose(0,0,0)
+
+    def _openPort(self, PORT, BAUD_RATE):
+        """ opens self.ser from the PORT given to the constructor """
+        self._emulator = None
 
         if PORT is None:
             PORT = find_port()
@@ -471,18 +732,24 @@ class Create:
         if isinstance(PORT, str):
             if PORT == 'sim':
                 print('In simulated mode...')
-                self.ser = 'sim'; # SRSerial('mapSquare.txt')
+                from .emulator import PtyEmulator
+                self._emulator = PtyEmulator().start()
+                self.ser = openTransport(self._emulator.path, baudrate=BAUD_RATE, timeout=0.5)
             else:
-                # for Mac/Linux - use whole port name
+                # for Mac/Linux - use whole port name, or a
+                # socket://, posix: or loop:// transport URL
                 # print 'In Mac/Linux mode...'
-                self.ser = serial.Serial(PORT, baudrate=BAUD_RATE, timeout=0.5)
+                self.ser = openTransport(PORT, baudrate=BAUD_RATE, timeout=0.5)
         # otherwise, we try to open the numeric serial port...
-        else:
+        elif isinstance(PORT, int):
             # print 'In Windows mode...'
             self.ser = serial.Serial(PORT-1, baudrate=BAUD_RATE, timeout=0.5)
+        # or it is already an open transport (see transport.py)
+        else:
+            self.ser = PORT
 
         # did the serial port actually open?
-        if self.ser != 'sim' and self.ser.isOpen():
+        if self.ser.isOpen():
             print('Serial port did open, presumably to a roomba...')
         else:
             print('Serial port did NOT open, check the')
@@ -493,11 +760,61 @@ class Create:
             print('              of the default 57600 - removing and')
             print('              reinstalling the battery should reset it.')
 
-        # our OI mode
+    def _initState(self, BAUD_RATE):
+        """ sets up the mode, sensor, stream and odometry state
+        of a freshly opened connection
+        """
+        # our OI mode: the one last commanded, and the one the robot
+        # last reported in OI_MODE (None until it has)
         self.sciMode = OFF_MODE
+        self.reportedMode = None
+        self._modeCallback = None
 
         # our sensor dictionary, currently empty
-        self.sensord = {}
+        self.sensord = SensorSnapshot()
+
+        # outgoing bytes are combined here while a batch() is open
+        self._wbuf = bytearray()
+        self._batchDepth = 0
+        # packs the high-rate commands without allocating; one
+        # CommandEncoder per thread (see _encoder)
+        self._encoders = threading.local()
+
+        # STREAM state; see startStream
+        self.baudRate = BAUD_RATE
+        self._streaming = False
+        self._streamThread = None
+        self._streamCallback = None
+        self._streamLazy = False
+        self._streamParser = StreamParser(SENSOR_DATA_WIDTH)
+        self._streamGeneration = 0
+        self._streamLock = threading.Lock()
+        self._sensorLock = threading.Lock()
+
+        # submit_query/process_io state: bytes received but not yet
+        # used, and the queries waiting for them, oldest first
+        self._rx = bytearray()
+        self._pending = collections.deque()
+        # after a query times out, what is left of its reply may still
+        # come: until _staleUntil whatever arrives is thrown away, and
+        # requests submitted meanwhile wait in _held
+        self._staleUntil = None
+        self._held = collections.deque()
+
+        # replies to sensors() and friends are given up on after
+        # _replyTimeout; raise replyLatency for slow links (TCP, radios).
+        # shortReplies counts the replies that came back incomplete
+        self.replyLatency = REPLY_LATENCY
+        self.shortReplies = 0
+
+        # the optional port-owning thread; see startIOThread
+        self._ioThread = None
+
+        # the optional SensorHistory; see enableHistory. Replies laid
+        # out differently from it are cut down to its packets with the
+        # byte ranges kept here per layout
+        self.history = None
+        self._historyRanges = {}
 
         # here are the variables that constitute the robot's
         # estimated odometry, thr is theta in radians...
@@ -510,33 +827,129 @@ class Create:
         self.leftEncoder_old = -1
         self.rightEncoder_old = -1
 
-        time.sleep(0.3)
-        self._start()  # go to passive mode - want to do this
-        # regardless of the final mode we'd like to be in...
-        time.sleep(0.3)
+        # (time.monotonic(), x, y, th) after each odometry step, oldest
+        # first, for getPoseAt; at most 2 * POSE_HISTORY_LENGTH entries
+        self._poseTimes = []
+        self._poses = []
+        self._poseLock = threading.Lock()
 
-        if (startingMode == SAFE_MODE):
-            print('Putting the robot into safe mode...')
-            self.toSafeMode()
+    _debug = False
 
-        if (startingMode == FULL_MODE):
-            print('Putting the robot into full mode...')
-            self.toSafeMode()
-            time.sleep(0.3)
-            self.toFullMode()
+    def _write(self, data):
+        """ sends one complete OI command (opcode plus payload) in
+        a single write, or holds it until the enclosing batch() ends
+        """
+        if self._debug:
+            print(list(data))
+        if self._batchDepth > 0:
+            self._wbuf += data
+        else:
+            self._flush()
+            self._send(data)
 
-        # We need to read the angle and distance sensors so that
-        # their values clear out!
-        time.sleep(0.25)
-        #self.sensors(6) # read all sensors to establish the sensord dictionary
-        self.setPose(0,0,0)
+    def _encoder(self):
+        """ the calling thread's CommandEncoder. An encoded command is a
+        view of the encoder's buffer until its next command, so threads
+        driving the robot at once must not share one.
+        """
+        try:
+            return self._encoders.encoder
+        except AttributeError:
+            encoder = self._encoders.encoder = CommandEncoder()
+            return encoder
+
+    def _flush(self):
+        """ writes out anything combined so far by batch() """
+        if self._wbuf:
+            data = bytes(self._wbuf)
+            del self._wbuf[:]
+            self._send(data)
+
+    def _send(self, data):
+        """ hands finished bytes to the port, or to the I/O thread's
+        queue while one is running (see startIOThread)
+        """
+        if self._ioThread is not None:
+            self._ioThread.submit(data)
+        else:
+            if self._staleUntil is not None:
+                self._settle()
+            self.ser.write(data)
 
-    _debug = False
+    def _settle(self):
+        """ waits out the rest of a timed-out reply (see _completeQueries)
+        so that a request sent now is not answered into its leftovers
+        """
+        time.sleep(max(0.0, self._staleUntil - time.monotonic()))
+        self._drainStale()
+
+    def _read(self, size):
+        """ reads a reply of size bytes, making sure its request went
+        out first. Gives up once the reply is overdue (_replyTimeout)
+        rather than after the port's timeout; a short reply is returned
+        as it is and the rest of it dropped (_resync), so that the next
+        reply starts on its own first byte.
+        """
+        r = self._readWithin(size, self._replyTimeout(size))
+        if len(r) < size:
+            self._resync(size - len(r))
+        return r
 
-    def _write(self, byte):
-        if self._debug:
-            print(byte[0])
-        self.ser.write(byte)
+    def _readWithin(self, size, timeout):
+        """ reads up to size bytes, making sure their request went out
+        first, and waiting at most timeout seconds for them
+        """
+        if self._pending or self._held:
+            # replies to submitted queries come first
+            self._finishQueries()
+        self._flush()
+        self._setPortTimeout(timeout)
+        return self.ser.read(size=size)
+
+    def _setPortTimeout(self, timeout):
+        if self.ser.timeout != timeout:
+            # reconfigures a real port, so only when it changes
+            self.ser.timeout = timeout
+
+    def _replyTimeout(self, size):
+        """ the seconds a reply of size bytes may take: replyLatency
+        plus 10 bits a byte at baudRate, rounded up to 10 ms so that
+        replies of similar length leave the port's timeout alone
+        """
+        seconds = self.replyLatency + size * 10.0 / self.baudRate
+        return math.ceil(seconds * 100) / 100.0
+
+    def _resync(self, missing):
+        """ called after a reply came back missing bytes. If they were
+        only late they arrive within one more reply timeout; they and
+        anything else received so far are thrown away. If they were lost
+        this costs that one timeout. Either way the next request's reply
+        is read from its first byte instead of from the tail of this one.
+        """
+        self.shortReplies += 1
+        if self._debug: print('Short reply,', missing, 'bytes missing; resynchronizing')
+        self.ser.read(size=missing)
+        self.ser.reset_input_buffer()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """ combines every command issued inside the with-block
+        into a single write to the serial port, e.g.
+
+            with robot.batch():
+                robot.go_differential(10, 0)
+                robot.motors(0, 1, 1)
+
+        batches may be nested; the bytes go out when the outermost
+        one ends. Sensor reads inside a batch flush it first.
+        """
+        self._batchDepth += 1
+        try:
+            yield self
+        finally:
+            self._batchDepth -= 1
+            if self._batchDepth == 0:
+                self._flush()
 
     def getPose(self, dist='cm'):
         """ getPose returns the current estimate of the
@@ -568,6 +981,7 @@ class Create:
             self.xPose = x; self.yPose = y
 
         self.thrPose = th
+        self._recordPose()
 
 
     def resetPose(self):
@@ -590,6 +1004,7 @@ class Create:
         if self.leftEncoder_old == -1:
             self.leftEncoder_old = self.leftEncoder
             self.rightEncoder_old = self.rightEncoder
+            self._recordPose()
             return
         left_diff  = self._getEncoderDelta(self.leftEncoder_old,self.leftEncoder)
         right_diff = self._getEncoderDelta(self.rightEncoder_old,self.rightEncoder)
@@ -611,6 +1026,44 @@ class Create:
 
         self.leftEncoder_old = self.leftEncoder
         self.rightEncoder_old = self.rightEncoder
+        self._recordPose()
+
+    def _recordPose(self):
+        """ adds the current pose to the history getPoseAt searches """
+        with self._poseLock:
+            times = self._poseTimes
+            if len(times) >= 2 * POSE_HISTORY_LENGTH:
+                del times[:POSE_HISTORY_LENGTH]
+                del self._poses[:POSE_HISTORY_LENGTH]
+            self._poses.append((self.xPose, self.yPose, self.thrPose))
+            times.append(time.monotonic())
+
+    def getPoseAt(self, t, dist='cm'):
+        """ the estimated pose at time t (on the time.monotonic()
+        clock), interpolated along the arc between the odometry steps
+        on either side of it. Times before the oldest step kept (the
+        last POSE_HISTORY_LENGTH or more) or after the newest one get
+        the pose of that step.
+        dist may be 'cm' or 'mm'; angle is in radians
+        """
+        with self._poseLock:
+            times = self._poseTimes
+            i = bisect.bisect_right(times, t)
+            if not times:
+                pose = (self.xPose, self.yPose, self.thrPose)
+            elif i == 0:
+                pose = self._poses[0]
+            elif i == len(times):
+                pose = self._poses[-1]
+            else:
+                t0 = times[i-1]
+                t1 = times[i]
+                pose = _interpolatePose(self._poses[i-1], self._poses[i],
+                                        (t - t0) / (t1 - t0) if t1 > t0 else 1.0)
+        x, y, th = pose
+        if dist == 'cm':
+            return (x/10.0, y/10.0, th)
+        return (x, y, th)
 
 
     def _integrateNextOdometricStepCreate(self, distance, rawAngle):
@@ -621,7 +1074,8 @@ class Create:
             in mm. Convert to radians via: angle_rad = 2 * rawAngle / WHEEL_SPAN
         to the estimate of the robot's global pose
 
-        NOTE: This method is currently unused (commented out in _readSensorList).
+        NOTE: This method is currently unused (the sensor decoders in
+        decoders.py do not call it).
         The active odometry path uses _integrateNextEncoderStep instead.
         """
         if distance == 0 and rawAngle == 0:
@@ -678,19 +1132,8 @@ class Create:
         left_cm_sec:  left  wheel velocity in cm/sec (capped at +- 50)
         right_cm_sec: right wheel velocity in cm/sec (capped at +- 50)
         """
-        if left_cm_sec < -50: left_cm_sec = -50;
-        if left_cm_sec > 50:  left_cm_sec = 50;
-        if right_cm_sec < -50: right_cm_sec = -50;
-        if right_cm_sec > 50: right_cm_sec = 50;
-        # convert to mm/sec, ensure we have integers
-        leftHighVal, leftLowVal = _toTwosComplement2Bytes( int(left_cm_sec*10) )
-        rightHighVal, rightLowVal = _toTwosComplement2Bytes( int(right_cm_sec*10) )
-        # send these bytes and set the stored velocities
-        self._write( DRIVEDIRECT )
-        self._write( bytes([rightHighVal]) )
-        self._write( bytes([rightLowVal]) )
-        self._write( bytes([leftHighVal]) )
-        self._write( bytes([leftLowVal]) )
+        # convert to mm/sec; the encoder caps them at +-500
+        self._write( self._encoder().drive_direct( left_cm_sec*10, right_cm_sec*10 ) )
 
     def stop(self):
         """ stop calls go_differential(0,0) """
@@ -699,28 +1142,10 @@ class Create:
         foo = self.sensors([POSE])
 
     def motors ( self, side_brush = 0, main_brush = 0, vacuum = 0):
-        if (side_brush > 1):
-            side_brush = 1
-        elif (side_brush < -1):
-            side_brush = -1
-
-        if (main_brush > 1):
-            main_brush = 1
-        elif (main_brush < -1):
-            main_brush = -1
-
-        if (vacuum > 1):
-            vacuum = 1
-        elif (vacuum < 0):
-            vacuum = 0
-
-        byteToWrite = bytes([(16 if main_brush < 0  else 0) |
-                     (8  if side_brush < 0  else 0) |
-                     (4  if main_brush != 0 else 0) |
-                     (2  if vacuum != 0     else 0) |
-                     (1  if side_brush > 0  else 0)])
-        self._write( MOTORS )
-        self._write( byteToWrite)
+        """ side_brush and main_brush: -1 (reverse), 0 (off), 1 (forward)
+        vacuum: 0 (off) or 1 (on)
+        """
+        self._write( self._encoder().motors( side_brush, main_brush, vacuum ) )
 
     def go_differential( self, cm_per_sec=0, rad_per_sec=0 ):
         """ go_differential(cm_per_sec, rad_per_sec) sets the robot's velocity to
@@ -763,11 +1188,39 @@ class Create:
     def _start(self):
         """ changes from OFF_MODE to PASSIVE_MODE """
         self._write( START )
-        # they recommend 20 ms between mode-changing commands
-        time.sleep(0.25)
         # change the mode we think we're in...
+        self.sciMode = PASSIVE_MODE
+        # they recommend 20 ms between mode-changing commands
+        time.sleep(0.02)
         return
 
+    def _waitReady(self, timeout=READY_TIMEOUT):
+        """ sends START and asks for OI_MODE every READY_PROBE_INTERVAL
+        until the robot answers, for at most timeout seconds. Returns
+        the mode it reported (also kept in sciMode), or None if it
+        never answered.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            # a late answer to an earlier probe is as good as any
+            asked = time.monotonic()
+            self._write( START + SENSORS + bytes([OI_MODE]) )
+            r = self._readWithin(1, READY_PROBE_INTERVAL)
+            if len(r) == 1:
+                # anything after the answer is stale
+                self.ser.reset_input_buffer()
+                if r[0] <= FULL_MODE:
+                    self.sciMode = self.reportedMode = r[0]
+                    return r[0]
+                return None
+            now = time.monotonic()
+            if now >= deadline:
+                print('The robot did not answer within', timeout, 'seconds;')
+                print('  carrying on as if it had.')
+                return None
+            # for ports that give up without waiting
+            time.sleep(max(0.0, asked + READY_PROBE_INTERVAL - now))
+
     def close(self):
         """ tries to shutdown the robot as kindly as possible, by
         clearing any remaining odometric data
@@ -775,6 +1228,8 @@ class Create:
         closing the serial port
         """
         # is there other clean up to be done?
+        self.stopStream()
+        self.stopIOThread()
         # let's get rid of any lingering odometric data
         # we don't call getSensorList, because we don't want to integrate the odometry...
         self._getRawSensorDataAsList( [19,20] )
@@ -782,6 +1237,8 @@ class Create:
         self._start()       # send Create back to passive mode
         time.sleep(0.1)
         self.ser.close()
+        if self._emulator is not None:
+            self._emulator.stop()
         return
 
     def _closeSer(self):
@@ -802,47 +1259,10 @@ class Create:
         other drive-related calls are available
         """
 
-        # first, they should be ints
-        #   in case they're being generated mathematically
-        if not isinstance(roomba_mm_sec, int):
-            roomba_mm_sec = int(roomba_mm_sec)
-        if not isinstance(roomba_radius_mm, int):
-            roomba_radius_mm = int(roomba_radius_mm)
-
-        # we check that the inputs are within limits
-        # if not, we cap them there
-        if roomba_mm_sec < -500:
-            roomba_mm_sec = -500
-        if roomba_mm_sec > 500:
-            roomba_mm_sec = 500
-
-        # if the radius is beyond the limits, we go straight
-        # it doesn't really seem to go straight, however...
-        if roomba_radius_mm < -2000:
-            roomba_radius_mm = 32768
-        if roomba_radius_mm > 2000:
-            roomba_radius_mm = 32768
-        # get the two bytes from the velocity
-        # these come back as numbers, so we will chr them
-        velHighVal, velLowVal = _toTwosComplement2Bytes( roomba_mm_sec )
-
-        # get the two bytes from the radius in the same way
-        # note the special cases
-        if roomba_radius_mm == 0:
-            if turn_dir == 'CW':
-                roomba_radius_mm = -1
-            else: # default is 'CCW' (turning left)
-                roomba_radius_mm = 1
-        radiusHighVal, radiusLowVal = _toTwosComplement2Bytes( roomba_radius_mm )
-
-        #print 'bytes are', velHighVal, velLowVal, radiusHighVal, radiusLowVal
-
-        # send these bytes and set the stored velocities
-        self._write( DRIVE )
-        self._write( bytes([velHighVal]) )
-        self._write( bytes([velLowVal]) )
-        self._write( bytes([radiusHighVal]) )
-        self._write( bytes([radiusLowVal]) )
+        # the encoder makes them ints and caps them: +-500 mm/sec,
+        # and a radius beyond +-2000 mm means go straight
+        # (it doesn't really seem to go straight, however...)
+        self._write( self._encoder().drive( roomba_mm_sec, roomba_radius_mm, turn_dir ) )
 
 
     def setLEDs(self, power_color, power_intensity, play, advance ):
@@ -854,8 +1274,6 @@ class Create:
         should either be 0 (off) or 1 (on).
         """
         # make sure we're within range...
-        if advance != 0: advance = 1
-        if play != 0: play = 1
         try:
             power = int(power_intensity)
             powercolor = int(power_color)
@@ -864,20 +1282,9 @@ class Create:
             powercolor = 128
             print('Type exception caught in setAbsoluteLEDs in roomba.py')
             print('Your power_color or power_intensity was not of type int.')
-        if power < 0: power = 0
-        if power > 255: power = 255
-        if powercolor < 0: powercolor = 0
-        if powercolor > 255: powercolor = 255
-        # create the first byte
-        #firstByteVal = (status << 4) | (spot << 3) | (clean << 2) | (max << 1) | dirtdetect
-        firstByteVal =  (advance << 3) | (play << 1)
-
-        # send these as bytes
-        # print 'bytes are', firstByteVal, powercolor, power
-        self._write( LEDS )
-        self._write( bytes([firstByteVal]) )
-        self._write( bytes([powercolor]) )
-        self._write( bytes([power]) )
+        # the encoder caps power and powercolor to 0-255 and builds
+        # the first byte: (advance << 3) | (play << 1)
+        self._write( self._encoder().leds( powercolor, power, play, advance ) )
 
         return
 
@@ -896,26 +1303,12 @@ class Create:
         if not isinstance(packetnumber, int):
             packetnumber = 6
 
-        if packetnumber < 0 or packetnumber > 6:
+        if packetnumber not in SENSOR_GROUPS:
             packetnumber = 6
 
-        self._write( SENSORS )
-        self._write( bytes([packetnumber]) )
-
-        if packetnumber == 0:
-            r = self.ser.read(size=26)
-        if packetnumber == 1:
-            r = self.ser.read(size=10)
-        if packetnumber == 2:
-            r = self.ser.read(size=6)
-        if packetnumber == 3:
-            r = self.ser.read(size=10)
-        if packetnumber == 4:
-            r = self.ser.read(size=14)
-        if packetnumber == 5:
-            r = self.ser.read(size=12)
-        if packetnumber == 6:
-            r = self.ser.read(size=52)
+        self._write( SENSORS + bytes([packetnumber]) )
+
+        r = self._read(_replyWidth(packetnumber))
 
         r = list(r)   # bytes iteration already yields ints in Python 3
         return r
@@ -927,14 +1320,12 @@ class Create:
         needs to be converted to integers...
         """
         numberOfSensors = len(listofsensors)
-        self._write( QUERYLIST )
-        self._write( bytes([numberOfSensors]) )
         resultLength = 0
         for sensornum in listofsensors:
-            self._write( bytes([sensornum]) )
             resultLength += SENSOR_DATA_WIDTH[sensornum]
+        self._write( QUERYLIST + bytes([numberOfSensors]) + bytes(listofsensors) )
 
-        r = self.ser.read(size=resultLength)
+        r = self._read(resultLength)
         r = list(r)   # bytes iteration already yields ints in Python 3
         #print 'r is ', r
         return r
@@ -969,12 +1360,11 @@ class Create:
         if (demoNumber < -1 or demoNumber > 9):
             demoNumber = -1 # stop current demo
 
-        self._write( DEMO )
         if demoNumber < 0 or demoNumber > 9:
             # invalid values are equivalent to stopping
-            self._write( bytes([255]) ) # -1
+            self._write( DEMO + bytes([255]) ) # -1
         else:
-            self._write( bytes([demoNumber]) )
+            self._write( DEMO + bytes([demoNumber]) )
 
 
     def setSong(self, songNumber, songDataList):
@@ -996,27 +1386,9 @@ class Create:
             print('No data in the songDataList')
             return
 
-        if songNumber < 0: songNumber = 0
-        if songNumber > 15: songNumber = 15
-
-        # indicate that a song is coming
-        self._write( SONG )
-        self._write( bytes([songNumber]) )
-
-        L = min(len(songDataList), 16)
-        self._write( bytes([L]) )
-
-        # loop through the notes, up to 16
-        for note in songDataList[:L]:
-            # make sure its a tuple, or else we rest for 1/4 second
-            if isinstance(note, tuple):
-                #more error checking here!
-                self._write( bytes([note[0]]) )  # note number
-                self._write( bytes([note[1]]) )  # duration
-            else:
-                self._write( bytes([30]) )   # a rest note
-                self._write( bytes([16]) )   # 1/4 of a second
-
+        # the encoder caps songNumber to 0-15, stores up to 16 notes
+        # and turns anything that is not a tuple into a 1/4 second rest
+        self._write( self._encoder().song( songNumber, songDataList ) )
         return
 
 
@@ -1035,8 +1407,7 @@ class Create:
         if songNumber < 0: songNumber = 0
         if songNumber > 15: songNumber = 15
 
-        self._write( PLAY )
-        self._write( bytes([songNumber]) )
+        self._write( PLAY + bytes([songNumber]) )
 
 
     def playNote(self, noteNumber, duration, songNumber=0):
@@ -1049,57 +1420,26 @@ class Create:
         self.playSongNumber(songNumber)
 
 
-    def _getLower5Bits( self, r ):
-        """ r is one byte as an integer """
-        return [ _bitOfByte(4,r), _bitOfByte(3,r), _bitOfByte(2,r), _bitOfByte(1,r), _bitOfByte(0,r) ]
-
-    def _getOneBit( self, r ):
-        """ r is one byte as an integer """
-        if r == 1:  return 1
-        else:       return 0
-
-    def _getOneByteUnsigned( self, r ):
-        """ r is one byte as an integer """
-        return r
-
-    def _getOneByteSigned( self, r ):
-        """ r is one byte as a signed integer """
-        return _twosComplementInt1byte( r )
-
-    def _getTwoBytesSigned( self, r1, r2 ):
-        """ r1, r2 are two bytes as a signed integer """
-        return _twosComplementInt2bytes( r1, r2 )
-
-    def _getTwoBytesUnsigned( self, r1, r2 ):
-        """ r1, r2 are two bytes as an unsigned integer """
-        return r1 << 8 | r2
-
-    def _getButtonBits( self, r ):
-        """ r is one byte as an integer """
-        return [ _bitOfByte(2,r), _bitOfByte(0,r) ]
-
-
     def _setNextDataFrame(self):
         """ This function _asks_ the robot to collect ALL of
         the sensor data into the next packet to send back.
         """
-        self._write( SENSORS )
-        self._write( bytes([6]) )
+        self._write( SENSORS + bytes([6]) )
 
     def _getNextDataFrame(self):
         """ This function then gets back ALL of
         the sensor data and organizes it into the sensor
         dictionary, sensord.
         """
-        r = self.ser.read(size=52)
+        r = self._read(52)
         r = list(r)   # bytes iteration already yields ints in Python 3
         #return self._readSensorList(r)
 
     def _rawSend( self, listofints ):
-        for x in listofints:
-            self._write( bytes([x]) )
+        self._write( bytes(listofints) )
 
     def _rawRecv( self ):
+        self._flush()
         nBytesWaiting = self.ser.inWaiting()
         #print 'nBytesWaiting is', nBytesWaiting
         r = self.ser.read(size=nBytesWaiting)
@@ -1108,6 +1448,7 @@ class Create:
         return r
 
     def _rawRecvStr( self ):
+        self._flush()
         nBytesWaiting = self.ser.inWaiting()
         #print 'nBytesWaiting is', nBytesWaiting
         r = self.ser.read(size=nBytesWaiting)
@@ -1119,317 +1460,625 @@ class Create:
         If none are requested, then all of the sensors are updated
         (which takes a bit more time...)
         """
-        if isinstance(list_of_sensors_to_poll, list):
-            # first, we change any pieces of sensor values to
-            # the single digit that is required here
-            distangle = 0
-            if POSE in list_of_sensors_to_poll:
-                list_of_sensors_to_poll.remove(POSE)
-                # should check if they're already there
-                list_of_sensors_to_poll.append(DISTANCE)
-                list_of_sensors_to_poll.append(ANGLE)
-
-            if LEFT_BUMP in list_of_sensors_to_poll:
-                list_of_sensors_to_poll.remove(LEFT_BUMP)
-                if BUMPS_AND_WHEEL_DROPS not in list_of_sensors_to_poll:
-                    list_of_sensors_to_poll.append(BUMPS_AND_WHEEL_DROPS)
-
-            if RIGHT_BUMP in list_of_sensors_to_poll:
-                list_of_sensors_to_poll.remove(RIGHT_BUMP)
-                if BUMPS_AND_WHEEL_DROPS not in list_of_sensors_to_poll:
-                    list_of_sensors_to_poll.append(BUMPS_AND_WHEEL_DROPS)
-
-            if RIGHT_WHEEL_DROP in list_of_sensors_to_poll:
-                list_of_sensors_to_poll.remove(RIGHT_WHEEL_DROP)
-                if BUMPS_AND_WHEEL_DROPS not in list_of_sensors_to_poll:
-                    list_of_sensors_to_poll.append(BUMPS_AND_WHEEL_DROPS)
-
-            if LEFT_WHEEL_DROP in list_of_sensors_to_poll:
-                list_of_sensors_to_poll.remove(LEFT_WHEEL_DROP)
-                if BUMPS_AND_WHEEL_DROPS not in list_of_sensors_to_poll:
-                    list_of_sensors_to_poll.append(BUMPS_AND_WHEEL_DROPS)
-
-            if CENTER_WHEEL_DROP in list_of_sensors_to_poll:
-                list_of_sensors_to_poll.remove(CENTER_WHEEL_DROP)
-                if BUMPS_AND_WHEEL_DROPS not in list_of_sensors_to_poll:
-                    list_of_sensors_to_poll.append(BUMPS_AND_WHEEL_DROPS)
-
-            if LEFT_WHEEL_OVERCURRENT in list_of_sensors_to_poll:
-                list_of_sensors_to_poll.remove(LEFT_WHEEL_OVERCURRENT)
-                if LSD_AND_OVERCURRENTS not in list_of_sensors_to_poll:
-                    list_of_sensors_to_poll.append(LSD_AND_OVERCURRENTS)
-
-            if RIGHT_WHEEL_OVERCURRENT in list_of_sensors_to_poll:
-                list_of_sensors_to_poll.remove(RIGHT_WHEEL_OVERCURRENT)
-                if LSD_AND_OVERCURRENTS not in list_of_sensors_to_poll:
-                    list_of_sensors_to_poll.append(LSD_AND_OVERCURRENTS)
-
-            if ADVANCE_BUTTON in list_of_sensors_to_poll:
-                list_of_sensors_to_poll.remove(ADVANCE_BUTTON)
-                if BUTTONS not in list_of_sensors_to_poll:
-                    list_of_sensors_to_poll.append(BUTTONS)
-
-            if PLAY_BUTTON in list_of_sensors_to_poll:
-                list_of_sensors_to_poll.remove(PLAY_BUTTON)
-                if BUTTONS not in list_of_sensors_to_poll:
-                    list_of_sensors_to_poll.append(BUTTONS)
-
-            r = self._getRawSensorDataAsList(list_of_sensors_to_poll)
+        if self._streaming:
+            # the reader thread keeps sensord up to date
+            return self.sensord
 
-        else:
-            # if it's an integer, its a frame number
-            r = self._getRawSensorFrameAsList( list_of_sensors_to_poll )
-            # now, we set list_of_sensors_to_poll
-            frameNumber = list_of_sensors_to_poll
-            if frameNumber == 0:
-                list_of_sensors_to_poll = list(range(7,27))
-            elif frameNumber == 1:
-                list_of_sensors_to_poll = list(range(7,17))
-            elif frameNumber == 2:
-                list_of_sensors_to_poll = list(range(17,21))
-            elif frameNumber == 3:
-                list_of_sensors_to_poll = list(range(21,27))
-            elif frameNumber == 4:
-                list_of_sensors_to_poll = list(range(27,35))
-            elif frameNumber == 5:
-                list_of_sensors_to_poll = list(range(35,43))
-            else:
-                list_of_sensors_to_poll = list(range(7,43))
+        if self._ioThread is not None:
+            # the I/O thread sends the request and decodes the reply
+            try:
+                return self._ioThread.query(list_of_sensors_to_poll).result()
+            except TimeoutError:
+                print('No reply from the robot to a sensor query')
+                return self.sensord
+
+        # a list of sensors or a frame number; the plan for it is
+        # worked out once and reused on every later poll
+        plan = queryPlan(list_of_sensors_to_poll)
+        self._write(plan.request)
+        r = self._read(plan.size)
 
         # change our dictionary
-        self._readSensorList(list_of_sensors_to_poll, r)
+        self._readSensorList(plan.packets, r, plan.decoder)
         return self.sensord
 
+    def readFrame( self, list_of_sensors_to_poll=6 ):
+        """ like sensors(), but returns the reply as a LazyFrame that
+        decodes each sensor the first time it is read, e.g.
+
+            frame = robot.readFrame(6)
+            frame[VOLTAGE], frame.leftBump, frame.raw
+
+        The odometry still follows the wheel encoders in the reply, but
+        sensord is not updated. Not available while streaming or with
+        the I/O thread running, and None as well if the reply came
+        back incomplete.
+        """
+        if self._streaming or self._ioThread is not None:
+            print('readFrame: the port is owned by the stream or the I/O thread')
+            return None
+        plan = queryPlan(list_of_sensors_to_poll)
+        self._write(plan.request)
+        r = self._read(plan.size)
+        if len(r) < plan.size:
+            # the bytes that did come may be from anywhere in the reply
+            if self._debug: print("Incomplete Sensor Packet")
+            return None
+        return self._lazyFrame(plan.decoder, r)
+
+    def enableHistory( self, list_of_sensors=6, capacity=4096 ):
+        """ starts keeping the last capacity replies to
+        list_of_sensors (a list or a frame number, as for sensors()),
+        whether polled or streamed, with their times and poses in a
+        NumPy ring buffer. Returns the SensorHistory, also kept as
+        self.history; see history.py. Needs NumPy.
+        Rows hold the packets as a stream of list_of_sensors sends them;
+        a polled reply with more packets in it (a group, say, that
+        was cheaper to ask for) is recorded with just those.
+        """
+        from .history import SensorHistory
+        if isinstance(list_of_sensors, (list, tuple)):
+            packets = _expandAliases(list_of_sensors)
+        else:
+            packets = queryPlan(list_of_sensors).packets
+        self._historyRanges = {}
+        self.history = SensorHistory(packets, capacity)
+        return self.history
+
+    def _recordHistory(self, packets, r, pose):
+        """ adds a complete reply laid out as packets to the history,
+        if it has every packet the history keeps
+        """
+        history = self.history
+        if packets != history.packets:
+            ranges = self._historyRanges.get(packets, False)
+            if ranges is False:
+                ranges = self._historyRanges[packets] = _byteRanges(packets, history.packets)
+            if ranges is None:
+                return
+            r = b''.join([r[start:end] for start, end in ranges])
+        history.append(time.monotonic(), r, pose)
+
+    def disableHistory(self):
+        """ stops recording; returns the SensorHistory, if any """
+        history = self.history
+        self.history = None
+        return history
+
+    def fileno(self):
+        """ the file descriptor of the port, so the robot can go in a
+        select/poll/epoll loop next to sockets and stdin
+        """
+        return self.ser.fileno()
+
+    def submit_query( self, list_of_sensors_to_poll=6, callback=None, timeout=0.5 ):
+        """ sends the same request sensors() would, without waiting for
+        the reply. Once process_io has read the reply, sensord is updated,
+        the returned SensorQuery is marked done and callback, if given,
+        is called with it. A reply that has not arrived after timeout
+        seconds (None waits forever) is given up on.
+        """
+        plan = queryPlan(list_of_sensors_to_poll)
+        return self._submit(plan.request, plan.packets, plan.size, callback, timeout)
+
+    def _submit( self, request, packets, size, callback=None, timeout=0.5 ):
+        if self._ioThread is not None:
+            # the thread starts the clock when the request goes out
+            query = SensorQuery(packets, size, timeout, callback)
+            self._flush()
+            self._ioThread.submitQuery(request, query)
+            return query
+        if self._staleUntil is not None:
+            # sent once the port is clear; the clock starts then
+            query = SensorQuery(packets, size, timeout, callback)
+            self._held.append((request, query))
+            return query
+        deadline = None if timeout is None else time.monotonic() + timeout
+        query = SensorQuery(packets, size, deadline, callback)
+        self._pending.append(query)
+        self._write(request)
+        return query
+
+    def _drainStale(self):
+        """ True once nothing more can come of the replies given up on:
+        the overdue window has passed, and whatever arrived is thrown
+        away. The requests held meanwhile are then sent.
+        """
+        if time.monotonic() < self._staleUntil:
+            return False
+        self._staleUntil = None
+        del self._rx[:]
+        self.ser.reset_input_buffer()
+        while self._held:
+            request, query = self._held.popleft()
+            if query.deadline is not None:
+                query.deadline += time.monotonic()
+            self._pending.append(query)
+            self._send(request)
+        return True
+
+    def process_io(self):
+        """ never blocks: reads whatever bytes the port already has,
+        finishes the submitted queries they answer and, while streaming
+        without a reader thread, decodes complete stream frames.
+        Call it whenever the port's fileno() is readable, and now and then
+        anyway so timeouts are noticed.
+        returns the list of queries finished by this call
+        """
+        if self._streamThread is not None or self._ioThread is not None:
+            # a reader or I/O thread owns the port
+            return []
+        self._flush()
+        n = self.ser.in_waiting
+        if n > 0:
+            self._rx += self.ser.read(n)
+        return self._completeQueries()
+
+    def _completeQueries(self):
+        """ hands the received bytes to the waiting queries in order;
+        bytes nobody is waiting for go to the stream parser if a stream
+        is running and are dropped otherwise
+        """
+        finished = []
+        rx = self._rx
+        pending = self._pending
+        if self._staleUntil is not None and not self._drainStale():
+            del rx[:]
+            return finished
+        lost = False
+        while pending:
+            query = pending[0]
+            if lost:
+                query.timedOut = True
+            elif len(rx) >= query.size:
+                if query.packets is not None:
+                    self._readSensorList(query.packets, rx[:query.size])
+                del rx[:query.size]
+            elif query.deadline is not None and time.monotonic() >= query.deadline:
+                # the reply is overdue. What is left of it may still come,
+                # ahead of the replies to the queries behind it, so those
+                # are given up on as well and everything that arrives
+                # until they would all be overdue is thrown away
+                self._staleUntil = time.monotonic() + self._replyTimeout(
+                    sum(q.size for q in pending))
+                del rx[:]
+                query.timedOut = True
+                lost = True
+            else:
+                break
+            pending.popleft()
+            query.done = True
+            finished.append(query)
+            if query.callback is not None:
+                query.callback(query)
+        if rx and not pending:
+            if self._streaming:
+                results = self._applyStreamFrames(self._streamParser.feed(rx))
+                if self._streamCallback is not None:
+                    for result in results:
+                        self._streamCallback(result)
+            del rx[:]
+        return finished
+
+    def _finishQueries(self):
+        """ blocks until every submitted query is done """
+        self._flush()
+        while self._pending or self._held:
+            self._completeQueries()
+            if self._pending or self._held:
+                self._receive(True)
+
+    def _receive(self, wait):
+        """ adds what has arrived of the submitted queries' replies to
+        _rx, first waiting up to the port's timeout for a byte if wait
+        """
+        data = self.ser.read(1) if wait else b''
+        self._rx += data
+        n = self.ser.in_waiting
+        if not self._streaming:
+            # what follows the last reply belongs to whoever
+            # reads next, not to the queries
+            n = min(n, sum(q.size for q in self._pending) - len(self._rx))
+        if n > 0:
+            self._rx += self.ser.read(n)
+
+    def sensors_many( self, n, interval=0.0, list_of_sensors_to_poll=6, depth=PIPELINE_DEPTH ):
+        """ polls list_of_sensors_to_poll (as for sensors()) n times,
+        a poll every interval seconds, or back to back if interval is 0.
+        Up to depth requests are kept in flight: another goes out as soon
+        as a reply is in, and replies are matched to requests in order
+        (see submit_query), so a burst runs at the speed of the link
+        rather than at one round trip per poll.
+        Returns a list of n SensorSnapshots, one per reply, with None
+        for the polls a lost byte may have spoiled.
+
+        Replies carry no sequence number, so a lost byte shifts every
+        reply behind it and is only noticed when a reply never completes,
+        at the latest at the end of the burst. The replies are then known
+        to be in step only up to the last time every request sent had its
+        reply and no byte was left over; the polls since come back None,
+        and the port is cleared before the next request goes out (see
+        _completeQueries). Back to back, that can be the whole burst.
+        Not available while streaming or with the I/O thread running
+        (returns []).
+        """
+        if self._streaming or self._ioThread is not None:
+            print('sensors_many: the port is owned by the stream or the I/O thread')
+            return []
+        plan = queryPlan(list_of_sensors_to_poll)
+        # a reply may have to wait behind all the others in flight
+        timeout = self._replyTimeout(plan.size * depth)
+        results = [None] * n
+        sent = 0
+        answered = 0
+        inStep = 0      # the replies to the polls before this one were in step
+        failing = False
+        start = time.monotonic()
+
+        def send():
+            """ sends the next poll if it is due and there is room """
+            nonlocal sent
+            if (sent < n and len(self._pending) + len(self._held) < depth
+                    and time.monotonic() >= start + sent * interval):
+                self._submit(plan.request, plan.packets, plan.size, keep, timeout)
+                sent += 1
+                return True
+            return False
+
+        def keep(query):
+            nonlocal answered, inStep, failing
+            if query.timedOut:
+                if not failing:
+                    self.shortReplies += 1
+                    failing = True
+                # which replies were shifted is unknown
+                for i in range(inStep, answered):
+                    results[i] = None
+                inStep = answered + 1
+            else:
+                failing = False
+                results[answered] = self.sensord.copy()
+                if not self._pending and not self._held and not self._rx:
+                    inStep = answered + 1
+                # top the pipeline up right away, not once the
+                # replies that came in with this one are read
+                send()
+            answered += 1
+
+        # replies to queries submitted before this come first
+        self._finishQueries()
+        self._setPortTimeout(timeout)
+        start = time.monotonic()
+        while sent < n or self._pending or self._held:
+            if send():
+                continue
+            due = start + sent * interval
+            canSend = sent < n and len(self._pending) + len(self._held) < depth
+            if self._pending:
+                # block for the replies only while there is nothing to send
+                self._receive(not canSend)
+                if canSend and not self._rx:
+                    time.sleep(max(0.0, min(due - time.monotonic(), 0.001)))
+            elif self._held:
+                # the port is being cleared after a lost reply
+                time.sleep(max(0.0, self._staleUntil - time.monotonic()))
+            else:
+                time.sleep(max(0.0, due - time.monotonic()))
+            self._completeQueries()
+        return results
+
+    def startStream( self, list_of_sensors_to_stream, callback=None, lazy=False ):
+        """ asks the robot to send the listed sensors every 15 ms
+        (the STREAM command) and starts a reader thread that parses the
+        frames and keeps sensord and the pose estimate up to date.
+        While streaming, sensors() returns the latest streamed values
+        without a round trip to the robot.
+        callback, if given, is called from the reader thread with
+        sensord after every frame.
+        With lazy=True only the pose is kept up to date, and callback
+        gets a LazyFrame per frame instead (see readFrame); for loggers
+        that mostly keep the raw bytes.
+        """
+        if self._streaming:
+            self.stopStream()
+        packets = _expandAliases(list_of_sensors_to_stream)
+        self._checkStreamFits(packets)
+        self.streamPackets = packets
+        self._streamCallback = callback
+        self._streamLazy = lazy
+        self._streamParser.reset()
+        self._streaming = True
+        self._write( STREAM + bytes([len(packets)]) + bytes(packets) )
+        self._startStreamReader()
+
+    def _startStreamReader(self):
+        """ starts the thread that reads the stream's frames """
+        if self._ioThread is not None:
+            # the I/O thread reads the frames along with everything else
+            return
+        self._streamThread = threading.Thread(target=self._streamReader,
+                                              name='create-stream', daemon=True)
+        self._streamThread.start()
+
+    def changeStream( self, list_of_sensors_to_stream, keepOdometry=True ):
+        """ switches an active stream to a new list of sensors without
+        reconnecting: the stream is paused, complete frames still in
+        flight are applied, any half-received frame is thrown away, and
+        the stream resumes with the new list.
+        If the current stream carries the wheel encoders they stay in
+        the new list (so the pose estimate keeps integrating) unless
+        keepOdometry is False.
+        If no stream is running, this is the same as startStream.
+        """
+        if not self._streaming:
+            return self.startStream(list_of_sensors_to_stream)
+        packets = _expandAliases(list_of_sensors_to_stream)
+        if keepOdometry:
+            for encoder in (ENCODER_LEFT, ENCODER_RIGHT):
+                if encoder in self.streamPackets and encoder not in packets:
+                    packets.append(encoder)
+        self._checkStreamFits(packets)
+
+        with self._streamLock:
+            self._write( PAUSERESUME + bytes([0]) )
+            # a frame may already be on the wire; let it arrive
+            time.sleep(STREAM_PERIOD)
+            if self._ioThread is None:
+                n = self.ser.in_waiting
+                if n > 0:
+                    self._applyStreamFrames(self._streamParser.feed(self.ser.read(n)))
+            self._streamParser.reset()
+            # the reader drops anything it read before this point
+            self._streamGeneration += 1
+            self.streamPackets = packets
+            with self.batch():
+                self._write( STREAM + bytes([len(packets)]) + bytes(packets) )
+                self._write( PAUSERESUME + bytes([1]) )
+
+    def _checkStreamFits( self, packets ):
+        """ warns if a frame of packets cannot be sent every 15 ms """
+        # header, count, one id per packet, data, checksum
+        frameLength = 3 + len(packets)
+        for sensornum in packets:
+            frameLength += SENSOR_DATA_WIDTH[sensornum]
+        if frameLength * 10 > self.baudRate * STREAM_PERIOD:
+            print('Warning: a', frameLength, 'byte stream frame does not fit')
+            print('  in 15 ms at', self.baudRate, 'baud; stream fewer sensors.')
+
+    def stopStream(self):
+        """ pauses the robot's stream and stops the reader thread """
+        if not self._streaming:
+            return
+        self._pauseStream()
+        time.sleep(STREAM_PERIOD)
+        self._streamPaused()
+
+    def _pauseStream(self):
+        """ asks the robot to hold the stream. A frame may already be on
+        its way and is still read: let STREAM_PERIOD pass, then call
+        _streamPaused. The list of sensors and the callback are kept
+        for _resumeStream.
+        """
+        with self._streamLock:
+            self._write( PAUSERESUME + bytes([0]) )
+
+    def _streamPaused(self):
+        """ stops reading the stream held by _pauseStream """
+        with self._streamLock:
+            self._streaming = False
+        if self._streamThread is not None:
+            self._streamThread.join()
+            self._streamThread = None
+            # what the reader left unread is not a reply
+            self.ser.reset_input_buffer()
+        self._streamParser.reset()
+
+    def _resumeStream(self):
+        """ resumes a stream held by _pauseStream """
+        self._streaming = True
+        self._write( PAUSERESUME + bytes([1]) )
+        self._startStreamReader()
+
+    def isStreaming(self):
+        """ True while startStream is feeding sensord """
+        return self._streaming
+
+    def startIOThread(self):
+        """ hands the port to a background thread (see iothread.py):
+        from now on commands are queued and written most urgent first
+        (stops and mode changes, then driving, then sensor queries, then
+        LEDs and songs), and sensor replies are read in between, so a
+        stop never waits behind a song upload or a slow reply.
+        returns the IOThread, for its depth() and stats()
+        """
+        if self._ioThread is None:
+            from .iothread import IOThread
+            self._flush()
+            self._ioThread = IOThread(self).start()
+        return self._ioThread
+
+    def stopIOThread(self):
+        """ lets the I/O thread write out its queue, then takes the
+        port back
+        """
+        if self._ioThread is None:
+            return
+        self._flush()
+        ioThread = self._ioThread
+        ioThread.stop()
+        self._ioThread = None
+
+    def _streamReader(self):
+        """ body of the reader thread started by startStream """
+        parser = self._streamParser
+        while self._streaming:
+            generation = self._streamGeneration
+            try:
+                n = self.ser.in_waiting
+                data = self.ser.read(n if n > 0 else 1)
+            except (serial.SerialException, OSError) as err:
+                print('Stream reader stopped:', err)
+                self._streaming = False
+                break
+            if not data:
+                continue
+            with self._streamLock:
+                if generation != self._streamGeneration:
+                    # read before changeStream swapped the packet list
+                    continue
+                results = self._applyStreamFrames(parser.feed(data))
+            if self._streamCallback is not None:
+                for result in results:
+                    self._streamCallback(result)
+
+    def _applyStreamFrames(self, frames):
+        """ decodes parsed stream frames into sensord and the pose;
+        returns what the stream callback gets for each frame: sensord,
+        or a LazyFrame if the stream was started with lazy=True
+        """
+        results = []
+        for packets, payload in frames:
+            with self._sensorLock:
+                if self._streamLazy:
+                    results.append(self._lazyFrame(compileDecoder(tuple(packets)), payload))
+                else:
+                    self._readSensorList(packets, payload)
+                    results.append(self.sensord)
+        return results
+
     def printSensors(self):
         """ convenience function to show sensed data in d
         if d is None, the current self.sensord is used instead
         """
-        self.sensors([LEFT_BUMP,RIGHT_BUMP,LEFT_WHEEL_DROP,RIGHT_WHEEL_DROP,CENTER_WHEEL_DROP,WALL_IR_SENSOR,CLIFF_LEFT,CLIFF_FRONT_LEFT,CLIFF_FRONT_RIGHT,CLIFF_RIGHT,VIRTUAL_WALL,LEFT_WHEEL_OVERCURRENT,RIGHT_WHEEL_OVERCURRENT,INFRARED_BYTE,PLAY_BUTTON,ADVANCE_BUTTON,POSE,CHARGING_STATE,VOLTAGE,CURRENT,BATTERY_TEMP,BATTERY_CHARGE,BATTERY_CAPACITY,WALL_SIGNAL,CLIFF_LEFT_SIGNAL,CLIFF_FRONT_LEFT_SIGNAL,CLIFF_FRONT_RIGHT_SIGNAL,CLIFF_RIGHT_SIGNAL,OI_MODE,SONG_NUMBER,SONG_PLAYING,CHARGING_SOURCES_AVAILABLE, ENCODER_LEFT, ENCODER_RIGHT,LIGHTBUMP_LEFT,LIGHTBUMP_FRONT_LEFT,LIGHTBUMP_CENTER_LEFT,LIGHTBUMP_CENTER_RIGHT,LIGHTBUMP_FRONT_RIGHT,LIGHTBUMP_RIGHT,LIGHTBUMP])
-        d = self.sensord
-        pose = d[POSE]
-
-        print('                   LEFT_BUMP:', d[LEFT_BUMP])
-        print('                  RIGHT_BUMP:', d[RIGHT_BUMP])
-        print('             LEFT_WHEEL_DROP:', d[LEFT_WHEEL_DROP])
-        print('            RIGHT_WHEEL_DROP:', d[RIGHT_WHEEL_DROP])
-        print('           CENTER_WHEEL_DROP:', d[CENTER_WHEEL_DROP])
-        print('              WALL_IR_SENSOR:', d[WALL_IR_SENSOR])
-        print('                  CLIFF_LEFT:', d[CLIFF_LEFT])
-        print('            CLIFF_FRONT_LEFT:', d[CLIFF_FRONT_LEFT])
-        print('           CLIFF_FRONT_RIGHT:', d[CLIFF_FRONT_RIGHT])
-        print('                 CLIFF_RIGHT:', d[CLIFF_RIGHT])
-        print('                VIRTUAL_WALL:', d[VIRTUAL_WALL])
-        print('      LEFT_WHEEL_OVERCURRENT:', d[LEFT_WHEEL_OVERCURRENT])
-        print('     RIGHT_WHEEL_OVERCURRENT:', d[RIGHT_WHEEL_OVERCURRENT])
-        print('               INFRARED_BYTE:', d[INFRARED_BYTE])
-        print('                 PLAY_BUTTON:', d[PLAY_BUTTON])
-        print('              ADVANCE_BUTTON:', d[ADVANCE_BUTTON])
-        print('                 POSE X (cm):', pose[0])
-        print('                 POSE Y (cm):', pose[1])
-        print('               POSE TH (rad):', pose[2])
-        print('              CHARGING_STATE:', d[CHARGING_STATE])
-        print('                     VOLTAGE:', d[VOLTAGE])
-        print('                     CURRENT:', d[CURRENT])
-        print('                BATTERY_TEMP:', d[BATTERY_TEMP])
-        print('              BATTERY_CHARGE:', d[BATTERY_CHARGE])
-        print('            BATTERY_CAPACITY:', d[BATTERY_CAPACITY])
-        print('                 WALL_SIGNAL:', d[WALL_SIGNAL])
-        print('           CLIFF_LEFT_SIGNAL:', d[CLIFF_LEFT_SIGNAL])
-        print('     CLIFF_FRONT_LEFT_SIGNAL:', d[CLIFF_FRONT_LEFT_SIGNAL])
-        print('    CLIFF_FRONT_RIGHT_SIGNAL:', d[CLIFF_FRONT_RIGHT_SIGNAL])
-        print('          CLIFF_RIGHT_SIGNAL:', d[CLIFF_RIGHT_SIGNAL])
-        print('                     OI_MODE:', d[OI_MODE])
-        print('                 SONG_NUMBER:', d[SONG_NUMBER])
-        print('                SONG_PLAYING:', d[SONG_PLAYING])
-        print('                ENCODER_LEFT:', d[ENCODER_LEFT])
-        print('               ENCODER_RIGHT:', d[ENCODER_RIGHT])
-        print('                   LIGHTBUMP:', d[LIGHTBUMP])
-        print('              LIGHTBUMP_LEFT:', d[LIGHTBUMP_LEFT])
-        print('        LIGHTBUMP_FRONT_LEFT:', d[LIGHTBUMP_FRONT_LEFT])
-        print('       LIGHTBUMP_CENTER_LEFT:', d[LIGHTBUMP_CENTER_LEFT])
-        print('      LIGHTBUMP_CENTER_RIGHT:', d[LIGHTBUMP_CENTER_RIGHT])
-        print('      LIGHTBUMP_CENTER_RIGHT:', d[LIGHTBUMP_CENTER_RIGHT])
-        print('             LIGHTBUMP_RIGHT:', d[LIGHTBUMP_RIGHT])
-        print('  CHARGING_SOURCES_AVAILABLE:', d[CHARGING_SOURCES_AVAILABLE])
+        d = self.sensors(PRINTED_SENSORS)
+        for line in formatSensors(d):
+            print(line)
         return d
 
-    def _readSensorList(self, sensor_data_list, r):
+    def _readSensorList(self, sensor_data_list, r, decoder=None):
         """ this returns the latest values from the particular
         sensors requested in the listofvalues
+        decoder, if given, is the compiled decoder for sensor_data_list
         """
 
         if len(sensor_data_list) == 0:
             print('No data was read in _readSensorList.')
             return self.sensord
 
-        sensorDataInterpreter = [ None, # 0
-                                  None, # 1
-                                  None, # 2
-                                  None, # 3
-                                  None, # 4
-                                  None, # 5
-                                  None, # 6
-                                  self._getLower5Bits, # 7 BUMPS_AND_WHEEL_DROPS
-                                  self._getOneBit, # 8 WALL_IR_SENSOR
-                                  self._getOneBit, # 9 CLIFF_LEFT = 9
-                                  self._getOneBit, # 10 CLIFF_FRONT_LEFT = 10
-                                  self._getOneBit, # 11 CLIFF_FRONT_RIGHT = 11
-                                  self._getOneBit, # 12 CLIFF_RIGHT = 12
-                                  self._getOneBit, # 13 VIRTUAL_WALL
-                                  self._getLower5Bits, # 14 LSD_AND_OVERCURRENTS
-                                  self._getOneBit, # 15 DIRT_DETECTED
-                                  self._getOneBit, # 16 unused
-                                  self._getOneByteUnsigned, # 17 INFRARED_BYTE
-                                  self._getButtonBits, # 18 BUTTONS
-                                  self._getTwoBytesSigned, # 19 DISTANCE
-                                  self._getTwoBytesSigned, # 20 ANGLE
-                                  self._getOneByteUnsigned, # 21 CHARGING_STATE
-                                  self._getTwoBytesUnsigned, # 22 VOLTAGE
-                                  self._getTwoBytesSigned, # 23 CURRENT
-                                  self._getOneByteSigned, # 24 BATTERY_TEMP
-                                  self._getTwoBytesUnsigned, # 25 BATTERY_CHARGE
-                                  self._getTwoBytesUnsigned, # 26 BATTERY_CAPACITY
-                                  self._getTwoBytesUnsigned, # 27 WALL_SIGNAL
-                                  self._getTwoBytesUnsigned, # 28 CLIFF_LEFT_SIGNAL
-                                  self._getTwoBytesUnsigned, # 29 CLIFF_FRONT_LEFT_SIGNAL
-                                  self._getTwoBytesUnsigned, # 30 CLIFF_FRONT_RIGHT_SIGNAL
-                                  self._getTwoBytesUnsigned, # 31 CLIFF_RIGHT_SIGNAL
-                                  self._getLower5Bits, # 32 CARGO_BAY_DIGITAL_INPUTS
-                                  self._getTwoBytesUnsigned, # 33 CARGO_BAY_ANALOG_SIGNAL
-                                  self._getOneByteUnsigned, # 34 CHARGING_SOURCES_AVAILABLE
-                                  self._getOneByteUnsigned, # 35 OI_MODE
-                                  self._getOneByteUnsigned, # 36 SONG_NUMBER
-                                  self._getOneByteUnsigned, # 37 SONG_PLAYING
-                                  self._getOneByteUnsigned, # 38 NUM_STREAM_PACKETS
-                                  self._getTwoBytesSigned, # 39 REQUESTED_VELOCITY
-                                  self._getTwoBytesSigned, # 40 REQUESTED_RADIUS
-                                  self._getTwoBytesSigned, # 41 REQUESTED_RIGHT_VELOCITY
-                                  self._getTwoBytesSigned, # 42 REQUESTED_LEFT_VELOCITY
-                                  self._getTwoBytesUnsigned, # 43 Left Encoder Counts
-                                  self._getTwoBytesUnsigned, # 44 Right Encoder Counts
-                                  self._getOneByteUnsigned, # 45 LIGH_BUMP
-                                  self._getTwoBytesUnsigned, # 46 LIGHTBUMP_LEFT
-                                  self._getTwoBytesUnsigned, # 47 LIGHTBUMP_FRONT_LEFT
-                                  self._getTwoBytesUnsigned, # 48 LIGHTBUMP_CENTER_LEFT
-                                  self._getTwoBytesUnsigned, # 49 LIGHTBUMP_CENTER_RIGHT
-                                  self._getTwoBytesUnsigned, # 50 LIGHTBUMP_FRONT_RIGHT
-                                  self._getTwoBytesUnsigned, # 51 LIGHTBUMP_RIGHT
-                                  None # only 51 as of right now
-                                  ]
-
-        startofdata = 0
-        distance = 0
-        angle = 0
-        update_pose = False
-
-        for sensorNum in sensor_data_list:
-            width = SENSOR_DATA_WIDTH[sensorNum]
-            dataGetter = sensorDataInterpreter[sensorNum]
-            interpretedData = 0
-
-            if (width == 1):
-                if startofdata >= len(r):
-                    if self._debug: print("Incomplete Sensor Packet")
-                    break
-                else: interpretedData = dataGetter(r[startofdata])
-            if (width == 2):
-                if startofdata >= len(r) - 1:
-                    if self._debug: print("Incomplete Sensor Packet")
-                    break
-                else: interpretedData = dataGetter(r[startofdata], r[startofdata+1] )
-
-            # add to our dictionary
-            self.sensord[sensorNum] = interpretedData
-
-            # POSE = 100 - later
-
-            #LEFT_BUMP = 101
-            #RIGHT_BUMP = 102
-            #LEFT_WHEEL_DROP = 103
-            #RIGHT_WHEEL_DROP = 104
-            #CENTER_WHEEL_DROP = 105
-            if sensorNum == BUMPS_AND_WHEEL_DROPS:
-                self.sensord[CENTER_WHEEL_DROP] = interpretedData[0]
-                self.sensord[LEFT_WHEEL_DROP] = interpretedData[1]
-                self.sensord[RIGHT_WHEEL_DROP] = interpretedData[2]
-                self.sensord[LEFT_BUMP] = interpretedData[3]
-                self.sensord[RIGHT_BUMP] = interpretedData[4]
-
-            #LEFT_WHEEL_OVERCURRENT = 106
-            #RIGHT_WHEEL_OVERCURRENT = 107
-            if sensorNum == LSD_AND_OVERCURRENTS:
-                self.sensord[LEFT_WHEEL_OVERCURRENT] = interpretedData[0]
-                self.sensord[RIGHT_WHEEL_OVERCURRENT] = interpretedData[1]
-
-            #ADVANCE_BUTTON = 108
-            #PLAY_BUTTON = 109
-            if sensorNum == BUTTONS:
-                self.sensord[ADVANCE_BUTTON] = interpretedData[0]
-                self.sensord[PLAY_BUTTON] = interpretedData[1]
-
-            if sensorNum == DIRT_DETECTED:
-                self.sensord[DIRT_DETECTED] = interpretedData
-
-            # handle special cases
-            if (sensorNum == DISTANCE):
-                distance = interpretedData
-            if (sensorNum == ANGLE):
-                angle = interpretedData
-
-            if (sensorNum == ENCODER_LEFT):
-                self.leftEncoder = interpretedData
-                update_pose = True
-            if (sensorNum == ENCODER_RIGHT):
-                self.rightEncoder = interpretedData
-                update_pose = True
-
-            #resultingValues.append(interpretedData)
-            # update index for next sensor...
-            startofdata = startofdata + width
-
-        #if (distance != 0 or angle != 0):
-        #    self._integrateNextOdometricStepCreate(distance,angle)
-        if update_pose == True:
-             self._integrateNextEncoderStep()
-        self.sensord[POSE] = self.getPose(dist='cm')
-
-
-
-    def toFullMode(self):
-        """ changes the state to FULL_MODE
+        # one precompiled unpack for the whole reply; see decoders.py
+        if decoder is None:
+            decoder = compileDecoder(tuple(sensor_data_list))
+        if len(r) < decoder.size:
+            # with a byte missing from the middle everything after it
+            # is shifted; keep the values from the last whole reply
+            if self._debug: print("Incomplete Sensor Packet")
+            return self.sensord
+        if isinstance(r, list):
+            r = bytes(r)
+        decoder.decode(self, r)
+        if self.history is not None:
+            self._recordHistory(decoder.packets, r, self.sensord.pose)
+
+    def _lazyFrame(self, decoder, r):
+        """ decoder.frame, plus a history row for a complete reply """
+        frame = decoder.frame(self, r)
+        if self.history is not None:
+            self._recordHistory(decoder.packets, frame.raw, frame.pose)
+        return frame
+
+
+
+    def toFullMode(self, timeout=MODE_TIMEOUT):
+        """ changes the state to FULL_MODE; returns True once the robot
+        reports FULL_MODE (see _confirmMode)
         """
         self._start()
-        time.sleep(0.03)
-        self.toSafeMode()
-        time.sleep(0.03)
         self._write( FULL )
-        time.sleep(0.03)
         self.sciMode = FULL_MODE
-
-        return
+        return self._confirmMode(FULL_MODE, timeout)
 
 
-    def toSafeMode(self):
+    def toSafeMode(self, timeout=MODE_TIMEOUT):
         """ changes the state (from PASSIVE_MODE or FULL_MODE)
-        to SAFE_MODE
+        to SAFE_MODE; returns True once the robot reports SAFE_MODE
+        (see _confirmMode)
         """
         self._start()
-        time.sleep(0.03)
         # now we're in PASSIVE_MODE, so we repeat the above code...
         self._write( SAFE )
-        # they recommend 20 ms between mode-changing commands
-        time.sleep(0.03)
         # change the mode we think we're in...
         self.sciMode = SAFE_MODE
-        # no response here, so we don't get any...
-        return
+        return self._confirmMode(SAFE_MODE, timeout)
 
 
+    def _confirmMode(self, mode, timeout=MODE_TIMEOUT):
+        """ waits up to timeout seconds for the robot to report mode in
+        OI_MODE, asking for it every STREAM_PERIOD, or watching the
+        stream if one is running. Returns True if it did, False if it
+        did not (after printing a warning), and None if it cannot be
+        told: a stream without OI_MODE is running.
+        """
+        if self._streaming and OI_MODE not in self.streamPackets:
+            return None
+        deadline = time.monotonic() + timeout
+        while True:
+            asked = time.monotonic()
+            if self._pollMode() == mode:
+                return True
+            now = time.monotonic()
+            if now >= deadline:
+                print('The robot did not report', modeStr(mode), 'within', timeout, 'seconds')
+                return False
+            time.sleep(max(0.0, asked + STREAM_PERIOD - now))
+
+    def _pollMode(self):
+        """ the mode the robot reports now, or None if it did not answer """
+        if self._streaming:
+            # the stream keeps reportedMode current
+            return self.reportedMode
+        if self._ioThread is not None:
+            try:
+                return self._ioThread.query([OI_MODE]).result().get(OI_MODE)
+            except TimeoutError:
+                return None
+        plan = queryPlan([OI_MODE])
+        self._write(plan.request)
+        r = self._read(plan.size)
+        if len(r) < plan.size:
+            return None
+        self._readSensorList(plan.packets, r, plan.decoder)
+        return self.reportedMode
+
+    def _observeMode(self, mode):
+        """ called by the decoders with every OI_MODE the robot reports;
+        calls the onModeLost callback when the robot leaves the mode it
+        was commanded into
+        """
+        previous = self.reportedMode
+        self.reportedMode = mode
+        commanded = self.sciMode
+        if mode != commanded and previous == commanded:
+            callback = self._modeCallback
+            if callback is not None:
+                callback(commanded, mode)
+
+    def onModeLost(self, callback):
+        """ callback(commanded, reported) is called whenever a sensor
+        reply or stream frame shows the robot has left the mode it was
+        put in, e.g. dropped from SAFE_MODE to PASSIVE_MODE by a cliff
+        or wheel drop (from the stream thread while streaming).
+        Only replies that carry OI_MODE are seen. None removes it.
+        """
+        self._modeCallback = callback
 
     def getMode(self):
-        """ returns one of OFF_MODE, PASSIVE_MODE, SAFE_MODE, FULL_MODE """
-        # but how right is it?
-        return self.sciMode
+        """ returns one of OFF_MODE, PASSIVE_MODE, SAFE_MODE, FULL_MODE:
+        the mode the robot last reported, or the one last commanded if
+        it has not reported one yet
+        """
+        if self.reportedMode is None:
+            return self.sciMode
+        return self.reportedMode
 
 
     def _setBaudRate(self, baudrate=10):
@@ -1453,8 +2102,7 @@ class Create:
             print('was not recognized. Not sending anything.')
             return
         # otherwise, send off the message
-        self._write( START )
-        self._write( bytes([baudcode]) )
+        self._write( START + bytes([baudcode]) )
         # the recommended pause
         time.sleep(0.1)
         # change the mode we think we're in...
@@ -1466,45 +2114,65 @@ class Create:
     # Some new stuff added by Sean
 
     def _startScript(self, number_of_bytes):
-        self._write( SCRIPT )
-        self._write( bytes([number_of_bytes]) )
+        self._write( SCRIPT + bytes([number_of_bytes]) )
         return
 
     def _endScript(self, timeout=-1.0):
-        # issue the ENDSCRIPT command to start the script
-        self._write( ENDSCRIPT )
-        interval = 1.0
-        total = 0.0
-
-        # strip out all existing crap
-        while(self.ser.read(8192) != b''):
-            continue
-
-        # poll
-        while(timeout<0.0 or total < timeout):
-            self._write(SENSORS)
-            self._write(bytes([7]))  # smallest packet value that I can tell
-            if self.ser.read(1) != b'':
-                break
-            time.sleep(interval - 0.5)
-            total = total + interval
-
-        # strip out again, we buffered up lots of junk
-        while(self.ser.read(8192) != b''):
-            continue
+        """ runs the script and returns once it has finished: True, or
+        False if timeout seconds (if not negative) went by first.
+        The robot reads nothing more until the script is over, so a
+        SENSORS request sent right behind ENDSCRIPT is answered the
+        moment it ends; its reply (BUMPS_AND_WHEEL_DROPS) goes into
+        sensord like any other.
+        """
+        if self._streaming:
+            # a stream byte would be taken for the reply, so the stream
+            # is paused for the script and resumed after it
+            self._pauseStream()
+            time.sleep(STREAM_PERIOD)
+            self._streamPaused()
+            try:
+                return self._endScript(timeout)
+            finally:
+                self._resumeStream()
+        request = SENSORS + bytes([BUMPS_AND_WHEEL_DROPS])
+        if self._ioThread is not None:
+            # the robot answers this once the script is over
+            self._write( ENDSCRIPT )
+            try:
+                self._ioThread.rawQuery(request, 1,
+                                        None if timeout < 0 else timeout).result()
+            except TimeoutError:
+                return False
+            return True
+
+        decoder = compileDecoder((BUMPS_AND_WHEEL_DROPS,))
+        with self.batch():
+            # issue the ENDSCRIPT command to start the script
+            self._write( ENDSCRIPT )
+            self._write( request )
+        # the reply is not overdue until the script is over, so this
+        # is no job for _read and its reply timeout
+        if timeout < 0:
+            r = b''
+            while not r:
+                r = self._readWithin(decoder.size, 1.0)
+        else:
+            r = self._readWithin(decoder.size, timeout)
+        if len(r) == decoder.size:
+            self._readSensorList(decoder.packets, r, decoder)
+            return True
+        print('The script did not finish within', timeout, 'seconds')
+        return False
 
     def _waitForDistance(self, distance_mm):
-        self._write(WAITDIST)
         leftHighVal, leftLowVal = _toTwosComplement2Bytes( distance_mm )
-        self._write( bytes([leftHighVal]) )
-        self._write( bytes([leftLowVal]) )
+        self._write( WAITDIST + bytes([leftHighVal, leftLowVal]) )
         return
 
     def _waitForAngle(self, angle_deg):
-        self._write(WAITANGLE)
         leftHighVal, leftLowVal = _toTwosComplement2Bytes( angle_deg )
-        self._write( bytes([leftHighVal]) )
-        self._write( bytes([leftLowVal]) )
+        self._write( WAITANGLE + bytes([leftHighVal, leftLowVal]) )
         return
 
     def turn(self, angle_rad, rad_per_sec=math.radians(20)):
@@ -1514,10 +2182,11 @@ class Create:
             rad_per_sec=math.radians(20)
         if (angle_rad < 0 and rad_per_sec > 0) or (angle_rad > 0 and rad_per_sec < 0):
             rad_per_sec = -rad_per_sec
-        self._startScript(13)
-        self.go_differential(0, rad_per_sec)
-        self._waitForAngle(int(math.degrees(angle_rad)))
-        self.stop()
+        with self.batch():
+            self._startScript(13)
+            self.go_differential(0, rad_per_sec)
+            self._waitForAngle(int(math.degrees(angle_rad)))
+            self.stop()
         self._endScript()
         #self.sensors([POSE])   # updated by Sean
 
@@ -1528,10 +2197,11 @@ class Create:
             cm_per_sec=10
         if (distance_cm < 0 and cm_per_sec > 0) or (distance_cm > 0 and cm_per_sec < 0):
             cm_per_sec = 0 - cm_per_sec
-        self._startScript(13)
-        self.go_differential(cm_per_sec, 0)
-        self._waitForDistance(distance_cm*10)
-        self.stop()
+        with self.batch():
+            self._startScript(13)
+            self.go_differential(cm_per_sec, 0)
+            self._waitForDistance(distance_cm*10)
+            self.stop()
         self._endScript()
         #self.sensors([POSE])   # updated by Sean
 
@@ -1571,13 +2241,10 @@ class Create:
     #Change Time of Roomba internal Clock to System-Time over Serial Port
     def change_Time(self):
         self._write(START)
-        self._write(CHANGE_TIME)
         weekdays = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
         i = 0
         now = datetime.datetime.now()
         for day in weekdays:
             if datetime.datetime.today().strftime('%A') == day: daycode = bytes([i])
             i += 1
-        self._write(daycode)
-        self._write(bytes([now.hour]))
-        self._write(bytes([now.minute]))
+        self._write(CHANGE_TIME + daycode + bytes([now.hour, now.minute]))
@@ -0,0 +1,228 @@
+#
+# decoders.py
+#
+# Compiled sensor reply decoders.
+#
+# A reply to QUERYLIST (or a stream frame's payload) is the data of each
+# requested packet back to back, so for a given id list its layout never
+# changes. compileDecoder() turns an id list into a SensorDecoder once:
+# the whole reply is unpacked by a single precompiled struct.Struct,
+# bitfields are expanded through 256-entry lookup tables, and the
+# straight-line Python that stores the values into sensord is generated
+# for exactly those ids, assigning straight to the SensorSnapshot slots.
+# Decoders are cached, so repeated polls of the same ids only pay for
+# the unpack and the stores.
+#
+# A decoder can also wrap a reply in a LazyFrame instead, which keeps the
+# raw bytes and decodes a field only when it is first read.
+
+import functools
+import struct
+from collections.abc import Mapping
+
+from .registry import SENSOR_DATA_WIDTH, PACKET_KINDS, DERIVED_BITS
+from .snapshot import FIELD_NAMES
+
+_STRUCT_CODE = {'bit': 'B', 'lower5': 'B', 'buttons': 'B',
+                'B': 'B', 'b': 'b', 'H': 'H', 'h': 'h'}
+
+# the lookup tables the generated code expands bitfields with
+_BIT = tuple(1 if v == 1 else 0 for v in range(256))
+_LOWER5 = tuple([(v >> 4) & 1, (v >> 3) & 1, (v >> 2) & 1, (v >> 1) & 1, v & 1]
+                for v in range(256))
+_BUTTONS = tuple([(v >> 2) & 1, v & 1] for v in range(256))
+
+_S8 = struct.Struct('>b').unpack_from
+_U16 = struct.Struct('>H').unpack_from
+_S16 = struct.Struct('>h').unpack_from
+
+# getter(raw, offset) for one field of each kind, used by LazyFrame
+_GETTERS = {
+    'bit': lambda r, o: _BIT[r[o]],
+    'lower5': lambda r, o: _LOWER5[r[o]][:],
+    'buttons': lambda r, o: _BUTTONS[r[o]][:],
+    'B': lambda r, o: r[o],
+    'b': lambda r, o: _S8(r, o)[0],
+    'H': lambda r, o: _U16(r, o)[0],
+    'h': lambda r, o: _S16(r, o)[0],
+}
+
+
+def _zero(r, o):
+    return 0
+
+
+def _bitGetter(table, i):
+    return lambda r, o: table[r[o]][i]
+
+
+_ID_OF_FIELD = {name: sensornum for sensornum, name in FIELD_NAMES.items()}
+_POSE = _ID_OF_FIELD['pose']
+
+
+class LazyFrame(Mapping):
+    """ one sensor reply, decoded a field at a time: frame[VOLTAGE] or
+    frame.voltage decodes that field on first access and keeps the
+    value. raw is the reply as bytes and pose the robot's pose once the
+    reply's encoder counts had been integrated. Read-only; otherwise
+    it behaves like a SensorSnapshot.
+    """
+
+    __slots__ = ('raw', 'pose', '_layout', '_values')
+
+    def __init__(self, raw, layout, pose):
+        self.raw = raw
+        self.pose = pose
+        self._layout = layout
+        self._values = None
+
+    def __getitem__(self, sensornum):
+        values = self._values
+        if values is None:
+            values = self._values = {}
+        elif sensornum in values:
+            return values[sensornum]
+        entry = self._layout.get(sensornum)
+        if entry is None:
+            if sensornum == _POSE:
+                return self.pose
+            raise KeyError(sensornum)
+        offset, getter = entry
+        value = values[sensornum] = getter(self.raw, offset)
+        return value
+
+    def __getattr__(self, name):
+        sensornum = _ID_OF_FIELD.get(name)
+        if sensornum is None:
+            raise AttributeError(name)
+        try:
+            return self[sensornum]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __contains__(self, sensornum):
+        return sensornum in self._layout or sensornum == _POSE
+
+    def __iter__(self):
+        yield from self._layout
+        yield _POSE
+
+    def __len__(self):
+        return len(self._layout) + 1
+
+    def __repr__(self):
+        return 'LazyFrame(%r)' % self.raw
+
+
+class SensorDecoder:
+    """ decodes replies laid out as packets into a Create's sensord
+    (a SensorSnapshot)
+
+    size is the reply length in bytes. decode(robot, r) stores every
+    packet (and the aliases derived from them) in robot.sensord, feeds
+    the wheel encoders to the odometry, passes OI_MODE to
+    robot._observeMode and refreshes sensord[POSE]; r is any buffer at
+    least size bytes long.
+    """
+
+    def __init__(self, packets, size, decode, source, layout, encoders, mode=None):
+        self.packets = packets
+        self.size = size
+        self.decode = decode
+        self.source = source
+        self.layout = layout        # id -> (offset, getter) for LazyFrame
+        self._encoders = encoders   # offsets of ENCODER_LEFT and _RIGHT
+        self._mode = mode           # offset of OI_MODE
+
+    def frame(self, robot, r):
+        """ wraps the reply r in a LazyFrame. Only the wheel encoders
+        and OI_MODE are decoded now, so the robot's odometry,
+        sensord[POSE] and mode tracking stay current; everything else
+        waits until it is read.
+        """
+        raw = bytes(r)
+        if self._mode is not None:
+            robot._observeMode(raw[self._mode])
+        left, right = self._encoders
+        if left is not None or right is not None:
+            if left is not None:
+                robot.leftEncoder = _U16(raw, left)[0]
+            if right is not None:
+                robot.rightEncoder = _U16(raw, right)[0]
+            robot._integrateNextEncoderStep()
+        pose = robot.sensord.pose = robot.getPose(dist='cm')
+        return LazyFrame(raw, self.layout, pose)
+
+
+@functools.lru_cache(maxsize=256)
+def compileDecoder(packets):
+    """ returns the SensorDecoder for packets, a tuple of packet ids """
+    # imported here: create.py imports this module
+    from .create import POSE, ENCODER_LEFT, ENCODER_RIGHT, OI_MODE
+
+    def store(sensornum, value):
+        name = FIELD_NAMES.get(sensornum)
+        if name is None:
+            return 'd[%d] = %s' % (sensornum, value)
+        return 'd.%s = %s' % (name, value)
+
+    fmt = '>'
+    size = 0
+    names = []
+    body = []
+    encoders = False
+    layout = {}
+    offsets = {}
+    for sensornum in packets:
+        width = SENSOR_DATA_WIDTH[sensornum]
+        kind = PACKET_KINDS[sensornum]
+        if width == 0 or kind is None:
+            body.append(store(sensornum, '0'))
+            layout[sensornum] = (size, _zero)
+            continue
+        layout[sensornum] = (size, _GETTERS[kind])
+        offsets[sensornum] = size
+        if kind in ('lower5', 'buttons'):
+            bits = _LOWER5 if kind == 'lower5' else _BUTTONS
+            for alias, i, _ in DERIVED_BITS.get(sensornum, ()):
+                layout[alias] = (size, _bitGetter(bits, i))
+        v = 'v%d' % len(names)
+        names.append(v)
+        fmt += _STRUCT_CODE[kind]
+        size += width
+        if kind == 'bit':
+            body.append(store(sensornum, '_BIT[%s]' % v))
+        elif kind in ('lower5', 'buttons'):
+            table = '_LOWER5' if kind == 'lower5' else '_BUTTONS'
+            body.append('bits = %s[%s]' % (table, v))
+            body.append(store(sensornum, 'bits[:]'))
+            for alias, i, _ in DERIVED_BITS.get(sensornum, ()):
+                body.append(store(alias, 'bits[%d]' % i))
+        else:
+            body.append(store(sensornum, v))
+        if sensornum == ENCODER_LEFT:
+            body.append('robot.leftEncoder = %s' % v)
+            encoders = True
+        elif sensornum == ENCODER_RIGHT:
+            body.append('robot.rightEncoder = %s' % v)
+            encoders = True
+        elif sensornum == OI_MODE:
+            body.append('robot._observeMode(%s)' % v)
+    if encoders:
+        body.append('robot._integrateNextEncoderStep()')
+    body.append(store(POSE, "robot.getPose(dist='cm')"))
+
+    lines = ['def decode(robot, r):', '    d = robot.sensord']
+    if len(names) == 1:
+        lines.append('    %s, = _unpack(r)' % names[0])
+    elif names:
+        lines.append('    %s = _unpack(r)' % ', '.join(names))
+    lines.extend('    ' + line for line in body)
+    source = '\n'.join(lines) + '\n'
+
+    namespace = {'_unpack': struct.Struct(fmt).unpack_from,
+                 '_BIT': _BIT, '_LOWER5': _LOWER5, '_BUTTONS': _BUTTONS}
+    exec(compile(source, '<decoder %s>' % (packets,), 'exec'), namespace)
+    return SensorDecoder(packets, size, namespace['decode'], source, layout,
+                         (offsets.get(ENCODER_LEFT), offsets.get(ENCODER_RIGHT)),
+                         offsets.get(OI_MODE))
@@ -0,0 +1,477 @@
+#
+# emulator.py
+#
+# An Open Interface emulator that speaks the protocol byte for byte,
+# for running cli.py, game.py and controllers without a robot.
+#
+# OIEmulator is the robot model: it tracks the OI mode, answers
+# SENSORS / QUERYLIST / STREAM, integrates differential-drive kinematics
+# into the encoder, distance and angle packets, stores and plays songs,
+# and runs SCRIPT with its WAIT commands. It has no I/O of its own:
+# bytes go in through feed() and come back as its return value, and
+# poll() hands over anything produced as time passes (stream frames).
+# That makes it a peer for transport.LoopbackTransport.
+#
+# PtyEmulator puts an OIEmulator behind a pseudo-terminal so any program
+# can open it like a serial port:
+#
+#   roomba-sim                 # prints the pty path, e.g. /dev/pts/4
+#   roomba-cli /dev/pts/4
+#
+# Create('sim') starts one automatically.
+
+import math
+import os
+import select
+import threading
+import time
+import tty
+
+from .create import (
+    OFF_MODE, PASSIVE_MODE, SAFE_MODE, FULL_MODE,
+    BUMPS_AND_WHEEL_DROPS, CLIFF_LEFT, CLIFF_FRONT_LEFT, CLIFF_FRONT_RIGHT,
+    CLIFF_RIGHT, DISTANCE, ANGLE, CHARGING_STATE, VOLTAGE, CURRENT,
+    BATTERY_TEMP, BATTERY_CHARGE, BATTERY_CAPACITY,
+    OI_MODE, SONG_NUMBER, SONG_PLAYING, NUM_STREAM_PACKETS,
+    REQUESTED_VELOCITY, REQUESTED_RADIUS, REQUESTED_RIGHT_VELOCITY,
+    REQUESTED_LEFT_VELOCITY, ENCODER_LEFT, ENCODER_RIGHT,
+    SENSOR_DATA_WIDTH, SENSOR_GROUPS, WHEEL_SPAN, TICK_PER_MM,
+)
+from .commands import PAYLOAD_LENGTH
+from .registry import encodePacket
+from .stream import STREAM_HEADER, STREAM_PERIOD
+
+# the DRIVE radii that mean straight, turn in place CCW and CW
+_STRAIGHT = (32767, -32768)
+_SPIN_CCW = 1
+_SPIN_CW = -1
+
+
+def _signed16(hi, lo):
+    v = hi << 8 | lo
+    return v - 0x10000 if v & 0x8000 else v
+
+
+class OIEmulator:
+    """ a simulated Create 2 at the byte level
+
+    clock is the time source in seconds (time.monotonic by default);
+    tests can pass a function returning a manually advanced time.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.now = clock()
+        self.mode = OFF_MODE
+        self.baudcode = 11
+
+        # static sensor values; set them with setSensor
+        self.values = {p: 0 for p in range(len(SENSOR_DATA_WIDTH))}
+        self.values[CHARGING_STATE] = 0
+        self.values[VOLTAGE] = 15500
+        self.values[CURRENT] = -180
+        self.values[BATTERY_TEMP] = 25
+        self.values[BATTERY_CHARGE] = 2500
+        self.values[BATTERY_CAPACITY] = 2700
+
+        # ground truth pose (mm, mm, rad) and wheel state
+        self.x = 0.0
+        self.y = 0.0
+        self.th = 0.0
+        self.leftVelocity = 0       # mm/s
+        self.rightVelocity = 0
+        self.requestedVelocity = 0
+        self.requestedRadius = 0
+        self.leftTicks = 0.0        # unwrapped encoder counts
+        self.rightTicks = 0.0
+        self.distance = 0.0         # mm since DISTANCE was last read
+        self.angle = 0.0            # degrees since ANGLE was last read
+        self.totalDistance = 0.0    # never reset; used by WAITDIST
+        self.totalAngle = 0.0       # never reset; used by WAITANGLE
+
+        self.songs = {}
+        self.songNumber = 0
+        self.songEnds = 0.0
+
+        self.streamPackets = []
+        self.streaming = False
+        self.nextStreamTime = 0.0
+
+        self.script = b''
+        self._wait = None           # (kind, target, start) while waiting
+        self._input = bytearray()   # received but not yet executed
+        self._output = bytearray()  # replies not yet handed out
+        self.commands = 0           # commands executed
+
+    # --- driving the model -------------------------------------------
+
+    def feed(self, data):
+        """ takes bytes written to the robot and returns its replies
+        (and any stream frames that became due)
+        """
+        self._advance(self.clock())
+        self._input += data
+        self._run()
+        return self._takeOutput()
+
+    def poll(self):
+        """ returns bytes the robot sent on its own since the last
+        feed() or poll(): stream frames, and replies held back by a
+        script WAIT that has since finished
+        """
+        self._advance(self.clock())
+        self._run()
+        return self._takeOutput()
+
+    def setSensor(self, packet, value):
+        """ sets the reading of a static sensor packet; a wheel drop or
+        cliff in SAFE_MODE drops the robot to PASSIVE_MODE like the real one
+        """
+        self.values[packet] = value
+        if self.mode == SAFE_MODE and self._safetyTripped():
+            self._stopWheels()
+            self.mode = PASSIVE_MODE
+
+    def _takeOutput(self):
+        out = bytes(self._output)
+        del self._output[:]
+        return out
+
+    def _safetyTripped(self):
+        drops = self.values[BUMPS_AND_WHEEL_DROPS] & 0x0C
+        cliffs = (self.values[CLIFF_LEFT] or self.values[CLIFF_FRONT_LEFT] or
+                  self.values[CLIFF_FRONT_RIGHT] or self.values[CLIFF_RIGHT])
+        return bool(drops or cliffs)
+
+    # --- time ----------------------------------------------------------
+
+    def _advance(self, now):
+        """ integrates the wheels up to now, stopping exactly where a
+        WAIT finishes or a stream frame is due
+        """
+        while self.now < now:
+            step = now - self.now
+            if self.streaming and self.nextStreamTime - self.now < step:
+                step = max(self.nextStreamTime - self.now, 0.0)
+            waitStep = self._timeToFinishWait()
+            if waitStep is not None and waitStep < step:
+                step = waitStep
+            self._integrate(step)
+            self.now += step
+            if self.streaming and self.now >= self.nextStreamTime:
+                self._output += self._streamFrame()
+                self.nextStreamTime += STREAM_PERIOD
+                if self.nextStreamTime < self.now:
+                    # fell behind (e.g. a paused clock); don't flood
+                    self.nextStreamTime = self.now + STREAM_PERIOD
+            if self._wait is not None and self._waitFinished():
+                self._wait = None
+                self._run()
+
+    def _integrate(self, dt):
+        if dt <= 0:
+            return
+        left = self.leftVelocity * dt
+        right = self.rightVelocity * dt
+        d = (left + right) / 2.0
+        dth = (right - left) / WHEEL_SPAN
+        mid = self.th + dth / 2.0
+        self.x += d * math.cos(mid)
+        self.y += d * math.sin(mid)
+        self.th = math.atan2(math.sin(self.th + dth), math.cos(self.th + dth))
+        self.leftTicks += left * TICK_PER_MM
+        self.rightTicks += right * TICK_PER_MM
+        self.distance += d
+        self.totalDistance += d
+        self.angle += math.degrees(dth)
+        self.totalAngle += math.degrees(dth)
+
+    def _timeToFinishWait(self):
+        """ seconds of motion left before the current WAIT is done """
+        if self._wait is None:
+            return None
+        kind, target, start = self._wait
+        if kind == 'time':
+            return max(target - self.now, 0.0)
+        if kind == 'dist':
+            rate = (self.leftVelocity + self.rightVelocity) / 2.0
+            done = self.totalDistance - start
+        elif kind == 'angle':
+            rate = math.degrees((self.rightVelocity - self.leftVelocity) / WHEEL_SPAN)
+            done = self.totalAngle - start
+        else:
+            return None
+        remaining = target - done
+        if rate == 0 or remaining * rate <= 0:
+            return None
+        return remaining / rate
+
+    def _waitFinished(self):
+        kind, target, start = self._wait
+        if kind == 'time':
+            return self.now >= target - 1e-9
+        if kind == 'dist':
+            done = self.totalDistance - start
+        elif kind == 'angle':
+            done = self.totalAngle - start
+        else:
+            return False
+        if target >= 0:
+            return done >= target - 1e-6
+        return done <= target + 1e-6
+
+    # --- command execution ----------------------------------------------
+
+    def _run(self):
+        """ executes every complete command in the input, unless a
+        script WAIT is holding them back
+        """
+        buf = self._input
+        while buf and self._wait is None:
+            opcode = buf[0]
+            if opcode not in PAYLOAD_LENGTH:
+                # not a command; the robot ignores stray bytes
+                del buf[:1]
+                continue
+            n = PAYLOAD_LENGTH[opcode]
+            if n is None:
+                if len(buf) < 2:
+                    return
+                if opcode == 140:
+                    if len(buf) < 3:
+                        return
+                    n = 2 + 2 * buf[2]
+                else:
+                    n = 1 + buf[1]
+            if len(buf) < 1 + n:
+                return
+            payload = bytes(buf[1:1 + n])
+            del buf[:1 + n]
+            self._execute(opcode, payload)
+            self.commands += 1
+
+    def _execute(self, opcode, payload):
+        if opcode == 128:                       # START
+            self.mode = PASSIVE_MODE
+            return
+        if self.mode == OFF_MODE:
+            # nothing but START is heard until the OI is started
+            return
+        if opcode == 129:                       # BAUD
+            self.baudcode = payload[0]
+            self.mode = PASSIVE_MODE
+        elif opcode == 130 or opcode == 131:    # CONTROL / SAFE
+            self.mode = SAFE_MODE
+            if self._safetyTripped():
+                self.mode = PASSIVE_MODE
+        elif opcode == 132:                     # FULL
+            self.mode = FULL_MODE
+        elif opcode in (133, 134, 135, 143):    # POWER, SPOT, CLEAN, DOCK
+            self._stopWheels()
+            self.mode = PASSIVE_MODE
+        elif opcode == 173:                     # STOP
+            self._stopWheels()
+            self.streaming = False
+            self.mode = OFF_MODE
+        elif opcode == 137:                     # DRIVE
+            if self._canDrive():
+                self._drive(_signed16(payload[0], payload[1]),
+                            _signed16(payload[2], payload[3]))
+        elif opcode == 145:                     # DRIVEDIRECT
+            if self._canDrive():
+                right = _signed16(payload[0], payload[1])
+                left = _signed16(payload[2], payload[3])
+                self.rightVelocity = max(-500, min(500, right))
+                self.leftVelocity = max(-500, min(500, left))
+                self.requestedVelocity = (right + left) // 2
+                self.requestedRadius = 0
+        elif opcode == 140:                     # SONG
+            number = payload[0]
+            if number <= 15:
+                notes = payload[2:]
+                self.songs[number] = [(notes[i], notes[i+1]) for i in range(0, len(notes), 2)]
+        elif opcode == 141:                     # PLAY
+            if self._canDrive() and payload[0] in self.songs:
+                self.songNumber = payload[0]
+                length = sum(d for _, d in self.songs[payload[0]]) / 64.0
+                self.songEnds = self.now + length
+        elif opcode == 142:                     # SENSORS
+            self._output += self._packetBytes(payload[0])
+        elif opcode == 149:                     # QUERYLIST
+            for packet in payload[1:]:
+                self._output += self._packetBytes(packet)
+        elif opcode == 148:                     # STREAM
+            self.streamPackets = list(payload[1:])
+            self.streaming = True
+            self.nextStreamTime = self.now
+        elif opcode == 150:                     # PAUSERESUME
+            self.streaming = bool(payload[0]) and bool(self.streamPackets)
+            if self.streaming:
+                self.nextStreamTime = self.now
+        elif opcode == 152:                     # SCRIPT
+            self.script = payload[1:]
+        elif opcode == 153:                     # play script
+            # the script runs before anything received after it
+            self._input[:0] = self.script
+        elif opcode == 154:                     # show script
+            self._output += bytes([len(self.script)]) + self.script
+        elif opcode == 155:                     # WAIT TIME
+            self._wait = ('time', self.now + payload[0] / 10.0, None)
+        elif opcode == 156:                     # WAITDIST
+            self._wait = ('dist', _signed16(payload[0], payload[1]), self.totalDistance)
+        elif opcode == 157:                     # WAITANGLE
+            self._wait = ('angle', _signed16(payload[0], payload[1]), self.totalAngle)
+        # the remaining commands (LEDs, motors, demos, clock, ...) have no
+        # effect on anything the emulator reports
+
+    def _canDrive(self):
+        return self.mode == SAFE_MODE or self.mode == FULL_MODE
+
+    def _stopWheels(self):
+        self.leftVelocity = 0
+        self.rightVelocity = 0
+        self.requestedVelocity = 0
+        self.requestedRadius = 0
+
+    def _drive(self, velocity, radius):
+        velocity = max(-500, min(500, velocity))
+        self.requestedVelocity = velocity
+        self.requestedRadius = radius
+        half = WHEEL_SPAN / 2.0
+        if radius in _STRAIGHT:
+            self.leftVelocity = self.rightVelocity = velocity
+        elif radius == _SPIN_CCW:
+            self.leftVelocity, self.rightVelocity = -velocity, velocity
+        elif radius == _SPIN_CW:
+            self.leftVelocity, self.rightVelocity = velocity, -velocity
+        else:
+            radius = max(-2000, min(2000, radius))
+            self.leftVelocity = velocity * (radius - half) / radius
+            self.rightVelocity = velocity * (radius + half) / radius
+
+    # --- sensor replies --------------------------------------------------
+
+    def _packetValue(self, packet):
+        """ the current reading of one packet, as an int """
+        if packet == DISTANCE:
+            value = int(self.distance)
+            self.distance -= value
+            return value
+        if packet == ANGLE:
+            value = int(self.angle)
+            self.angle -= value
+            return value
+        if packet == OI_MODE:
+            return self.mode
+        if packet == SONG_NUMBER:
+            return self.songNumber
+        if packet == SONG_PLAYING:
+            return 1 if self.now < self.songEnds else 0
+        if packet == NUM_STREAM_PACKETS:
+            return len(self.streamPackets)
+        if packet == REQUESTED_VELOCITY:
+            return self.requestedVelocity
+        if packet == REQUESTED_RADIUS:
+            return self.requestedRadius
+        if packet == REQUESTED_RIGHT_VELOCITY:
+            return int(self.rightVelocity)
+        if packet == REQUESTED_LEFT_VELOCITY:
+            return int(self.leftVelocity)
+        if packet == ENCODER_LEFT:
+            return int(self.leftTicks) & 0xFFFF
+        if packet == ENCODER_RIGHT:
+            return int(self.rightTicks) & 0xFFFF
+        return self.values[packet]
+
+    def _packetBytes(self, packet):
+        """ the bytes a SENSORS/QUERYLIST request for packet returns """
+        if packet in SENSOR_GROUPS:
+            out = bytearray()
+            for p in SENSOR_GROUPS[packet]:
+                out += self._packetBytes(p)
+            return bytes(out)
+        if packet >= len(SENSOR_DATA_WIDTH) or SENSOR_DATA_WIDTH[packet] == 0:
+            # unknown packets get no reply
+            return b''
+        return encodePacket(packet, self._packetValue(packet))
+
+    def _streamFrame(self):
+        frame = bytearray([STREAM_HEADER, 0])
+        for packet in self.streamPackets:
+            data = self._packetBytes(packet)
+            if data:
+                frame.append(packet)
+                frame += data
+        frame[1] = len(frame) - 2
+        frame.append(-sum(frame) & 0xFF)
+        return frame
+
+
+class PtyEmulator:
+    """ runs an OIEmulator behind a pseudo-terminal in a background
+    thread; open self.path like any serial port
+    """
+
+    def __init__(self, emulator=None):
+        self.emulator = emulator if emulator is not None else OIEmulator()
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, name='oi-emulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._running:
+            self._running = False
+            self._thread.join()
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _serve(self):
+        emulator = self.emulator
+        while self._running:
+            r, _, _ = select.select([self.master], [], [], STREAM_PERIOD / 3)
+            if r:
+                try:
+                    data = os.read(self.master, 4096)
+                except OSError:
+                    break
+                out = emulator.feed(data)
+            else:
+                out = emulator.poll()
+            if out:
+                os.write(self.master, out)
+
+
+def main():
+    """ roomba-sim: serve an emulated robot on a pty until Ctrl-C """
+    sim = PtyEmulator().start()
+    print('Emulated robot on', sim.path)
+    print('  e.g. roomba-cli', sim.path)
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.stop()
+        print('\nEmulator stopped after', sim.emulator.commands, 'commands.')
+
+
+if __name__ == '__main__':
+    main()
@@ -54,7 +54,6 @@ def main():
 	ROOMBA_PORT = sys.argv[1] if len(sys.argv) > 1 else None
 
 	robot = create.Create(ROOMBA_PORT)
-	robot.toSafeMode()
 
 	pygame.init()
 	size = width, height = 800, 600
@@ -170,8 +169,9 @@ def main():
 						update_roomba = True
 
 			if update_roomba == True:
-				robot.go_differential(robot_dir*FWD_SPEED,robot_rot*ROT_SPEED)
-				robot.motors(side_brush, main_brush, vacuum)
+				with robot.batch():
+					robot.go_differential(robot_dir*FWD_SPEED,robot_rot*ROT_SPEED)
+					robot.motors(side_brush, main_brush, vacuum)
 				time.sleep(0.1)
 
 			# done with the actual roomba stuff
@@ -0,0 +1,129 @@
+#
+# history.py
+#
+# A timestamped record of recent sensor replies, kept in NumPy.
+#
+# SensorHistory is a preallocated structured-array ring buffer with one
+# row per reply (or stream frame) of a fixed packet list. A row is the
+# reply's raw bytes, which the dtype reads as big-endian signed and
+# unsigned fields named as in SensorSnapshot, followed by the monotonic
+# time it was decoded and the pose (cm, cm, rad) after it:
+#
+#   h = robot.enableHistory([ENCODER_LEFT, ENCODER_RIGHT, VOLTAGE], 8192)
+#   ...
+#   rows = h.window(2.0)            # the last two seconds
+#   v = np.diff(rows['x']) / np.diff(rows['t'])
+#   rows['voltage'].mean()
+#
+# Every row is written twice, at i and i + capacity, so any run of up
+# to capacity consecutive rows is contiguous and the window methods
+# return views into the buffer rather than copies. A view stays valid
+# until capacity more rows have been recorded.
+#
+# Needs NumPy (pip install create-serial[numpy]); Create imports this
+# module only when enableHistory is called.
+
+import struct
+
+import numpy as np
+
+from .decoders import PACKET_KINDS
+from .snapshot import FIELD_NAMES
+
+_NUMPY_TYPE = {'bit': 'u1', 'lower5': 'u1', 'buttons': 'u1',
+               'B': 'u1', 'b': 'i1', 'H': '>u2', 'h': '>i2'}
+
+# t, x, y, th after the reply bytes
+_TRAILER = struct.Struct('=dddd')
+
+
+def replyDtype(packets, trailer=True):
+    """ the structured dtype of a reply of packets: one big-endian field
+    per packet at its offset in the reply, plus t, x, y and th when
+    trailer is True. Packets without data, and repeats, get no field.
+    """
+    names, formats, offsets = [], [], []
+    size = 0
+    for sensornum in packets:
+        kind = PACKET_KINDS[sensornum]
+        if kind is None:
+            continue
+        fmt = _NUMPY_TYPE[kind]
+        name = FIELD_NAMES[sensornum]
+        if name not in names:
+            names.append(name)
+            formats.append(fmt)
+            offsets.append(size)
+        size += np.dtype(fmt).itemsize
+    if trailer:
+        for name in ('t', 'x', 'y', 'th'):
+            names.append(name)
+            formats.append('=f8')
+            offsets.append(size)
+            size += 8
+    return np.dtype({'names': names, 'formats': formats,
+                     'offsets': offsets, 'itemsize': size})
+
+
+class SensorHistory:
+    """ the last capacity replies of one packet list; see the module
+    comment. Rows are oldest first in every view.
+    """
+
+    def __init__(self, packets, capacity=4096):
+        self.packets = tuple(packets)
+        self.capacity = int(capacity)
+        if self.capacity < 1:
+            raise ValueError('capacity must be at least 1')
+        self.dtype = replyDtype(self.packets)
+        self.replySize = self.dtype.itemsize - _TRAILER.size
+        self._rows = np.zeros(2 * self.capacity, dtype=self.dtype)
+        self._mem = memoryview(self._rows.view(np.uint8).reshape(-1))
+        self._next = 0          # where the next row goes, 0 .. capacity-1
+        self._count = 0         # rows recorded, at most capacity
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def append(self, t, reply, pose):
+        """ records one reply (replySize bytes) decoded at time t, after
+        which the robot's pose was pose = (x, y, th)
+        """
+        row = bytes(reply[:self.replySize]) + _TRAILER.pack(t, pose[0], pose[1], pose[2])
+        itemsize = len(row)
+        i = self._next
+        self._mem[i * itemsize:(i + 1) * itemsize] = row
+        j = i + self.capacity
+        self._mem[j * itemsize:(j + 1) * itemsize] = row
+        self._next = (i + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def latest(self, n=None):
+        """ a view of the last n rows (all of them by default) """
+        count = self._count
+        if n is None or n > count:
+            n = count
+        end = self._next + self.capacity if count == self.capacity else self._next
+        return self._rows[end - n:end]
+
+    def between(self, t0, t1):
+        """ a view of the rows with t0 <= t <= t1 """
+        rows = self.latest()
+        t = rows['t']
+        return rows[np.searchsorted(t, t0, 'left'):np.searchsorted(t, t1, 'right')]
+
+    def window(self, seconds, now=None):
+        """ a view of the rows from the last seconds before now
+        (the time of the newest row by default)
+        """
+        rows = self.latest()
+        if len(rows) == 0:
+            return rows
+        if now is None:
+            now = rows['t'][-1]
+        return self.between(now - seconds, now)
@@ -0,0 +1,235 @@
+#
+# iothread.py
+#
+# An optional background thread that owns the robot's port.
+#
+# Once Create.startIOThread() has been called, every command goes into a
+# priority queue instead of straight to the port, and the thread writes
+# them out most urgent first:
+#
+#   PRIORITY_SAFETY       stopping the wheels, mode changes
+#   PRIORITY_DRIVE        driving, scripts, brush motors
+#   PRIORITY_SENSORS      sensor queries and stream control
+#   PRIORITY_PERIPHERAL   LEDs, songs and everything else
+#
+# Commands of equal priority keep their order. A stop also throws away
+# any drive commands still waiting, so nothing queued before it can
+# start the wheels again. Between writes the thread reads whatever the
+# robot has sent and finishes sensor queries with it, so a slow reply
+# never holds up a stop.
+
+import heapq
+import threading
+import time
+from concurrent.futures import Future
+
+PRIORITY_SAFETY = 0
+PRIORITY_DRIVE = 1
+PRIORITY_SENSORS = 2
+PRIORITY_PERIPHERAL = 3
+
+PRIORITY_NAMES = ('safety', 'drive', 'sensors', 'peripheral')
+
+# how often the thread checks for replies while queries are outstanding
+# or a stream is running
+POLL_INTERVAL = 0.002
+
+_MODES = (128, 129, 130, 131, 132, 133)         # START ... POWER
+_DRIVES = (137, 145, 146)                       # DRIVE, DRIVEDIRECT, DRIVEPWM
+_MOTION = (137, 138, 144, 145, 146, 152, 153)   # + MOTORS, PWM, SCRIPT, play script
+_QUERIES = (142, 148, 149, 150)                 # SENSORS, STREAM, QUERYLIST, PAUSERESUME
+
+
+def _isStop(data):
+    """ True for a DRIVE with zero velocity, or a DRIVEDIRECT or
+    DRIVEPWM with both wheels at zero
+    """
+    if len(data) < 5 or data[0] not in _DRIVES:
+        return False
+    if data[0] == 137:
+        return data[1] == 0 and data[2] == 0
+    return not any(data[1:5])
+
+
+def commandPriority(data):
+    """ the queue priority of a write, from its first command """
+    opcode = data[0]
+    if opcode in _MODES or _isStop(data):
+        return PRIORITY_SAFETY
+    if opcode in _MOTION:
+        return PRIORITY_DRIVE
+    if opcode in _QUERIES:
+        return PRIORITY_SENSORS
+    return PRIORITY_PERIPHERAL
+
+
+class _Latency:
+    """ queueing delay statistics for one priority """
+
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+class IOThread:
+    """ the thread behind Create.startIOThread; see the module comment """
+
+    def __init__(self, robot):
+        self.robot = robot
+        self._heap = []         # (priority, seq, enqueued, data, query)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._running = False
+        self._latency = [_Latency() for name in PRIORITY_NAMES]
+        self.thread = None
+
+    def start(self):
+        self._running = True
+        self.thread = threading.Thread(target=self._run, name='create-io', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ writes out everything still queued, then ends the thread """
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self.thread.join()
+
+    def submit(self, data, priority=None):
+        """ queues a write; priority defaults to commandPriority(data) """
+        data = bytes(data)
+        if priority is None:
+            priority = commandPriority(data)
+        with self._cond:
+            if priority == PRIORITY_SAFETY and _isStop(data):
+                self._dropMotion()
+            self._push(priority, data, None)
+
+    def emergencyStop(self):
+        """ stops the wheels ahead of everything else queued """
+        self.submit(bytes([137, 0, 0, 0, 0]), PRIORITY_SAFETY)
+
+    def query(self, list_of_sensors_to_poll=6, timeout=0.5):
+        """ queues a sensor request; returns a concurrent.futures.Future
+        that resolves to the robot's sensord once the reply is decoded,
+        or raises TimeoutError if it does not arrive within timeout
+        seconds of being sent
+        """
+        future = Future()
+        self.robot.submit_query(list_of_sensors_to_poll, self._finished(future), timeout)
+        return future
+
+    def rawQuery(self, request, size, timeout=0.5):
+        """ like query, for a prepared request whose size byte reply
+        is read but not decoded
+        """
+        future = Future()
+        self.robot._submit(request, None, size, self._finished(future), timeout)
+        return future
+
+    def submitQuery(self, request, query):
+        """ queues request; query is added to the robot's pending
+        replies when the request is written. Its deadline holds the
+        timeout until then.
+        """
+        with self._cond:
+            self._push(PRIORITY_SENSORS, bytes(request), query)
+
+    def _finished(self, future):
+        robot = self.robot
+
+        def finished(query):
+            if query.timedOut:
+                future.set_exception(TimeoutError('no reply from the robot'))
+            else:
+                future.set_result(robot.sensord)
+        return finished
+
+    def depth(self):
+        """ number of writes and queries waiting to go out """
+        with self._cond:
+            return len(self._heap)
+
+    def stats(self):
+        """ queueing delay per priority name: count, mean and max seconds """
+        with self._cond:
+            return {name: {'count': lat.count,
+                           'mean': lat.total / lat.count if lat.count else 0.0,
+                           'max': lat.max}
+                    for name, lat in zip(PRIORITY_NAMES, self._latency)}
+
+    def _push(self, priority, data, query):
+        heapq.heappush(self._heap, (priority, self._seq, time.monotonic(), data, query))
+        self._seq += 1
+        self._cond.notify()
+
+    def _dropMotion(self):
+        """ forgets the queued drive commands (called holding _cond) """
+        kept = [item for item in self._heap
+                if item[0] != PRIORITY_DRIVE or item[3][0] not in _MOTION]
+        if len(kept) != len(self._heap):
+            heapq.heapify(kept)
+            self._heap = kept
+
+    def _run(self):
+        robot = self.robot
+        ser = robot.ser
+        while True:
+            with self._cond:
+                while (self._running and not self._heap and not robot._pending
+                       and not robot._streaming):
+                    self._cond.wait()
+                if not self._running and not self._heap and not self._waiting():
+                    break
+                item = heapq.heappop(self._heap) if self._heap else None
+                if item is not None and item[4] is not None and robot._staleUntil is not None:
+                    # what is left of a lost reply may still come; sensor
+                    # requests wait until _pump has thrown it away
+                    heapq.heappush(self._heap, item)
+                    item = None
+                if item is None:
+                    # only replies or frames to wait for; a new
+                    # command wakes us early
+                    self._cond.wait(POLL_INTERVAL)
+            if item is not None:
+                priority, seq, enqueued, data, query = item
+                if query is not None:
+                    # the timeout counts from when the request goes out
+                    if query.deadline is not None:
+                        query.deadline += time.monotonic()
+                    robot._pending.append(query)
+                ser.write(data)
+                self._latency[priority].add(time.monotonic() - enqueued)
+            self._pump()
+        # give up on replies that would never time out
+        while robot._pending:
+            query = robot._pending.popleft()
+            query.timedOut = query.done = True
+            if query.callback is not None:
+                query.callback(query)
+
+    def _waiting(self):
+        """ True while a sent query may still get its reply """
+        for query in self.robot._pending:
+            if query.deadline is not None:
+                return True
+        return False
+
+    def _pump(self):
+        """ reads what has arrived and finishes queries with it """
+        robot = self.robot
+        with robot._streamLock:
+            n = robot.ser.in_waiting
+            if n > 0:
+                robot._rx += robot.ser.read(n)
+            robot._completeQueries()
@@ -0,0 +1,97 @@
+#
+# odometry.py
+#
+# Wheel odometry over whole encoder recordings, with NumPy.
+#
+# integrateEncoders does what Create._integrateNextEncoderStep does one
+# sample at a time -- 16-bit wraparound, midpoint heading -- for entire
+# arrays of left and right encoder counts, and returns the pose after
+# every sample. The wheel geometry can be given as arrays of candidate
+# values, which are all integrated at once (NumPy broadcasting); that is
+# what calibrate uses to find the WHEEL_SPAN and WHEEL_DIAMETER that best
+# explain a recorded drive whose true end pose was measured:
+#
+#   x, y, th = integrateEncoders(cols['encoderLeft'], cols['encoderRight'])
+#   span, diameter, err = calibrate(left, right, (100.0, 0.0, 0.0),
+#                                   np.linspace(225, 245, 81),
+#                                   np.linspace(70, 74, 41))
+#
+# Needs NumPy (pip install create-serial[numpy]).
+
+import math
+
+import numpy as np
+
+from .create import WHEEL_SPAN, WHEEL_DIAMETER, TICK_PER_REVOLUTION
+
+
+def encoderDeltas(counts):
+    """ the tick differences between consecutive encoder counts,
+    unwrapping the 16-bit counter as _getEncoderDelta does
+    """
+    delta = np.diff(np.asarray(counts, dtype=np.int64), axis=-1)
+    delta = np.where(delta < -32768, delta + 65536, delta)
+    return np.where(delta > 32768, delta - 65536, delta)
+
+
+def integrateEncoders(left, right, start=(0.0, 0.0, 0.0), wheelSpan=WHEEL_SPAN,
+                      wheelDiameter=WHEEL_DIAMETER, dist='cm'):
+    """ returns arrays x, y, th: the pose at every encoder sample,
+    starting from start (x, y in dist units, th in radians) at the first
+    one. dist may be 'cm' or 'mm'; th is wrapped to [-pi, pi].
+    wheelSpan (mm) and wheelDiameter (mm) may be arrays of candidates
+    of one shape S; the results then have shape S + (len(left),).
+    """
+    scale = 10.0 if dist == 'cm' else 1.0
+    span = np.asarray(wheelSpan, dtype=float)[..., np.newaxis]
+    tickPerMm = TICK_PER_REVOLUTION / (math.pi * np.asarray(wheelDiameter, dtype=float))
+    tickPerMm = tickPerMm[..., np.newaxis]
+
+    left_mm = encoderDeltas(left) / tickPerMm
+    right_mm = encoderDeltas(right) / tickPerMm
+    distance = (left_mm + right_mm) / 2.0
+    dAngle = (right_mm - left_mm) / span
+
+    x0, y0, th0 = start
+    shape = np.broadcast(distance, dAngle).shape[:-1] + (len(left),)
+    if len(left) == 0:
+        return np.empty(shape), np.empty(shape), np.empty(shape)
+    th = np.empty(shape)
+    x = np.empty(shape)
+    y = np.empty(shape)
+    th[..., 0] = th0
+    x[..., 0] = x0 * scale
+    y[..., 0] = y0 * scale
+    # heading after each step, and the midpoint heading used for it
+    np.cumsum(dAngle, axis=-1, out=th[..., 1:])
+    th[..., 1:] += th0
+    mid = th[..., :-1] + dAngle / 2.0
+    np.cumsum(distance * np.cos(mid), axis=-1, out=x[..., 1:])
+    np.cumsum(distance * np.sin(mid), axis=-1, out=y[..., 1:])
+    x[..., 1:] += x0 * scale
+    y[..., 1:] += y0 * scale
+    th = np.arctan2(np.sin(th), np.cos(th))
+    return x / scale, y / scale, th
+
+
+def calibrate(left, right, endPose, wheelSpans, wheelDiameters,
+              start=(0.0, 0.0, 0.0), dist='cm'):
+    """ searches every combination of wheelSpans x wheelDiameters (mm)
+    for the geometry whose odometry over the recorded encoder counts
+    ends closest to endPose, the measured final (x, y, th) in dist units.
+    The error is the position error plus the heading error as arc
+    length at the wheel. Returns (wheelSpan, wheelDiameter, errors),
+    errors having one row per span and one column per diameter.
+    """
+    scale = 10.0 if dist == 'cm' else 1.0
+    spans = np.asarray(wheelSpans, dtype=float)
+    diameters = np.asarray(wheelDiameters, dtype=float)
+    span, diameter = np.meshgrid(spans, diameters, indexing='ij')
+    start = (start[0] * scale, start[1] * scale, start[2])
+    x, y, th = integrateEncoders(left, right, start, span, diameter, dist='mm')
+    x1, y1, th1 = endPose
+    dth = np.arctan2(np.sin(th[..., -1] - th1), np.cos(th[..., -1] - th1))
+    errors = (np.hypot(x[..., -1] - x1 * scale, y[..., -1] - y1 * scale)
+              + np.abs(dth) * span / 2.0) / scale
+    i, j = np.unravel_index(np.argmin(errors), errors.shape)
+    return spans[i], diameters[j], errors
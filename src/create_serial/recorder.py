@@ -0,0 +1,465 @@
+#
+# recorder.py
+#
+# Recording and replaying the bytes that pass between Create and the
+# robot.
+#
+# RecordingTransport wraps any transport and appends everything written
+# and read to a session log. The log is a small file header followed by
+# one record per write or read:
+#
+#   header   b'OIREC\x01\0\0', wall clock at the start (uint64 ns)
+#   record   time since the start (uint64 monotonic ns), direction
+#            (0 sent to the robot, 1 received from it, 2 received and
+#            thrown away by reset_input_buffer), length (uint16), then
+#            the bytes themselves
+#
+# all little-endian. A reset record, written even when nothing was
+# waiting, marks where the reader gave up on the replies still owed. SessionLog memory-maps a log and walks its records
+# without reading the file into memory, so multi-gigabyte captures can
+# be replayed. replaySession() decodes a log through a Create instance
+# (its _readSensorList and odometry); ReplayTransport serves the
+# received bytes back to a program that makes the same calls it made
+# while recording.
+
+import argparse
+import math
+import mmap
+import struct
+import threading
+import time
+
+from .commands import PAYLOAD_LENGTH
+from .create import (
+    Create, PASSIVE_MODE, SENSOR_DATA_WIDTH, SENSOR_GROUPS, find_port,
+)
+from .stream import StreamParser
+from .transport import Transport, openTransport
+
+LOG_MAGIC = b'OIREC\x01\0\0'
+_FILE_HEADER = struct.Struct('<8sQ')
+_RECORD = struct.Struct('<QBH')
+_MAX_RECORD = 0xFFFF
+
+TX = 0      # bytes sent to the robot
+RX = 1      # bytes received from the robot
+RESET = 2   # bytes received and thrown away unread
+
+_SONG = 140
+_SENSORS = 142
+_STREAM = 148
+_QUERYLIST = 149
+
+# what roomba-record asks for: every Create 2 packet from 7 to 51
+# except 16, which is unused
+RECORD_SENSORS = [p for p in range(7, 52) if p != 16]
+
+
+class RecordingTransport(Transport):
+    """ passes everything through to transport and logs it to log,
+    a path or a binary file object opened for writing
+    """
+
+    def __init__(self, transport, log):
+        self.transport = transport
+        if isinstance(log, (str, bytes)) or hasattr(log, '__fspath__'):
+            self._log = open(log, 'wb')
+            self._ownLog = True
+        else:
+            self._log = log
+            self._ownLog = False
+        self._lock = threading.Lock()
+        self._start = time.monotonic_ns()
+        self._log.write(_FILE_HEADER.pack(LOG_MAGIC, time.time_ns()))
+
+    def _record(self, direction, data):
+        t = time.monotonic_ns() - self._start
+        view = memoryview(data).cast('B')
+        with self._lock:
+            # an empty record still marks a reset
+            for i in range(0, max(len(view), 1), _MAX_RECORD):
+                chunk = view[i:i + _MAX_RECORD]
+                self._log.write(_RECORD.pack(t, direction, len(chunk)))
+                self._log.write(chunk)
+
+    @property
+    def timeout(self):
+        return self.transport.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self.transport.timeout = value
+
+    @property
+    def baudrate(self):
+        return self.transport.baudrate
+
+    @property
+    def is_open(self):
+        return self.transport.is_open
+
+    @property
+    def in_waiting(self):
+        return self.transport.in_waiting
+
+    def fileno(self):
+        return self.transport.fileno()
+
+    def write(self, data):
+        n = self.transport.write(data)
+        self._record(TX, data)
+        return n
+
+    def read(self, size=1):
+        data = self.transport.read(size)
+        if data:
+            self._record(RX, data)
+        return data
+
+    def readinto(self, buf):
+        n = self.transport.readinto(buf)
+        if n:
+            self._record(RX, memoryview(buf).cast('B')[:n])
+        return n
+
+    def reset_input_buffer(self):
+        # read what would be thrown away, so the log still has it
+        n = self.transport.in_waiting
+        data = self.transport.read(n) if n > 0 else b''
+        self.transport.reset_input_buffer()
+        self._record(RESET, data)
+
+    def flush(self):
+        """ pushes buffered records out to the log file """
+        with self._lock:
+            self._log.flush()
+
+    def close(self):
+        self.transport.close()
+        with self._lock:
+            if self._ownLog:
+                self._log.close()
+            else:
+                self._log.flush()
+
+
+class SessionLog:
+    """ a recorded session, memory-mapped read only
+
+    records() yields (t, direction, data) for every record, where t is
+    seconds since the recording started and data is a memoryview into
+    the map; copy it if it has to outlive the SessionLog.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise ValueError('%s is empty, not a session log' % path)
+        magic, self.startTime = _FILE_HEADER.unpack_from(self._map, 0)
+        if magic != LOG_MAGIC:
+            self.close()
+            raise ValueError('%s is not a session log' % path)
+        self.startTime /= 1e9   # wall clock, seconds since the epoch
+
+    def __len__(self):
+        """ size of the log in bytes """
+        return len(self._map)
+
+    def records(self, direction=None):
+        view = memoryview(self._map)
+        try:
+            pos = _FILE_HEADER.size
+            end = len(view)
+            unpack = _RECORD.unpack_from
+            while pos + _RECORD.size <= end:
+                t, d, n = unpack(view, pos)
+                pos += _RECORD.size
+                if pos + n > end:
+                    break       # cut off while recording
+                if direction is None or d == direction:
+                    yield (t / 1e9, d, view[pos:pos + n])
+                pos += n
+        finally:
+            view.release()
+
+    def duration(self):
+        """ seconds between the start and the last record """
+        last = 0.0
+        for t, _, _ in self.records():
+            last = t
+        return last
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ReplayTransport(Transport):
+    """ a read-only port serving the bytes received in a session log
+
+    Writes are accepted and dropped. With realtime=True every received
+    chunk becomes readable only once as much time has passed since the
+    ReplayTransport was created as had passed in the recording, so a
+    program sees the robot's original timing; otherwise everything is
+    readable at once. After the last chunk reads time out as they would
+    on a silent port.
+    """
+
+    def __init__(self, log, realtime=False, timeout=0.5):
+        self.log = log if isinstance(log, SessionLog) else SessionLog(log)
+        self.realtime = realtime
+        self.timeout = timeout
+        self.written = 0
+        self._records = self.log.records(RX)
+        self._chunk = b''
+        self._due = 0.0
+        self._start = time.monotonic()
+        self.exhausted = False
+        self._next()
+
+    def _next(self):
+        for t, _, data in self._records:
+            self._chunk = data
+            self._due = t
+            return
+        self._chunk = b''
+        self.exhausted = True
+
+    def _ready(self):
+        if not self._chunk:
+            return False
+        return not self.realtime or time.monotonic() - self._start >= self._due
+
+    def write(self, data):
+        n = len(memoryview(data).cast('B'))
+        self.written += n
+        return n
+
+    @property
+    def in_waiting(self):
+        return len(self._chunk) if self._ready() else 0
+
+    def _readSome(self, view, timeout):
+        if not self._ready():
+            if self.exhausted:
+                wait = timeout
+            else:
+                wait = self._due - (time.monotonic() - self._start)
+                if timeout is not None:
+                    wait = min(wait, timeout)
+            if wait:
+                time.sleep(max(wait, 0.0))
+            if not self._ready():
+                return 0
+        n = min(len(view), len(self._chunk))
+        view[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        if not self._chunk:
+            self._next()
+        return n
+
+    def reset_input_buffer(self):
+        # the bytes recorded after a reset are still wanted
+        pass
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            self._records.close()
+            self._chunk = b''
+            self.log.close()
+
+
+def _replyLayout(packet):
+    """ the packet ids the robot answers with for SENSORS packet """
+    if packet in SENSOR_GROUPS:
+        return list(SENSOR_GROUPS[packet])
+    if packet < len(SENSOR_DATA_WIDTH) and SENSOR_DATA_WIDTH[packet]:
+        return [packet]
+    return []
+
+
+def _splitCommands(buf):
+    """ takes the complete commands off the front of buf and returns
+    them as (opcode, payload) pairs; an incomplete command is left
+    """
+    commands = []
+    i = 0
+    while i < len(buf):
+        opcode = buf[i]
+        if opcode not in PAYLOAD_LENGTH:
+            i += 1      # not a command
+            continue
+        n = PAYLOAD_LENGTH[opcode]
+        if n is None:
+            if opcode == _SONG:     # number, count, note pairs
+                if i + 2 >= len(buf):
+                    break
+                n = 2 + 2 * buf[i+2]
+            else:                   # STREAM, QUERYLIST, SCRIPT: count, bytes
+                if i + 1 >= len(buf):
+                    break
+                n = 1 + buf[i+1]
+        if i + 1 + n > len(buf):
+            break
+        commands.append((opcode, bytes(buf[i+1:i+1+n])))
+        i += 1 + n
+    del buf[:i]
+    return commands
+
+
+def replaySession(log, robot, realtime=False, callback=None):
+    """ decodes every sensor reply in log through robot, a Create,
+    updating its sensord and pose exactly as the live session did.
+
+    The commands sent in the session say what each reply holds:
+    SENSORS and QUERYLIST replies are matched to their requests in
+    order, and anything received while no reply is outstanding goes
+    through the STREAM frame parser. A reset record means the session
+    gave up on the replies still owed, unanswered or short, so they
+    are dropped too and the next reply is matched to the next request. With realtime=True the replay
+    sleeps to keep the recorded timing. callback, if given, is called
+    as callback(t, robot.sensord) after every decoded reply.
+
+    returns the number of replies decoded
+    """
+    if not isinstance(log, SessionLog):
+        with SessionLog(log) as opened:
+            return replaySession(opened, robot, realtime, callback)
+    pending = []        # packet lists of the replies still owed
+    tx = bytearray()
+    rx = bytearray()
+    parser = StreamParser(SENSOR_DATA_WIDTH)
+    decoded = 0
+    start = time.monotonic()
+
+    for t, direction, data in log.records():
+        if realtime:
+            wait = t - (time.monotonic() - start)
+            if wait > 0:
+                time.sleep(wait)
+
+        if direction == RESET:
+            del pending[:]
+            del rx[:]
+            parser.reset()
+            continue
+
+        if direction == TX:
+            tx += data
+            for opcode, payload in _splitCommands(tx):
+                if opcode == _SENSORS:
+                    layout = _replyLayout(payload[0])
+                elif opcode == _QUERYLIST:
+                    layout = []
+                    for packet in payload[1:]:
+                        layout += _replyLayout(packet)
+                elif opcode == _STREAM:
+                    # a new stream layout; a half frame is stale now
+                    parser.reset()
+                    continue
+                else:
+                    continue
+                if layout:
+                    pending.append(layout)
+            continue
+
+        rx += data
+        while pending:
+            layout = pending[0]
+            size = sum(SENSOR_DATA_WIDTH[p] for p in layout)
+            if len(rx) < size:
+                break
+            del pending[0]
+            robot._readSensorList(layout, rx[:size])
+            del rx[:size]
+            decoded += 1
+            if callback is not None:
+                callback(t, robot.sensord)
+        if not pending and rx:
+            for packets, payload in parser.feed(rx):
+                robot._readSensorList(packets, payload)
+                decoded += 1
+                if callback is not None:
+                    callback(t, robot.sensord)
+            del rx[:]
+    return decoded
+
+
+def record_main():
+    """ roomba-record: log a sensor session to a file until Ctrl-C """
+    parser = argparse.ArgumentParser(description='Record the serial traffic of a sensor session.')
+    parser.add_argument('log', help='session log to write')
+    parser.add_argument('port', nargs='?', help="serial port or transport URL; 'sim' for the emulator")
+    parser.add_argument('--interval', type=float, default=0.05,
+                        help='seconds between sensor polls (default 0.05)')
+    parser.add_argument('--stream', action='store_true',
+                        help='use the STREAM command instead of polling')
+    args = parser.parse_args()
+
+    emulator = None
+    port = args.port if args.port is not None else find_port()
+    if port == 'sim':
+        from .emulator import PtyEmulator
+        emulator = PtyEmulator().start()
+        port = emulator.path
+    ser = RecordingTransport(openTransport(port, timeout=0.5), args.log)
+    robot = Create(ser, startingMode=PASSIVE_MODE)
+    try:
+        if args.stream:
+            robot.startStream(RECORD_SENSORS)
+        while True:
+            if not args.stream:
+                robot.sensors(list(RECORD_SENSORS))
+            x, y, th = robot.getPose()
+            print('\rx %8.1f cm  y %8.1f cm  th %7.1f deg' % (x, y, math.degrees(th)),
+                  end='', flush=True)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        robot.close()
+        if emulator is not None:
+            emulator.stop()
+    print('\nSession written to', args.log)
+
+
+def replay_main():
+    """ roomba-replay: decode a session log and report the odometry """
+    parser = argparse.ArgumentParser(description='Decode a recorded session through Create.')
+    parser.add_argument('log', help='session log written by roomba-record')
+    parser.add_argument('--realtime', action='store_true',
+                        help='replay at the recorded speed instead of as fast as possible')
+    parser.add_argument('--verbose', action='store_true',
+                        help='print the pose after every reply')
+    args = parser.parse_args()
+
+    def showPose(t, sensord):
+        x, y, th = robot.getPose()
+        print('%10.3f s  x %8.1f cm  y %8.1f cm  th %7.1f deg' % (t, x, y, math.degrees(th)))
+
+    with SessionLog(args.log) as log:
+        robot = Create(ReplayTransport(log), startingMode=PASSIVE_MODE)
+        started = time.monotonic()
+        replies = replaySession(log, robot, realtime=args.realtime,
+                                callback=showPose if args.verbose else None)
+        elapsed = time.monotonic() - started
+        duration = log.duration()
+        size = len(log)
+        robot.ser.close()
+    x, y, th = robot.getPose()
+    print('%d replies decoded from %d bytes covering %.1f s, in %.2f s'
+          % (replies, size, duration, elapsed))
+    print('final pose: x %.1f cm  y %.1f cm  th %.1f deg' % (x, y, math.degrees(th)))
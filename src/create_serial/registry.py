@@ -0,0 +1,184 @@
+#
+# registry.py
+#
+# The one table of what the robot's sensor packets are.
+#
+# Each packet has a row: its id, the constant create.py names it by, its
+# SensorSnapshot field, how its bytes are read (kind) and the unit of
+# the value the robot sends. The bits sensors() also reports on their
+# own (LEFT_BUMP, PLAY_BUTTON, ...) have a row naming the packet and bit
+# they come from. Everything else is built from these rows when the
+# package is imported:
+#
+#   SENSOR_DATA_WIDTH          create.py, the stream parser, the emulator
+#   PACKET_KINDS               decoders.compileDecoder, LazyFrame, NumPy
+#   FIELD_NAMES                SensorSnapshot's slots, batch column names
+#   DERIVED_BITS               the bitfield aliases everywhere
+#   encodePacket/encodeReply   the robot's side, for simulators and tests
+#   formatSensors              Create.printSensors
+#
+# so a new packet is one more line in PACKETS.
+#
+# The kinds:
+#   'bit'      1 byte, 1 if the byte is 1 else 0
+#   'lower5'   1 byte, its low 5 bits as a list, bit 4 first
+#   'buttons'  1 byte, bits 2 and 0 as a list
+#   'B' 'b'    1 byte unsigned / signed
+#   'H' 'h'    2 bytes big-endian unsigned / signed
+
+import collections
+
+SensorSpec = collections.namedtuple('SensorSpec', 'id constant name kind unit width signed')
+
+#          id  constant                      field                       kind       unit
+PACKETS = (
+    (7,  'BUMPS_AND_WHEEL_DROPS',      'bumpsAndWheelDrops',       'lower5',  None),
+    (8,  'WALL_IR_SENSOR',             'wallIrSensor',             'bit',     None),
+    (9,  'CLIFF_LEFT',                 'cliffLeft',                'bit',     None),
+    (10, 'CLIFF_FRONT_LEFT',           'cliffFrontLeft',           'bit',     None),
+    (11, 'CLIFF_FRONT_RIGHT',          'cliffFrontRight',          'bit',     None),
+    (12, 'CLIFF_RIGHT',                'cliffRight',               'bit',     None),
+    (13, 'VIRTUAL_WALL',               'virtualWall',              'bit',     None),
+    (14, 'LSD_AND_OVERCURRENTS',       'lsdAndOvercurrents',       'lower5',  None),
+    (15, 'DIRT_DETECTED',              'dirtDetected',             'bit',     None),
+    (16, None,                         'unused16',                 'bit',     None),
+    (17, 'INFRARED_BYTE',              'infraredByte',             'B',       None),
+    (18, 'BUTTONS',                    'buttons',                  'buttons', None),
+    (19, 'DISTANCE',                   'distance',                 'h',       'mm'),
+    (20, 'ANGLE',                      'angle',                    'h',       'deg'),
+    (21, 'CHARGING_STATE',             'chargingState',            'B',       None),
+    (22, 'VOLTAGE',                    'voltage',                  'H',       'mV'),
+    (23, 'CURRENT',                    'current',                  'h',       'mA'),
+    (24, 'BATTERY_TEMP',               'batteryTemp',              'b',       'C'),
+    (25, 'BATTERY_CHARGE',             'batteryCharge',            'H',       'mAh'),
+    (26, 'BATTERY_CAPACITY',           'batteryCapacity',          'H',       'mAh'),
+    (27, 'WALL_SIGNAL',                'wallSignal',               'H',       None),
+    (28, 'CLIFF_LEFT_SIGNAL',          'cliffLeftSignal',          'H',       None),
+    (29, 'CLIFF_FRONT_LEFT_SIGNAL',    'cliffFrontLeftSignal',     'H',       None),
+    (30, 'CLIFF_FRONT_RIGHT_SIGNAL',   'cliffFrontRightSignal',    'H',       None),
+    (31, 'CLIFF_RIGHT_SIGNAL',         'cliffRightSignal',         'H',       None),
+    (32, 'CARGO_BAY_DIGITAL_INPUTS',   'cargoBayDigitalInputs',    'lower5',  None),
+    (33, 'CARGO_BAY_ANALOG_SIGNAL',    'cargoBayAnalogSignal',     'H',       None),
+    (34, 'CHARGING_SOURCES_AVAILABLE', 'chargingSourcesAvailable', 'B',       None),
+    (35, 'OI_MODE',                    'oiMode',                   'B',       None),
+    (36, 'SONG_NUMBER',                'songNumber',               'B',       None),
+    (37, 'SONG_PLAYING',               'songPlaying',              'B',       None),
+    (38, 'NUM_STREAM_PACKETS',         'numStreamPackets',         'B',       None),
+    (39, 'REQUESTED_VELOCITY',         'requestedVelocity',        'h',       'mm/s'),
+    (40, 'REQUESTED_RADIUS',           'requestedRadius',          'h',       'mm'),
+    (41, 'REQUESTED_RIGHT_VELOCITY',   'requestedRightVelocity',   'h',       'mm/s'),
+    (42, 'REQUESTED_LEFT_VELOCITY',    'requestedLeftVelocity',    'h',       'mm/s'),
+    (43, 'ENCODER_LEFT',               'encoderLeft',              'H',       'ticks'),
+    (44, 'ENCODER_RIGHT',              'encoderRight',             'H',       'ticks'),
+    (45, 'LIGHTBUMP',                  'lightBump',                'B',       None),
+    (46, 'LIGHTBUMP_LEFT',             'lightBumpLeft',            'H',       None),
+    (47, 'LIGHTBUMP_FRONT_LEFT',       'lightBumpFrontLeft',       'H',       None),
+    (48, 'LIGHTBUMP_CENTER_LEFT',      'lightBumpCenterLeft',      'H',       None),
+    (49, 'LIGHTBUMP_CENTER_RIGHT',     'lightBumpCenterRight',     'H',       None),
+    (50, 'LIGHTBUMP_FRONT_RIGHT',      'lightBumpFrontRight',      'H',       None),
+    (51, 'LIGHTBUMP_RIGHT',            'lightBumpRight',           'H',       None),
+    (52, 'INFRARED_CHARACTER_LEFT',    'infraredCharacterLeft',    'B',       None),
+    (53, 'INFRARED_CHARACTER_RIGHT',   'infraredCharacterRight',   'B',       None),
+    (54, 'LEFT_MOTOR_CURRENT',         'leftMotorCurrent',         'h',       'mA'),
+    (55, 'RIGHT_MOTOR_CURRENT',        'rightMotorCurrent',        'h',       'mA'),
+    (56, 'MAIN_BRUSH_MOTOR_CURRENT',   'mainBrushMotorCurrent',    'h',       'mA'),
+    (57, 'SIDE_BRUSH_MOTOR_CURRENT',   'sideBrushMotorCurrent',    'h',       'mA'),
+    (58, 'STASIS',                     'stasis',                   'B',       None),
+)
+
+# the single bits sensors() reports by themselves
+#          id   constant                    field                    packet bit
+BITS = (
+    (101, 'LEFT_BUMP',               'leftBump',              7,  1),
+    (102, 'RIGHT_BUMP',              'rightBump',             7,  0),
+    (103, 'LEFT_WHEEL_DROP',         'leftWheelDrop',         7,  3),
+    (104, 'RIGHT_WHEEL_DROP',        'rightWheelDrop',        7,  2),
+    (105, 'CENTER_WHEEL_DROP',       'centerWheelDrop',       7,  4),
+    (106, 'LEFT_WHEEL_OVERCURRENT',  'leftWheelOvercurrent',  14, 4),
+    (107, 'RIGHT_WHEEL_OVERCURRENT', 'rightWheelOvercurrent', 14, 3),
+    (108, 'ADVANCE_BUTTON',          'advanceButton',         18, 2),
+    (109, 'PLAY_BUTTON',             'playButton',            18, 0),
+)
+
+# (x cm, y cm, th rad) from the odometry, not a packet of its own
+POSE_ID = 100
+
+_WIDTH = {'bit': 1, 'lower5': 1, 'buttons': 1, 'B': 1, 'b': 1, 'H': 2, 'h': 2}
+
+# the bits a list-valued kind holds, in list order
+LIST_BITS = {'lower5': (4, 3, 2, 1, 0), 'buttons': (2, 0)}
+
+SPECS = {sensornum: SensorSpec(sensornum, constant, name, kind, unit,
+                               _WIDTH[kind], kind in ('b', 'h'))
+         for sensornum, constant, name, kind, unit in PACKETS}
+
+# widths and kinds indexed by id; 0-6 are the groups and carry no data
+SENSOR_DATA_WIDTH = [0] * (max(SPECS) + 1)
+_kinds = [None] * (max(SPECS) + 1)
+for _spec in SPECS.values():
+    SENSOR_DATA_WIDTH[_spec.id] = _spec.width
+    _kinds[_spec.id] = _spec.kind
+PACKET_KINDS = tuple(_kinds)
+del _kinds, _spec
+
+FIELD_NAMES = {spec.id: spec.name for spec in SPECS.values()}
+FIELD_NAMES[POSE_ID] = 'pose'
+FIELD_NAMES.update((sensornum, name) for sensornum, _, name, _, _ in BITS)
+
+# packet id -> ((derived id, index in the packet's list, bit), ...)
+DERIVED_BITS = {}
+for _sensornum, _, _, _packet, _bit in BITS:
+    _index = LIST_BITS[PACKET_KINDS[_packet]].index(_bit)
+    DERIVED_BITS.setdefault(_packet, []).append((_sensornum, _index, _bit))
+DERIVED_BITS = {packet: tuple(sorted(bits, key=lambda b: b[1]))
+                for packet, bits in DERIVED_BITS.items()}
+del _sensornum, _packet, _bit, _index
+
+
+def encodePacket(sensornum, value):
+    """ the bytes the robot sends for packet sensornum holding value:
+    an int as the robot has it, or for the list-valued kinds the list
+    sensors() returns
+    """
+    spec = SPECS.get(sensornum)
+    if spec is None:
+        return b''
+    if isinstance(value, (list, tuple)):
+        raw = 0
+        for bit, set_ in zip(LIST_BITS[spec.kind], value):
+            raw |= (1 if set_ else 0) << bit
+        value = raw
+    value = int(value) & ((1 << (8 * spec.width)) - 1)
+    return value.to_bytes(spec.width, 'big')
+
+
+def encodeReply(packets, values):
+    """ the reply to a QUERYLIST of packets: values maps each id to its
+    value (a SensorSnapshot or dict will do; missing ids send 0)
+    """
+    return b''.join(encodePacket(p, values.get(p, 0)) for p in packets)
+
+
+# what printSensors shows, (label, id, unit suffix) per line: every
+# packet but the bitfields, which are printed bit by bit after them
+_LINES = tuple([(spec.constant, spec.id, ' ' + spec.unit if spec.unit else '')
+                for spec in SPECS.values()
+                if spec.constant is not None and spec.id not in DERIVED_BITS]
+               + [(constant, sensornum, '') for sensornum, constant, _, _, _ in BITS])
+PRINTED_SENSORS = [sensornum for _, sensornum, _ in _LINES] + [POSE_ID]
+
+
+def formatSensors(d):
+    """ the lines printSensors prints for d, a SensorSnapshot: one per
+    sensor in d, with its unit, and the pose
+    """
+    lines = []
+    for constant, sensornum, unit in _LINES:
+        if sensornum in d:
+            lines.append('%28s: %s%s' % (constant, d[sensornum], unit))
+    pose = d.get(POSE_ID)
+    if pose is not None:
+        lines.append('%28s: %s' % ('POSE X (cm)', pose[0]))
+        lines.append('%28s: %s' % ('POSE Y (cm)', pose[1]))
+        lines.append('%28s: %s' % ('POSE TH (rad)', pose[2]))
+    return lines
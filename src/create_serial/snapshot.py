@@ -0,0 +1,112 @@
+#
+# snapshot.py
+#
+# SensorSnapshot, the fixed-layout record that holds a robot's sensor
+# values (Create.sensord).
+#
+# Every packet, the derived bump / wheel drop / overcurrent / button
+# bits and the pose (FIELD_NAMES, from registry.py) have a slot, so a
+# snapshot is a few hundred bytes with no per-instance dict, and the
+# decoders store into it with plain attribute assignments. It still
+# reads like the old int-keyed dict:
+#
+#   d = robot.sensors([VOLTAGE, LEFT_BUMP])
+#   d[VOLTAGE] == d.voltage
+#   d.get(LEFT_BUMP), VOLTAGE in d, dict(d), d.items()
+#
+# A field that has not been read yet is missing, as a dict key would be.
+
+from collections.abc import MutableMapping
+
+from .registry import FIELD_NAMES
+
+_IDS = tuple(FIELD_NAMES)
+_FIELDS = tuple(FIELD_NAMES.values())
+
+
+class SensorSnapshot(MutableMapping):
+    """ sensor values with a slot per sensor; see the module comment.
+    Ids without a field of their own (the group packets 0-6) are kept
+    in a small dict on the side.
+    """
+
+    __slots__ = _FIELDS + ('_extra',)
+
+    def __init__(self, values=()):
+        self._extra = None
+        for sensornum, value in dict(values).items():
+            self[sensornum] = value
+
+    def __getitem__(self, sensornum):
+        name = FIELD_NAMES.get(sensornum)
+        if name is None:
+            if self._extra is None:
+                raise KeyError(sensornum)
+            return self._extra[sensornum]
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(sensornum) from None
+
+    def __setitem__(self, sensornum, value):
+        name = FIELD_NAMES.get(sensornum)
+        if name is None:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[sensornum] = value
+        else:
+            setattr(self, name, value)
+
+    def __delitem__(self, sensornum):
+        name = FIELD_NAMES.get(sensornum)
+        if name is None:
+            if self._extra is None:
+                raise KeyError(sensornum)
+            del self._extra[sensornum]
+            return
+        try:
+            delattr(self, name)
+        except AttributeError:
+            raise KeyError(sensornum) from None
+
+    def __contains__(self, sensornum):
+        name = FIELD_NAMES.get(sensornum)
+        if name is None:
+            return self._extra is not None and sensornum in self._extra
+        return hasattr(self, name)
+
+    def get(self, sensornum, default=None):
+        name = FIELD_NAMES.get(sensornum)
+        if name is None:
+            return default if self._extra is None else self._extra.get(sensornum, default)
+        return getattr(self, name, default)
+
+    def __iter__(self):
+        for sensornum, name in zip(_IDS, _FIELDS):
+            if hasattr(self, name):
+                yield sensornum
+        if self._extra:
+            yield from list(self._extra)
+
+    def __len__(self):
+        n = 0
+        for name in _FIELDS:
+            if hasattr(self, name):
+                n += 1
+        return n + (len(self._extra) if self._extra else 0)
+
+    def copy(self):
+        """ a snapshot of the values as they are now (a shallow copy) """
+        other = SensorSnapshot.__new__(SensorSnapshot)
+        other._extra = dict(self._extra) if self._extra else None
+        for name in _FIELDS:
+            try:
+                setattr(other, name, getattr(self, name))
+            except AttributeError:
+                pass
+        return other
+
+    __copy__ = copy
+
+    def __repr__(self):
+        return 'SensorSnapshot(%r)' % dict(self)
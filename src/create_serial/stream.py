@@ -0,0 +1,102 @@
+#
+# stream.py
+#
+# Incremental parser for the frames the robot sends back after the
+# STREAM command (opcode 148). Every 15 ms the robot sends
+#
+#   [19] [n] [id1] [data1...] [id2] [data2...] ... [checksum]
+#
+# where n counts the id and data bytes and the low byte of the sum of
+# all bytes, checksum included, is 0.
+
+STREAM_HEADER = 19
+STREAM_PERIOD = 0.015   # seconds between frames
+
+
+class StreamParser:
+    """ turns an arbitrarily chunked byte stream into complete frames
+
+    widths is the per-packet-id data width table (SENSOR_DATA_WIDTH).
+    feed() returns a list of (ids, payload) pairs, one per good frame,
+    where payload holds just the data bytes of the packets in ids order,
+    i.e. exactly what a QUERYLIST of ids would have returned.
+    Frames with a bad checksum or layout are dropped and the parser
+    resynchronizes on the next header byte.
+    """
+
+    def __init__(self, widths):
+        self.widths = widths
+        self._buf = bytearray()
+        self.frames = 0   # good frames seen
+        self.errors = 0   # frames dropped while resynchronizing
+
+    def reset(self):
+        """ throws away any partially received frame """
+        del self._buf[:]
+
+    def pending(self):
+        """ number of buffered bytes not yet part of a complete frame """
+        return len(self._buf)
+
+    def feed(self, data):
+        buf = self._buf
+        buf += data
+        frames = []
+        start = 0
+        while True:
+            start = buf.find(STREAM_HEADER, start)
+            if start < 0:
+                del buf[:]
+                break
+            if len(buf) - start < 2:
+                del buf[:start]
+                break
+            n = buf[start+1]
+            end = start + n + 3
+            if len(buf) < end:
+                del buf[:start]
+                break
+            frame = self._parseFrame(buf, start, n, end)
+            if frame is None:
+                # not a real header after all, look for the next one
+                self.errors += 1
+                start += 1
+                continue
+            frames.append(frame)
+            self.frames += 1
+            start = end
+        return frames
+
+    def _parseFrame(self, buf, start, n, end):
+        """ returns (ids, payload) or None if this is not a valid frame """
+        if sum(buf[start:end]) & 0xFF != 0:
+            return None
+        widths = self.widths
+        ids = []
+        payload = bytearray()
+        i = start + 2
+        last = end - 1     # index of the checksum
+        while i < last:
+            packet = buf[i]
+            if packet >= len(widths) or widths[packet] == 0:
+                return None
+            width = widths[packet]
+            if i + 1 + width > last:
+                return None
+            ids.append(packet)
+            payload += buf[i+1:i+1+width]
+            i += 1 + width
+        return (ids, bytes(payload))
+
+
+def encodeStreamFrame(packets):
+    """ builds the frame the robot would send for packets, a list of
+    (id, data bytes) pairs; handy for simulators and tests
+    """
+    frame = bytearray([STREAM_HEADER, 0])
+    for packet, data in packets:
+        frame.append(packet)
+        frame += data
+    frame[1] = len(frame) - 2
+    frame.append(-sum(frame) & 0xFF)
+    return bytes(frame)
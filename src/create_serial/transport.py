@@ -0,0 +1,352 @@
+#
+# transport.py
+#
+# The byte pipes Create can talk to the robot through.
+#
+# Create only needs a handful of operations from its port: write,
+# read/readinto (blocking up to a timeout), in_waiting, fileno and
+# close. These are the same names pyserial uses, so a serial.Serial or
+# anything else that provides them can be passed to Create directly.
+#
+#   SerialTransport     pyserial (the default)
+#   PosixTTYTransport   a raw POSIX tty file descriptor, no pyserial
+#   TCPTransport        a TCP socket, e.g. to a ser2net bridge
+#   LoopbackTransport   in memory, optionally answered by a peer object
+#
+# openTransport() picks one from a port string.
+
+import errno
+import fcntl
+import io
+import os
+import select
+import socket
+import struct
+import termios
+import threading
+import time
+
+import serial
+
+
+class Transport:
+    """ base class for the transports; subclasses provide write,
+    _readSome, in_waiting, fileno and close, and get the blocking
+    read/readinto, reset_input_buffer and the pyserial-style aliases
+    from here
+    """
+
+    timeout = 0.5       # seconds read/readinto wait for the full size
+    baudrate = None     # line rate, if there is one
+    is_open = True
+
+    def write(self, data):
+        """ sends all of data; returns the number of bytes written """
+        raise NotImplementedError
+
+    def _readSome(self, view, timeout):
+        """ reads at most len(view) bytes into view, waiting up to
+        timeout seconds for the first one; returns the count (0 on timeout)
+        """
+        raise NotImplementedError
+
+    @property
+    def in_waiting(self):
+        """ number of bytes that can be read without blocking """
+        raise NotImplementedError
+
+    def fileno(self):
+        raise io.UnsupportedOperation('fileno')
+
+    def close(self):
+        self.is_open = False
+
+    def readinto(self, buf):
+        """ fills buf, waiting up to timeout for all of it;
+        returns the number of bytes read
+        """
+        view = memoryview(buf).cast('B')
+        size = len(view)
+        got = 0
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        # the first try even with a zero timeout: like pyserial, that
+        # returns what has already arrived
+        remaining = self.timeout
+        while got < size:
+            got += self._readSome(view[got:], remaining)
+            if deadline is not None and got < size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+        return got
+
+    def read(self, size=1):
+        """ reads size bytes, or fewer if the timeout runs out """
+        buf = bytearray(size)
+        n = self.readinto(buf)
+        del buf[n:]
+        return bytes(buf)
+
+    def reset_input_buffer(self):
+        """ throws away anything received but not yet read """
+        n = self.in_waiting
+        while n > 0:
+            self._readSome(memoryview(bytearray(n)), 0)
+            n = self.in_waiting
+
+    # the older pyserial spellings Create has always used
+    def inWaiting(self):
+        return self.in_waiting
+
+    def isOpen(self):
+        return self.is_open
+
+
+class SerialTransport(Transport):
+    """ a pyserial port; the hot methods are bound straight to the
+    serial.Serial object so this adds no call overhead
+    """
+
+    def __init__(self, port, baudrate=115200, timeout=0.5):
+        self._ser = serial.Serial(port, baudrate=baudrate, timeout=timeout)
+        self.baudrate = baudrate
+        self.write = self._ser.write
+        self.read = self._ser.read
+        self.readinto = self._ser.readinto
+        self.fileno = self._ser.fileno
+        self.reset_input_buffer = self._ser.reset_input_buffer
+
+    @property
+    def timeout(self):
+        return self._ser.timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._ser.timeout = value
+
+    @property
+    def in_waiting(self):
+        return self._ser.in_waiting
+
+    @property
+    def is_open(self):
+        return self._ser.isOpen()
+
+    def open(self):
+        self._ser.open()
+
+    def close(self):
+        self._ser.close()
+
+
+def _bytesReadable(fd):
+    """ FIONREAD: bytes waiting on a tty or socket file descriptor """
+    buf = fcntl.ioctl(fd, termios.FIONREAD, b'\0\0\0\0')
+    return struct.unpack('i', buf)[0]
+
+
+class _FdTransport(Transport):
+    """ shared code for the transports built on a non-blocking fd """
+
+    _fd = -1
+
+    def fileno(self):
+        return self._fd
+
+    @property
+    def in_waiting(self):
+        return _bytesReadable(self._fd)
+
+    def _waitReadable(self, timeout):
+        r, _, _ = select.select([self._fd], [], [], timeout)
+        return bool(r)
+
+    def _waitWritable(self):
+        select.select([], [self._fd], [], self.timeout)
+
+
+class PosixTTYTransport(_FdTransport):
+    """ a serial device driven directly through its file descriptor
+    with termios and os.read/os.write, skipping pyserial
+    """
+
+    def __init__(self, path, baudrate=115200, timeout=0.5):
+        speed = getattr(termios, 'B%d' % baudrate, None)
+        if speed is None:
+            raise ValueError('unsupported baud rate %r' % baudrate)
+        self._fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            self._configure(speed)
+        except termios.error:
+            os.close(self._fd)
+            raise
+        self.path = path
+        self.baudrate = baudrate
+        self.timeout = timeout
+
+    def _configure(self, speed):
+        """ 8N1, raw, no flow control, at speed """
+        iflag, oflag, cflag, lflag, ispeed, ospeed, cc = termios.tcgetattr(self._fd)
+        iflag &= ~(termios.IGNBRK | termios.BRKINT | termios.PARMRK | termios.ISTRIP |
+                   termios.INLCR | termios.IGNCR | termios.ICRNL | termios.IXON |
+                   termios.IXOFF | termios.IXANY | termios.INPCK)
+        oflag &= ~termios.OPOST
+        lflag &= ~(termios.ECHO | termios.ECHONL | termios.ICANON | termios.ISIG |
+                   termios.IEXTEN)
+        cflag &= ~(termios.CSIZE | termios.PARENB | termios.CSTOPB)
+        if hasattr(termios, 'CRTSCTS'):
+            cflag &= ~termios.CRTSCTS
+        cflag |= termios.CS8 | termios.CREAD | termios.CLOCAL
+        cc[termios.VMIN] = 0
+        cc[termios.VTIME] = 0
+        termios.tcsetattr(self._fd, termios.TCSANOW,
+                          [iflag, oflag, cflag, lflag, speed, speed, cc])
+        termios.tcflush(self._fd, termios.TCIOFLUSH)
+
+    def write(self, data):
+        view = memoryview(data).cast('B')
+        sent = 0
+        while sent < len(view):
+            try:
+                sent += os.write(self._fd, view[sent:])
+            except BlockingIOError:
+                self._waitWritable()
+        return sent
+
+    def _readSome(self, view, timeout):
+        if timeout != 0 and not self._waitReadable(timeout):
+            return 0
+        try:
+            return os.readv(self._fd, [view])
+        except BlockingIOError:
+            return 0
+
+    def reset_input_buffer(self):
+        termios.tcflush(self._fd, termios.TCIFLUSH)
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            os.close(self._fd)
+
+
+class TCPTransport(_FdTransport):
+    """ a TCP connection to a serial bridge such as ser2net """
+
+    def __init__(self, host, port, timeout=0.5, connect_timeout=5.0):
+        self._sock = socket.create_connection((host, port), timeout=connect_timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock.setblocking(False)
+        self._fd = self._sock.fileno()
+        self.timeout = timeout
+
+    def write(self, data):
+        view = memoryview(data).cast('B')
+        sent = 0
+        while sent < len(view):
+            try:
+                sent += self._sock.send(view[sent:])
+            except BlockingIOError:
+                self._waitWritable()
+        return sent
+
+    def _readSome(self, view, timeout):
+        if timeout != 0 and not self._waitReadable(timeout):
+            return 0
+        try:
+            n = self._sock.recv_into(view)
+        except BlockingIOError:
+            return 0
+        if n == 0:
+            raise ConnectionError(errno.ECONNRESET, 'serial bridge closed the connection')
+        return n
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            self._sock.close()
+
+
+class LoopbackTransport(Transport):
+    """ an in-memory port. Without a peer, everything written comes
+    straight back. With a peer, every write is handed to peer.feed(data)
+    and whatever bytes it returns become readable; if the peer also has
+    a poll() method it is called before each read for bytes it produces
+    on its own (a stream, for example).
+
+    There is no file descriptor, so fileno() raises
+    io.UnsupportedOperation.
+    """
+
+    def __init__(self, peer=None, timeout=0.5):
+        self.peer = peer
+        self.timeout = timeout
+        self._rx = bytearray()
+        self._cond = threading.Condition()
+        self._poll = getattr(peer, 'poll', None)
+
+    def write(self, data):
+        data = bytes(data)
+        reply = data if self.peer is None else self.peer.feed(data)
+        if reply:
+            with self._cond:
+                self._rx += reply
+                self._cond.notify_all()
+        return len(data)
+
+    def _pollPeer(self):
+        if self._poll is not None:
+            produced = self._poll()
+            if produced:
+                self._rx += produced
+
+    @property
+    def in_waiting(self):
+        with self._cond:
+            self._pollPeer()
+            return len(self._rx)
+
+    def _readSome(self, view, timeout):
+        with self._cond:
+            self._pollPeer()
+            if not self._rx and timeout != 0:
+                if self._poll is None:
+                    self._cond.wait(timeout)
+                else:
+                    # the peer may produce bytes as time passes
+                    deadline = None if timeout is None else time.monotonic() + timeout
+                    while not self._rx:
+                        wait = 0.001
+                        if deadline is not None:
+                            wait = min(wait, deadline - time.monotonic())
+                            if wait <= 0:
+                                break
+                        self._cond.wait(wait)
+                        self._pollPeer()
+            n = min(len(view), len(self._rx))
+            view[:n] = self._rx[:n]
+            del self._rx[:n]
+            return n
+
+    def reset_input_buffer(self):
+        with self._cond:
+            del self._rx[:]
+
+
+def openTransport(port, baudrate=115200, timeout=0.5):
+    """ opens a transport from a port string:
+
+      socket://host:port or tcp://host:port   TCPTransport
+      posix:/dev/ttyUSB0                      PosixTTYTransport
+      loop://                                 LoopbackTransport (echo)
+      anything else                           SerialTransport (pyserial)
+    """
+    for scheme in ('socket://', 'tcp://'):
+        if port.startswith(scheme):
+            host, _, tcpport = port[len(scheme):].rpartition(':')
+            return TCPTransport(host, int(tcpport), timeout=timeout)
+    if port.startswith('posix:'):
+        return PosixTTYTransport(port[len('posix:'):], baudrate, timeout=timeout)
+    if port.startswith('loop://'):
+        return LoopbackTransport(timeout=timeout)
+    return SerialTransport(port, baudrate, timeout=timeout)
@@ -0,0 +1,208 @@
+"""Tests for the asyncio client."""
+
+import asyncio
+import time
+import unittest
+
+from create_serial.aio import AsyncCreate
+from create_serial.create import (
+    SAFE_MODE,
+    FULL_MODE,
+    OI_MODE,
+    VOLTAGE,
+    ENCODER_LEFT,
+    ENCODER_RIGHT,
+)
+from create_serial.emulator import OIEmulator, PtyEmulator
+from create_serial.transport import LoopbackTransport
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class Delayed:
+    """ an OIEmulator whose replies arrive delay seconds after the
+    request, like a USB adapter holding them for its latency timer """
+
+    def __init__(self, delay):
+        self.emu = OIEmulator()
+        self.delay = delay
+        self._late = []
+
+    def feed(self, data):
+        reply = self.emu.feed(data)
+        if reply:
+            self._late.append((time.monotonic() + self.delay, reply))
+        return b''
+
+    def poll(self):
+        produced = self.emu.poll()
+        while self._late and time.monotonic() >= self._late[0][0]:
+            produced += self._late.pop(0)[1]
+        return produced
+
+
+class TestOverPty(unittest.TestCase):
+    """ the file descriptor path: loop.add_reader on a pty """
+
+    def test_sensors_and_modes(self):
+        async def session(path):
+            robot = await AsyncCreate.open('posix:' + path, startingMode=FULL_MODE)
+            try:
+                d = await robot.sensors([OI_MODE, VOLTAGE])
+                self.assertEqual(d[OI_MODE], FULL_MODE)
+                await robot.toSafeMode()
+                d = await robot.sensors(3)
+                self.assertEqual(d[VOLTAGE], 15500)
+                d = await robot.sensors([OI_MODE])
+                self.assertEqual(d[OI_MODE], SAFE_MODE)
+            finally:
+                await robot.close()
+
+        with PtyEmulator() as sim:
+            run(session(sim.path))
+
+    def test_concurrent_queries_get_their_own_replies(self):
+        async def session(path):
+            async with await AsyncCreate.open('posix:' + path) as robot:
+                await asyncio.gather(*[robot.sensors([OI_MODE] if i % 2 else [VOLTAGE])
+                                       for i in range(20)])
+                self.assertEqual(robot.sensord[OI_MODE], SAFE_MODE)
+                self.assertEqual(robot.sensord[VOLTAGE], 15500)
+                self.assertEqual(len(robot._pending), 0)
+
+        with PtyEmulator() as sim:
+            run(session(sim.path))
+
+    def test_move_waits_for_the_script(self):
+        async def session(path, emu):
+            async with await AsyncCreate.open('posix:' + path) as robot:
+                await robot.sensors([ENCODER_LEFT, ENCODER_RIGHT])
+                await robot.move(3, 20)
+                self.assertAlmostEqual(emu.x, 30.0, delta=1.0)
+                await robot.sensors([ENCODER_LEFT, ENCODER_RIGHT])
+                x, y, th = robot.getPose()
+                self.assertAlmostEqual(x, 3.0, delta=0.2)
+
+        emu = OIEmulator()
+        with PtyEmulator(emu) as sim:
+            run(session(sim.path, emu))
+
+
+class TestOverLoopback(unittest.TestCase):
+    """ the polling path, for transports without a file descriptor """
+
+    def test_stream_frames(self):
+        async def session():
+            emu = OIEmulator()
+            robot = await AsyncCreate.open(LoopbackTransport(peer=emu))
+            await robot.startStream([ENCODER_LEFT, ENCODER_RIGHT, OI_MODE])
+            await robot.drive(20, 0)
+            frames = []
+            async for d in robot.streamFrames():
+                frames.append(d)
+                if len(frames) == 10:
+                    await robot.stopStream()
+            self.assertGreaterEqual(len(frames), 10)
+            self.assertEqual(frames[-1][OI_MODE], SAFE_MODE)
+            self.assertFalse(robot.isStreaming())
+            await robot.stop()
+            await robot.close()
+            self.assertGreater(robot.getPose()[0], 0.0)
+
+        run(session())
+
+    def test_change_stream(self):
+        async def session():
+            emu = OIEmulator()
+            robot = await AsyncCreate.open(LoopbackTransport(peer=emu))
+            await robot.startStream([ENCODER_LEFT, ENCODER_RIGHT])
+            await robot.changeStream([OI_MODE])
+            self.assertEqual(robot.streamPackets, [OI_MODE, ENCODER_LEFT, ENCODER_RIGHT])
+            async for d in robot.streamFrames():
+                if OI_MODE in d:
+                    break
+            self.assertEqual(d[OI_MODE], SAFE_MODE)
+            await robot.close()
+
+        run(session())
+
+    def test_move_while_streaming(self):
+        async def session():
+            emu = OIEmulator()
+            robot = await AsyncCreate.open(LoopbackTransport(peer=emu))
+            await robot.startStream([ENCODER_LEFT, ENCODER_RIGHT])
+            start = time.monotonic()
+            await robot.move(4, 20)
+            self.assertGreater(time.monotonic() - start, 0.18)
+            self.assertAlmostEqual(emu.x, 40.0, delta=2.0)
+            self.assertTrue(robot.isStreaming())
+            await asyncio.sleep(0.1)
+            self.assertAlmostEqual(robot.getPose()[0], 4.0, delta=0.2)
+            await robot.close()
+
+        run(session())
+
+    def test_script_timeout(self):
+        async def session():
+            robot = await AsyncCreate.open(LoopbackTransport(peer=OIEmulator()))
+            await robot.startStream([ENCODER_LEFT, ENCODER_RIGHT])
+            # a script that waits 5 s (WAIT TIME 50)
+            robot._startScript(2)
+            robot._write(bytes([155, 50]))
+            self.assertFalse(await robot._endScript(timeout=0.05))
+            self.assertTrue(robot.isStreaming())
+            await robot.close()
+
+        run(session())
+
+    def test_mode_confirmed_over_a_slow_link(self):
+        async def session():
+            peer = Delayed(0.02)
+            robot = await AsyncCreate.open(LoopbackTransport(peer=peer),
+                                           startingMode=FULL_MODE)
+            self.assertTrue(await robot.toSafeMode())
+            self.assertEqual(robot.reportedMode, SAFE_MODE)
+            d = await robot.sensors([VOLTAGE, OI_MODE])
+            self.assertEqual((d[VOLTAGE], d[OI_MODE]), (15500, SAFE_MODE))
+            robot.ser.close()
+            robot._pollTask.cancel()
+
+        run(session())
+
+    def test_late_reply_is_not_taken_for_the_next(self):
+        async def session():
+            peer = Delayed(0.01)
+            robot = await AsyncCreate.open(LoopbackTransport(peer=peer))
+            peer.emu.setSensor(VOLTAGE, 15000)
+            # late, but within one more reply timeout
+            peer.delay = 0.05
+            robot.timeout = 0.02
+            with self.assertRaises(asyncio.TimeoutError):
+                await robot.sensors([VOLTAGE])
+            peer.delay = 0.01
+            d = await robot.sensors([OI_MODE, VOLTAGE])
+            self.assertEqual((d[OI_MODE], d[VOLTAGE]), (SAFE_MODE, 15000))
+            robot.ser.close()
+            robot._pollTask.cancel()
+
+        run(session())
+
+    def test_timeout(self):
+        async def session():
+            emu = OIEmulator()
+            robot = await AsyncCreate.open(LoopbackTransport(peer=emu))
+            robot.timeout = 0.05
+            # the emulator holds replies while a script waits
+            emu.feed(bytes([156, 0x7F, 0xFF]))
+            with self.assertRaises(asyncio.TimeoutError):
+                await robot.sensors([OI_MODE])
+            robot.ser.close()
+            robot._pollTask.cancel()
+
+        run(session())
+
+
+if __name__ == '__main__':
+    unittest.main()
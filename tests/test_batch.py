@@ -0,0 +1,89 @@
+"""Tests for the vectorized batch decoders."""
+
+import random
+import unittest
+from unittest.mock import patch
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from create_serial.create import (
+    Create,
+    PASSIVE_MODE,
+    SENSOR_DATA_WIDTH,
+    SENSOR_GROUPS,
+    BUMPS_AND_WHEEL_DROPS,
+    BUTTONS,
+    ENCODER_LEFT,
+    ENCODER_RIGHT,
+    VOLTAGE,
+    LEFT_BUMP,
+    PLAY_BUTTON,
+)
+from create_serial.snapshot import FIELD_NAMES
+from create_serial.stream import encodeStreamFrame
+from create_serial.transport import LoopbackTransport
+
+if np is not None:
+    from create_serial.batch import columns, decodeReplies, decodeStreamFrames
+    from create_serial.history import SensorHistory
+
+
+@unittest.skipIf(np is None, 'needs numpy')
+class TestDecodeReplies(unittest.TestCase):
+    def test_matches_the_scalar_decoder(self):
+        with patch('create_serial.create.time.sleep'):
+            robot = Create(LoopbackTransport(), startingMode=PASSIVE_MODE)
+        packets = list(SENSOR_GROUPS[6])
+        size = sum(SENSOR_DATA_WIDTH[i] for i in packets)
+        rng = random.Random(7)
+        replies = [bytes(rng.randrange(256) for i in range(size)) for n in range(20)]
+        cols = decodeReplies(b''.join(replies), packets)
+        for n, reply in enumerate(replies):
+            robot._readSensorList(packets, reply)
+            for sensornum in list(packets) + [LEFT_BUMP, PLAY_BUTTON]:
+                expected = robot.sensord[sensornum]
+                got = cols[FIELD_NAMES[sensornum]]
+                if isinstance(expected, list):
+                    continue
+                self.assertEqual(got[n], expected, FIELD_NAMES[sensornum])
+
+    def test_columns_are_native(self):
+        cols = decodeReplies(bytes([0x3C, 0x8C, 0xFF, 0xFF]), [VOLTAGE, ENCODER_LEFT])
+        self.assertTrue(cols['voltage'].dtype.isnative)
+        self.assertEqual(list(cols['encoderLeft']), [65535])
+
+    def test_partial_reply(self):
+        with self.assertRaises(ValueError):
+            decodeReplies(bytes(3), [VOLTAGE])
+
+
+@unittest.skipIf(np is None, 'needs numpy')
+class TestDecodeStreamFrames(unittest.TestCase):
+    def test_frames_and_bad_checksums(self):
+        packets = [BUMPS_AND_WHEEL_DROPS, ENCODER_LEFT, BUTTONS]
+        frames = [bytearray(encodeStreamFrame([(BUMPS_AND_WHEEL_DROPS, bytes([i & 3])),
+                                               (ENCODER_LEFT, bytes([0, i])),
+                                               (BUTTONS, bytes([4]))])) for i in range(4)]
+        frames[2][-1] ^= 0xFF
+        cols = decodeStreamFrames(b''.join(frames), packets)
+        self.assertEqual(list(cols['encoderLeft']), [0, 1, 3])
+        self.assertEqual(list(cols['leftBump']), [0, 0, 1])
+        self.assertEqual(list(cols['advanceButton']), [1, 1, 1])
+        self.assertNotIn('checksum', cols)
+
+
+@unittest.skipIf(np is None, 'needs numpy')
+class TestHistoryColumns(unittest.TestCase):
+    def test_history_rows(self):
+        h = SensorHistory((ENCODER_LEFT, ENCODER_RIGHT), capacity=4)
+        h.append(1.0, bytes([0, 5, 1, 0]), (1.0, 2.0, 0.5))
+        cols = columns(h.latest(), h.packets)
+        self.assertEqual(cols['encoderRight'][0], 256)
+        self.assertEqual(cols['th'][0], 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
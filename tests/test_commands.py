@@ -0,0 +1,93 @@
+"""Tests for the precompiled OI command encoders."""
+
+import unittest
+
+from create_serial.commands import CommandEncoder
+from create_serial.create import (
+    DRIVE,
+    DRIVEDIRECT,
+    LEDS,
+    MOTORS,
+    SONG,
+    _toTwosComplement2Bytes,
+)
+
+
+def drive_bytes(vel, radius):
+    return DRIVE + bytes(_toTwosComplement2Bytes(vel) + _toTwosComplement2Bytes(radius))
+
+
+class TestDrive(unittest.TestCase):
+    def test_forward(self):
+        enc = CommandEncoder()
+        self.assertEqual(bytes(enc.drive(200, 500)), drive_bytes(200, 500))
+
+    def test_velocity_is_capped(self):
+        enc = CommandEncoder()
+        self.assertEqual(bytes(enc.drive(900, 500)), drive_bytes(500, 500))
+        self.assertEqual(bytes(enc.drive(-900, 500)), drive_bytes(-500, 500))
+
+    def test_large_radius_goes_straight(self):
+        enc = CommandEncoder()
+        self.assertEqual(bytes(enc.drive(100, 32767))[3:], bytes([0x80, 0x00]))
+        self.assertEqual(bytes(enc.drive(100, -2001))[3:], bytes([0x80, 0x00]))
+
+    def test_zero_radius_turns_in_place(self):
+        enc = CommandEncoder()
+        self.assertEqual(bytes(enc.drive(100, 0)), drive_bytes(100, 1))
+        self.assertEqual(bytes(enc.drive(100, 0, 'CW')), drive_bytes(100, -1))
+
+    def test_floats_are_truncated(self):
+        enc = CommandEncoder()
+        self.assertEqual(bytes(enc.drive(99.9, -150.7)), drive_bytes(99, -150))
+
+
+class TestDriveDirect(unittest.TestCase):
+    def test_right_wheel_first(self):
+        enc = CommandEncoder()
+        data = bytes(enc.drive_direct(-100, 250))
+        self.assertEqual(data, DRIVEDIRECT + bytes(_toTwosComplement2Bytes(250) +
+                                                   _toTwosComplement2Bytes(-100)))
+
+    def test_capped(self):
+        enc = CommandEncoder()
+        data = bytes(enc.drive_direct(-1000, 1000))
+        self.assertEqual(data, DRIVEDIRECT + bytes(_toTwosComplement2Bytes(500) +
+                                                   _toTwosComplement2Bytes(-500)))
+
+
+class TestLedsAndMotors(unittest.TestCase):
+    def test_leds(self):
+        enc = CommandEncoder()
+        self.assertEqual(bytes(enc.leds(300, -5, 1, 1)), LEDS + bytes([10, 255, 0]))
+
+    def test_motors(self):
+        enc = CommandEncoder()
+        self.assertEqual(bytes(enc.motors(0, 0, 0)), MOTORS + bytes([0]))
+        self.assertEqual(bytes(enc.motors(1, 1, 1)), MOTORS + bytes([7]))
+        self.assertEqual(bytes(enc.motors(-1, -1, 0)), MOTORS + bytes([28]))
+
+
+class TestSong(unittest.TestCase):
+    def test_song(self):
+        enc = CommandEncoder()
+        data = bytes(enc.song(1, [(60, 32), 'rest']))
+        self.assertEqual(data, SONG + bytes([1, 2, 60, 32, 30, 16]))
+
+    def test_song_is_truncated_to_16_notes(self):
+        enc = CommandEncoder()
+        data = bytes(enc.song(20, [(60, 8)] * 20))
+        self.assertEqual(len(data), 3 + 32)
+        self.assertEqual(data[1], 15)
+        self.assertEqual(data[2], 16)
+
+    def test_buffer_is_reused(self):
+        enc = CommandEncoder()
+        first = enc.motors(1, 0, 0)
+        enc.drive(0, 0)
+        # the view returned earlier now sees the newer command
+        self.assertEqual(bytes(first)[:1], DRIVE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,9 @@
 """Tests for Create class with mocked serial port."""
 
+import collections
+import math
+import threading
+import time
 import unittest
 from unittest.mock import MagicMock, patch, call
 
@@ -14,6 +18,7 @@ from create_serial.create import (
     SAFE,
     DRIVE,
     MOTORS,
+    DRIVEDIRECT,
     LEDS,
     SONG,
     PLAY,
@@ -24,20 +29,43 @@ from create_serial.create import (
     DISTANCE,
     ANGLE,
     SENSOR_DATA_WIDTH,
+    STREAM,
+    PAUSERESUME,
+    BUMPS_AND_WHEEL_DROPS,
+    LEFT_BUMP,
+    OI_MODE,
+    VOLTAGE,
+    BATTERY_CHARGE,
+    POSE,
+    LIGHTBUMP_LEFT,
+    LIGHTBUMP_RIGHT,
+    LEFT_MOTOR_CURRENT,
+    STASIS,
+    SENSOR_GROUPS,
+    CLIFF_LEFT,
+    queryPlan,
+    POSE_HISTORY_LENGTH,
+    PIPELINE_DEPTH,
     _toTwosComplement2Bytes,
 )
+from create_serial.emulator import OIEmulator
+from create_serial.stream import encodeStreamFrame
+from create_serial.transport import LoopbackTransport, SerialTransport
 
 
 def make_robot():
     """Create a Create instance with a fully mocked serial port."""
-    with patch('create_serial.create.serial.Serial') as MockSerial:
-        mock_ser = MagicMock()
-        mock_ser.isOpen.return_value = True
-        # sensors() during __init__ calls _getRawSensorDataAsList which
-        # does ser.read; return empty data for initial sensor reads
-        mock_ser.read.return_value = b''
-        MockSerial.return_value = mock_ser
-        robot = Create(PORT='/dev/fake', startingMode=SAFE_MODE)
+    mock_ser = MagicMock()
+    mock_ser.isOpen.return_value = True
+    # sensors() during __init__ does ser.read; return empty data
+    # for initial sensor reads
+    mock_ser.read.return_value = b''
+    # any object with the transport methods can stand in for the port;
+    # nothing answers, so skip waiting out the readiness probe and the
+    # mode confirmation (TestReadiness covers those)
+    with patch.object(Create, '_waitReady', return_value=None), \
+         patch.object(Create, '_confirmMode', return_value=True):
+        robot = Create(PORT=mock_ser, startingMode=SAFE_MODE)
     return robot
 
 
@@ -55,6 +83,60 @@ class TestCreateConstructor(unittest.TestCase):
         self.assertEqual(th, 0.0)
 
 
+    def test_port_name_opens_pyserial(self):
+        with patch('create_serial.transport.serial.Serial') as MockSerial:
+            mock_ser = MagicMock()
+            mock_ser.isOpen.return_value = True
+            mock_ser.read.return_value = b''
+            MockSerial.return_value = mock_ser
+            with patch.object(Create, '_waitReady', return_value=None), \
+                 patch.object(Create, '_confirmMode', return_value=True):
+                robot = Create(PORT='/dev/fake', startingMode=SAFE_MODE)
+        MockSerial.assert_called_once_with('/dev/fake', baudrate=115200, timeout=0.5)
+        self.assertIsInstance(robot.ser, SerialTransport)
+        self.assertEqual(robot.ser.write, mock_ser.write)
+
+
+class SlowToWake:
+    """ an OIEmulator that ignores the first few writes, like a robot
+    that is still booting """
+
+    def __init__(self, ignored):
+        self.emu = OIEmulator()
+        self.ignored = ignored
+
+    def feed(self, data):
+        if self.ignored > 0:
+            self.ignored -= 1
+            return b''
+        return self.emu.feed(data)
+
+
+class TestReadiness(unittest.TestCase):
+    def test_connects_as_soon_as_the_robot_answers(self):
+        start = time.monotonic()
+        robot = Create(LoopbackTransport(peer=OIEmulator()), startingMode=FULL_MODE)
+        self.assertLess(time.monotonic() - start, 0.3)
+        self.assertEqual(robot.sciMode, FULL_MODE)
+        # reads wait as long as a reply can take, not a fixed half second
+        self.assertEqual(robot.ser.timeout, robot._replyTimeout(1))
+
+    def test_probes_until_answered(self):
+        port = LoopbackTransport(peer=SlowToWake(3))
+        robot = Create(port, startingMode=PASSIVE_MODE)
+        self.assertEqual(port.peer.ignored, 0)
+        self.assertEqual(robot.sciMode, PASSIVE_MODE)
+        self.assertEqual(port.in_waiting, 0)
+
+    def test_gives_up_after_the_timeout(self):
+        robot = make_robot()
+        robot.ser.reset_mock()
+        start = time.monotonic()
+        self.assertIsNone(robot._waitReady(timeout=0.2))
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertGreater(robot.ser.write.call_count, 1)
+
+
 class TestGoDifferential(unittest.TestCase):
     def test_go_differential_zero(self):
         robot = make_robot()
@@ -80,19 +162,17 @@ class TestMotors(unittest.TestCase):
         robot.ser.write.reset_mock()
         robot.motors(0, 0, 0)
         calls = robot.ser.write.call_args_list
-        # Should write MOTORS opcode then a byte
-        self.assertEqual(calls[0], call(MOTORS))
-        self.assertEqual(calls[1], call(bytes([0])))
+        # Should write MOTORS opcode and its byte in one write
+        self.assertEqual(calls, [call(MOTORS + bytes([0]))])
 
     def test_motors_all_on(self):
         robot = make_robot()
         robot.ser.write.reset_mock()
         robot.motors(1, 1, 1)
         calls = robot.ser.write.call_args_list
-        self.assertEqual(calls[0], call(MOTORS))
         # side_brush=1 -> bit0=1, main_brush=1 -> bit2=1, vacuum=1 -> bit1=1
         # = 0b00000111 = 7
-        self.assertEqual(calls[1], call(bytes([7])))
+        self.assertEqual(calls, [call(MOTORS + bytes([7]))])
 
 
 class TestSetLEDs(unittest.TestCase):
@@ -101,13 +181,15 @@ class TestSetLEDs(unittest.TestCase):
         robot.ser.write.reset_mock()
         robot.setLEDs(128, 255, 0, 1)
         calls = robot.ser.write.call_args_list
-        self.assertEqual(calls[0], call(LEDS))
+        self.assertEqual(len(calls), 1)
+        data = calls[0][0][0]
+        self.assertEqual(data[:1], LEDS)
         # advance=1 -> bit3, play=0 -> firstByteVal = 8
-        self.assertEqual(calls[1], call(bytes([8])))
+        self.assertEqual(data[1], 8)
         # power_color=128
-        self.assertEqual(calls[2], call(bytes([128])))
+        self.assertEqual(data[2], 128)
         # power_intensity=255
-        self.assertEqual(calls[3], call(bytes([255])))
+        self.assertEqual(data[3], 255)
 
 
 class TestSetSong(unittest.TestCase):
@@ -116,13 +198,15 @@ class TestSetSong(unittest.TestCase):
         robot.ser.write.reset_mock()
         robot.setSong(1, [(60, 32), (64, 32)])
         calls = robot.ser.write.call_args_list
-        self.assertEqual(calls[0], call(SONG))
-        self.assertEqual(calls[1], call(bytes([1])))   # song number
-        self.assertEqual(calls[2], call(bytes([2])))   # length
-        self.assertEqual(calls[3], call(bytes([60])))  # note 1
-        self.assertEqual(calls[4], call(bytes([32])))  # duration 1
-        self.assertEqual(calls[5], call(bytes([64])))  # note 2
-        self.assertEqual(calls[6], call(bytes([32])))  # duration 2
+        self.assertEqual(len(calls), 1)
+        data = calls[0][0][0]
+        self.assertEqual(data[:1], SONG)
+        self.assertEqual(data[1], 1)   # song number
+        self.assertEqual(data[2], 2)   # length
+        self.assertEqual(data[3], 60)  # note 1
+        self.assertEqual(data[4], 32)  # duration 1
+        self.assertEqual(data[5], 64)  # note 2
+        self.assertEqual(data[6], 32)  # duration 2
 
     def test_set_song_empty_list(self):
         robot = make_robot()
@@ -137,8 +221,332 @@ class TestSetSong(unittest.TestCase):
         robot.ser.write.reset_mock()
         robot.setSong(20, [(60, 32)])  # 20 > 15, should clamp to 15
         calls = robot.ser.write.call_args_list
-        self.assertEqual(calls[1], call(bytes([15])))
+        self.assertEqual(calls[0][0][0][1], 15)
+
+
+class TestCommandsFromThreads(unittest.TestCase):
+    def test_threads_do_not_overwrite_each_others_commands(self):
+        robot = make_robot()
+        sent = []
+        writing = threading.Event()
+        mainSent = threading.Event()
+
+        def write(data):
+            if threading.current_thread() is not threading.main_thread():
+                # the other thread's command is still being written...
+                writing.set()
+                mainSent.wait(1.0)
+            sent.append(bytes(data))
+            return len(data)
+        robot.ser.write.side_effect = write
+
+        other = threading.Thread(target=robot.motors, args=(1, 1, 1))
+        other.start()
+        self.assertTrue(writing.wait(1.0))
+        # ...when this one encodes and sends its own
+        robot.setWheelVelocities(10, -10)
+        mainSent.set()
+        other.join()
+        self.assertEqual(sent, [DRIVEDIRECT + bytes([0xff, 0x9c, 0x00, 0x64]),
+                                MOTORS + bytes([7])])
+
+
+class TestBatch(unittest.TestCase):
+    def test_drive_is_one_write(self):
+        robot = make_robot()
+        robot.ser.write.reset_mock()
+        robot.go_differential(10, 0)
+        calls = robot.ser.write.call_args_list
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(calls[0][0][0]), 5)
+        self.assertEqual(calls[0][0][0][:1], DRIVE)
+
+    def test_batch_combines_commands(self):
+        robot = make_robot()
+        robot.ser.write.reset_mock()
+        with robot.batch():
+            robot.go_differential(10, 0)
+            robot.motors(0, 1, 1)
+            self.assertEqual(robot.ser.write.call_count, 0)
+        calls = robot.ser.write.call_args_list
+        self.assertEqual(len(calls), 1)
+        data = calls[0][0][0]
+        self.assertEqual(len(data), 7)
+        self.assertEqual(data[:1], DRIVE)
+        self.assertEqual(data[5:], MOTORS + bytes([6]))
+
+    def test_nested_batch_flushes_at_outermost(self):
+        robot = make_robot()
+        robot.ser.write.reset_mock()
+        with robot.batch():
+            with robot.batch():
+                robot.motors(1, 0, 0)
+            self.assertEqual(robot.ser.write.call_count, 0)
+            robot.playSongNumber(2)
+        robot.ser.write.assert_called_once_with(MOTORS + bytes([1]) + PLAY + bytes([2]))
+
+    def test_sensor_read_flushes_batch(self):
+        robot = make_robot()
+        robot.ser.write.reset_mock()
+        robot.ser.read.return_value = b'\x00\x05'
+        with robot.batch():
+            robot.motors(1, 0, 0)
+            robot.sensors([ENCODER_LEFT])
+            self.assertEqual(robot.ser.write.call_count, 1)
+        robot.ser.write.assert_called_once_with(
+            MOTORS + bytes([1]) + QUERYLIST + bytes([1, ENCODER_LEFT]))
+
+
+class TestStream(unittest.TestCase):
+    def test_stream_updates_sensord(self):
+        robot = make_robot()
+        robot.ser.write.reset_mock()
+        frames = [encodeStreamFrame([(BUMPS_AND_WHEEL_DROPS, b'\x02'),
+                                     (ENCODER_LEFT, b'\x00\x10')])]
+        got_frame = threading.Event()
+
+        def read(size=1):
+            if frames:
+                return frames.pop()
+            time.sleep(0.01)
+            return b''
+
+        robot.ser.in_waiting = 0
+        robot.ser.read.side_effect = read
+        robot.startStream([LEFT_BUMP, ENCODER_LEFT], callback=lambda d: got_frame.set())
+        self.assertTrue(robot.isStreaming())
+        self.assertEqual(robot.ser.write.call_args_list[0],
+                         call(STREAM + bytes([2, ENCODER_LEFT, BUMPS_AND_WHEEL_DROPS])))
+        self.assertTrue(got_frame.wait(2.0))
+        # sensors() answers from the streamed state without a request
+        robot.ser.write.reset_mock()
+        d = robot.sensors([LEFT_BUMP])
+        self.assertEqual(robot.ser.write.call_count, 0)
+        self.assertEqual(d[LEFT_BUMP], 1)
+        self.assertEqual(d[ENCODER_LEFT], 16)
+
+        robot.stopStream()
+        self.assertFalse(robot.isStreaming())
+        robot.ser.write.assert_called_once_with(PAUSERESUME + bytes([0]))
+
+    def test_lazy_stream_passes_frames(self):
+        robot = make_robot()
+        frames = [encodeStreamFrame([(BUMPS_AND_WHEEL_DROPS, b'\x02'),
+                                     (ENCODER_LEFT, b'\x00\x10')])]
+        got = []
+        got_frame = threading.Event()
+
+        def read(size=1):
+            if frames:
+                return frames.pop()
+            time.sleep(0.01)
+            return b''
+
+        def callback(frame):
+            got.append(frame)
+            got_frame.set()
+
+        robot.ser.in_waiting = 0
+        robot.ser.read.side_effect = read
+        robot.startStream([LEFT_BUMP, ENCODER_LEFT], callback=callback, lazy=True)
+        self.assertTrue(got_frame.wait(2.0))
+        robot.stopStream()
+        self.assertEqual(got[0][LEFT_BUMP], 1)
+        self.assertEqual(got[0].encoderLeft, 16)
+        self.assertEqual(robot.leftEncoder, 16)
+        self.assertNotIn(LEFT_BUMP, robot.sensord)
+
+    def test_change_stream_keeps_encoders_and_drops_half_frames(self):
+        robot = make_robot()
+        first = encodeStreamFrame([(ENCODER_LEFT, b'\x00\x10'),
+                                   (ENCODER_RIGHT, b'\x00\x10')])
+        chunks = [first]
+        lock = threading.Lock()
+        got_frame = threading.Event()
+
+        def read(size=1):
+            with lock:
+                if chunks:
+                    return chunks.pop(0)
+            time.sleep(0.01)
+            return b''
+
+        robot.ser.in_waiting = 0
+        robot.ser.read.side_effect = read
+        robot.startStream([ENCODER_LEFT, ENCODER_RIGHT],
+                          callback=lambda d: got_frame.set())
+        self.assertTrue(got_frame.wait(2.0))
+        robot.ser.write.reset_mock()
+
+        robot.changeStream([BUMPS_AND_WHEEL_DROPS])
+        self.assertEqual(robot.streamPackets,
+                         [BUMPS_AND_WHEEL_DROPS, ENCODER_LEFT, ENCODER_RIGHT])
+        calls = robot.ser.write.call_args_list
+        self.assertEqual(calls[0], call(PAUSERESUME + bytes([0])))
+        self.assertEqual(calls[1], call(STREAM + bytes([3, BUMPS_AND_WHEEL_DROPS,
+                                                        ENCODER_LEFT, ENCODER_RIGHT])
+                                        + PAUSERESUME + bytes([1])))
 
+        # a stale half frame followed by a frame of the new layout
+        got_frame.clear()
+        second = encodeStreamFrame([(BUMPS_AND_WHEEL_DROPS, b'\x01'),
+                                    (ENCODER_LEFT, b'\x00\x20'),
+                                    (ENCODER_RIGHT, b'\x00\x20')])
+        with lock:
+            chunks.append(first[:4])
+            chunks.append(second)
+        self.assertTrue(got_frame.wait(2.0))
+        self.assertEqual(robot.sensord[ENCODER_LEFT], 32)
+        self.assertEqual(robot.sensord[BUMPS_AND_WHEEL_DROPS], [0, 0, 0, 0, 1])
+        robot.stopStream()
+
+    def test_change_stream_can_drop_encoders(self):
+        robot = make_robot()
+        robot.ser.in_waiting = 0
+        robot.ser.read.side_effect = lambda size=1: time.sleep(0.01) or b''
+        robot.startStream([ENCODER_LEFT, ENCODER_RIGHT])
+        robot.changeStream([BUMPS_AND_WHEEL_DROPS], keepOdometry=False)
+        self.assertEqual(robot.streamPackets, [BUMPS_AND_WHEEL_DROPS])
+        robot.stopStream()
+
+
+class TestNonBlockingIO(unittest.TestCase):
+    def test_submit_query_does_not_read(self):
+        robot = make_robot()
+        robot.ser.reset_mock()
+        query = robot.submit_query([OI_MODE, VOLTAGE])
+        robot.ser.write.assert_called_once_with(QUERYLIST + bytes([2, OI_MODE, VOLTAGE]))
+        robot.ser.read.assert_not_called()
+        self.assertFalse(query.done)
+
+    def test_process_io_completes_in_pieces(self):
+        robot = make_robot()
+        seen = []
+        first = robot.submit_query([OI_MODE, VOLTAGE], callback=seen.append)
+        second = robot.submit_query([OI_MODE])
+        robot.ser.in_waiting = 0
+        self.assertEqual(robot.process_io(), [])
+        robot.ser.in_waiting = 2
+        robot.ser.read.return_value = bytes([SAFE_MODE, 0x3C])
+        self.assertEqual(robot.process_io(), [])
+        robot.ser.in_waiting = 2
+        robot.ser.read.return_value = bytes([0x8C, FULL_MODE])
+        self.assertEqual(robot.process_io(), [first, second])
+        self.assertTrue(first.done and second.done)
+        self.assertEqual(seen, [first])
+        self.assertEqual(robot.sensord[VOLTAGE], 0x3C8C)
+        self.assertEqual(robot.sensord[OI_MODE], FULL_MODE)
+
+    def test_query_times_out(self):
+        robot = make_robot()
+        query = robot.submit_query([OI_MODE], timeout=0)
+        robot.ser.in_waiting = 0
+        self.assertEqual(robot.process_io(), [query])
+        self.assertTrue(query.timedOut)
+
+    def test_late_reply_is_not_taken_for_the_next(self):
+        # the reply comes after its timeout but within one more
+        # reply timeout, as a late one would
+        peer = Laggy(0.05)
+        robot = Create(LoopbackTransport(peer=peer), startingMode=SAFE_MODE)
+        peer.emu.setSensor(VOLTAGE, 15000)
+        first = robot.submit_query([VOLTAGE], timeout=0.02)
+        while not first.done:
+            robot.process_io()
+        self.assertTrue(first.timedOut)
+        peer.delay = 0.01
+        second = robot.submit_query([OI_MODE, VOLTAGE])
+        start = time.monotonic()
+        while not second.done and time.monotonic() - start < 1.0:
+            robot.process_io()
+        self.assertFalse(second.timedOut)
+        self.assertEqual(robot.sensord[OI_MODE], SAFE_MODE)
+        self.assertEqual(robot.sensord[VOLTAGE], 15000)
+
+    def test_queries_behind_a_lost_reply_are_given_up_on(self):
+        robot = make_robot()
+        robot.ser.in_waiting = 0
+        first = robot.submit_query([OI_MODE], timeout=0)
+        second = robot.submit_query([VOLTAGE])
+        self.assertEqual(robot.process_io(), [first, second])
+        self.assertTrue(first.timedOut and second.timedOut)
+
+    def test_sensors_waits_for_submitted_queries(self):
+        robot = make_robot()
+        robot.submit_query([OI_MODE])
+        robot.ser.in_waiting = 0
+        robot.ser.read.side_effect = [bytes([PASSIVE_MODE]), bytes([0x3C, 0x8C])]
+        d = robot.sensors([VOLTAGE])
+        self.assertEqual(d[OI_MODE], PASSIVE_MODE)
+        self.assertEqual(d[VOLTAGE], 0x3C8C)
+
+    def test_fileno(self):
+        robot = make_robot()
+        robot.ser.fileno.return_value = 7
+        self.assertEqual(robot.fileno(), 7)
+
+
+class TestQueryPlan(unittest.TestCase):
+    def test_aliases_are_expanded_once(self):
+        plan = queryPlan([POSE, LEFT_BUMP, DISTANCE, OI_MODE])
+        self.assertEqual(plan.packets, (DISTANCE, OI_MODE, ANGLE, BUMPS_AND_WHEEL_DROPS))
+        self.assertEqual(plan.request, QUERYLIST + bytes([4, DISTANCE, OI_MODE, ANGLE, BUMPS_AND_WHEEL_DROPS]))
+        self.assertEqual(plan.size, 6)
+        self.assertIs(queryPlan([POSE, LEFT_BUMP, DISTANCE, OI_MODE]), plan)
+
+    def test_groups(self):
+        self.assertEqual(queryPlan(3).request, SENSORS + bytes([3]))
+        self.assertEqual(queryPlan(3).size, 10)
+        self.assertIs(queryPlan(99), queryPlan(6))
+        self.assertEqual(queryPlan(100).size, 80)
+        self.assertEqual(queryPlan(107).packets, tuple(range(LEFT_MOTOR_CURRENT, STASIS + 1)))
+
+    def test_cheapest_mix_of_groups(self):
+        # a lone group beats six ids
+        plan = queryPlan(list(range(LIGHTBUMP_LEFT, LIGHTBUMP_RIGHT + 1)))
+        self.assertEqual(plan.request, SENSORS + bytes([106]))
+        self.assertEqual(plan.wireBytes(), 14)
+        # a group plus the ids it leaves out
+        plan = queryPlan(list(SENSOR_GROUPS[6]) + [ENCODER_LEFT])
+        self.assertEqual(plan.request, QUERYLIST + bytes([2, 6, ENCODER_LEFT]))
+        self.assertEqual(plan.packets, tuple(range(7, 43)) + (ENCODER_LEFT,))
+        self.assertEqual(plan.size, 54)
+        self.assertAlmostEqual(plan.wireTime(115200), 58 * 10 / 115200)
+        # a few ids are cheaper alone than the group that holds them
+        self.assertEqual(queryPlan([OI_MODE, VOLTAGE]).request,
+                         QUERYLIST + bytes([2, OI_MODE, VOLTAGE]))
+
+    def test_groups_never_read_the_odometry_unasked(self):
+        # group 6 would be cheapest, but reading DISTANCE and ANGLE
+        # zeroes them on the robot
+        wanted = [p for p in SENSOR_GROUPS[6] if p not in (DISTANCE, ANGLE)]
+        plan = queryPlan(wanted)
+        self.assertNotIn(DISTANCE, plan.packets)
+        self.assertNotIn(ANGLE, plan.packets)
+        # groups 1, 3, 4 and 5 instead, and the two ids left over
+        self.assertEqual(plan.request, QUERYLIST + bytes([6, 1, 3, 4, 5, 17, 18]))
+        self.assertEqual(queryPlan(wanted + [DISTANCE, ANGLE]).request, SENSORS + bytes([6]))
+
+    def test_group_replies_decode(self):
+        emu = OIEmulator()
+        emu.values[LIGHTBUMP_RIGHT] = 700
+        emu.values[STASIS] = 1
+        with patch('create_serial.create.time.sleep'):
+            robot = Create(LoopbackTransport(peer=emu), startingMode=SAFE_MODE)
+        d = robot.sensors(list(range(LIGHTBUMP_LEFT, LIGHTBUMP_RIGHT + 1)) + [STASIS, OI_MODE])
+        self.assertEqual(d[LIGHTBUMP_RIGHT], 700)
+        self.assertEqual(d[STASIS], 1)
+        self.assertEqual(d[OI_MODE], SAFE_MODE)
+
+    def test_callers_list_is_left_alone(self):
+        robot = make_robot()
+        wanted = [POSE, LEFT_BUMP]
+        robot.ser.reset_mock()
+        robot.sensors(wanted)
+        robot.submit_query(wanted)
+        self.assertEqual(wanted, [POSE, LEFT_BUMP])
+        request = QUERYLIST + bytes([3, DISTANCE, ANGLE, BUMPS_AND_WHEEL_DROPS])
+        self.assertEqual(robot.ser.write.call_args_list, [call(request), call(request)])
 
 class TestPose(unittest.TestCase):
     def test_get_set_pose_cm_rad(self):
@@ -168,6 +576,295 @@ class TestPose(unittest.TestCase):
         self.assertAlmostEqual(th, 1.5)
 
 
+class TestPoseAt(unittest.TestCase):
+    def step(self, robot, t, left, right):
+        # t is in seconds after the robot was set up
+        robot.leftEncoder, robot.rightEncoder = left, right
+        with patch('create_serial.create.time.monotonic', return_value=self.t0 + t):
+            robot._integrateNextEncoderStep()
+
+    def setUp(self):
+        self.t0 = time.monotonic() + 1.0
+
+    def test_interpolates_between_steps(self):
+        robot = make_robot()
+        self.step(robot, 10.0, 0, 0)
+        self.step(robot, 11.0, 1000, 1000)
+        x1, y1, th1 = robot.getPose()
+        x, y, th = robot.getPoseAt(self.t0 + 10.25)
+        self.assertAlmostEqual(x, x1 / 4)
+        self.assertAlmostEqual(y, 0.0)
+        # before and after the history: the nearest step
+        self.assertEqual(robot.getPoseAt(self.t0 + 20.0), robot.getPose())
+        self.assertEqual(robot.getPoseAt(0.0), (0.0, 0.0, 0.0))
+
+    def test_follows_the_arc(self):
+        robot = make_robot()
+        self.step(robot, 1.0, 0, 0)
+        self.step(robot, 2.0, 0, 400)
+        x1, y1, th1 = robot.getPose(dist='mm')
+        x, y, th = robot.getPoseAt(self.t0 + 1.5, dist='mm')
+        self.assertAlmostEqual(th, th1 / 2)
+        # the point is on the arc that leaves the start along the x axis
+        # and reaches the end
+        r = (x1 * x1 + y1 * y1) / (2 * y1)
+        self.assertAlmostEqual(math.hypot(x, y - r), r, places=6)
+        self.assertAlmostEqual(robot.getPoseAt(self.t0 + 2.0, dist='mm')[0], x1)
+
+    def test_history_is_bounded(self):
+        robot = make_robot()
+        for i in range(2 * POSE_HISTORY_LENGTH + 10):
+            self.step(robot, float(i), i, i)
+        self.assertLessEqual(len(robot._poseTimes), 2 * POSE_HISTORY_LENGTH)
+        self.assertEqual(robot.getPoseAt(self.t0 + 1e9), robot.getPose())
+
+
+class TestModeTracking(unittest.TestCase):
+    def setUp(self):
+        self.emu = OIEmulator()
+        self.robot = Create(LoopbackTransport(peer=self.emu), startingMode=PASSIVE_MODE)
+
+    def test_transitions_are_confirmed(self):
+        self.assertTrue(self.robot.toFullMode())
+        self.assertEqual(self.robot.reportedMode, FULL_MODE)
+        self.assertTrue(self.robot.toSafeMode())
+        self.assertEqual(self.emu.mode, SAFE_MODE)
+        self.assertEqual(self.robot.getMode(), SAFE_MODE)
+
+    def test_unconfirmed_transition_is_reported(self):
+        self.robot.ser.peer = MagicMock()
+        self.robot.ser.peer.feed.return_value = b''
+        start = time.monotonic()
+        self.assertFalse(self.robot.toSafeMode(timeout=0.1))
+        self.assertLess(time.monotonic() - start, 0.3)
+        self.assertEqual(self.robot.sciMode, SAFE_MODE)
+        self.assertEqual(self.robot.getMode(), PASSIVE_MODE)
+
+    def test_leaving_the_commanded_mode_calls_back(self):
+        robot = self.robot
+        robot.toSafeMode()
+        seen = []
+        robot.onModeLost(lambda commanded, reported: seen.append((commanded, reported)))
+        robot.sensors([OI_MODE, VOLTAGE])
+        self.assertEqual(seen, [])
+        self.emu.setSensor(CLIFF_LEFT, 1)
+        robot.sensors([OI_MODE, VOLTAGE])
+        robot.readFrame([OI_MODE])
+        self.assertEqual(seen, [(SAFE_MODE, PASSIVE_MODE)])
+        self.assertEqual(robot.getMode(), PASSIVE_MODE)
+
+
+class TestScripts(unittest.TestCase):
+    def setUp(self):
+        self.emu = OIEmulator()
+        self.robot = Create(LoopbackTransport(peer=self.emu), startingMode=SAFE_MODE)
+
+    def test_move_returns_when_the_script_ends(self):
+        start = time.monotonic()
+        self.robot.move(2, 20)
+        self.robot.move(2, 20)
+        elapsed = time.monotonic() - start
+        # two 0.1 s scripts back to back, without polling delays
+        self.assertGreater(elapsed, 0.18)
+        self.assertLess(elapsed, 0.35)
+        self.assertAlmostEqual(self.emu.x, 40.0, delta=2.0)
+        self.assertEqual(self.robot.sensord[BUMPS_AND_WHEEL_DROPS], [0, 0, 0, 0, 0])
+        self.assertEqual(self.robot.ser.in_waiting, 0)
+
+    def test_replies_already_asked_for_are_kept(self):
+        query = self.robot.submit_query([OI_MODE])
+        self.robot.move(1, 20)
+        self.assertTrue(query.done)
+        self.assertEqual(self.robot.sensord[OI_MODE], SAFE_MODE)
+
+    def test_move_while_streaming(self):
+        self.robot.startStream([ENCODER_LEFT, ENCODER_RIGHT])
+        start = time.monotonic()
+        self.robot.move(4, 20)
+        # a stream byte is not taken for the end of the script
+        self.assertGreater(time.monotonic() - start, 0.18)
+        self.assertAlmostEqual(self.emu.x, 40.0, delta=2.0)
+        self.assertTrue(self.robot.isStreaming())
+        time.sleep(0.1)
+        self.assertAlmostEqual(self.robot.getPose()[0], 4.0, delta=0.2)
+        self.robot.stopStream()
+
+    def test_timeout(self):
+        # a script that waits 5 s (WAIT TIME 50)
+        self.robot._startScript(2)
+        self.robot._write(bytes([155, 50]))
+        self.assertFalse(self.robot._endScript(timeout=0.05))
+
+
+class DropsAByte:
+    """ an OIEmulator that holds back the last byte of its next reply:
+    for late seconds, or for good if late is None """
+
+    def __init__(self, late=None):
+        self.emu = OIEmulator()
+        self.late = late
+        self.armed = False
+        self._held = None
+
+    def feed(self, data):
+        reply = self.emu.feed(data)
+        if self.armed and reply:
+            self.armed = False
+            if self.late is not None:
+                self._held = (time.monotonic() + self.late, reply[-1:])
+            reply = reply[:-1]
+        return reply
+
+    def poll(self):
+        produced = self.emu.poll()
+        if self._held is not None and time.monotonic() >= self._held[0]:
+            produced += self._held[1]
+            self._held = None
+        return produced
+
+
+class TestReplyTimeouts(unittest.TestCase):
+    def check_resyncs(self, peer):
+        robot = Create(LoopbackTransport(peer=peer), startingMode=SAFE_MODE)
+        peer.emu.setSensor(VOLTAGE, 15000)
+        peer.emu.setSensor(BATTERY_CHARGE, 2000)
+        peer.armed = True
+        start = time.monotonic()
+        robot.sensors([VOLTAGE, BATTERY_CHARGE])
+        # a reply timeout or two, not the port's half second
+        self.assertLess(time.monotonic() - start, 0.2)
+        self.assertEqual(robot.shortReplies, 1)
+        self.assertNotIn(VOLTAGE, robot.sensord)
+        # the next reply is read from its own first byte
+        d = robot.sensors([VOLTAGE, BATTERY_CHARGE])
+        self.assertEqual((d[VOLTAGE], d[BATTERY_CHARGE]), (15000, 2000))
+
+    def test_lost_byte(self):
+        self.check_resyncs(DropsAByte())
+
+    def test_late_byte(self):
+        self.check_resyncs(DropsAByte(late=0.08))
+
+    def test_timeout_follows_the_reply_length(self):
+        robot = make_robot()
+        robot.baudRate = 57600
+        self.assertEqual(robot._replyTimeout(1), 0.06)
+        self.assertEqual(robot._replyTimeout(80), 0.07)
+        robot.replyLatency = 0.2
+        self.assertEqual(robot._replyTimeout(1), 0.21)
+
+
+class Laggy:
+    """ an OIEmulator whose replies come back delay seconds late, like
+    a link with a USB adapter's latency timer in it. Counting replies
+    from 0 once replies is set, the ones in lose are never sent and
+    the ones in clip lose their last byte. onRequest, if set, is called
+    for every request that comes in
+    """
+
+    def __init__(self, delay):
+        self.emu = OIEmulator()
+        self.delay = delay
+        self.lose = ()
+        self.clip = ()
+        self.replies = None
+        self.inFlight = 0
+        self.mostInFlight = 0
+        self.onRequest = None
+        self._late = collections.deque()
+
+    def feed(self, data):
+        if self.onRequest is not None:
+            self.onRequest()
+        reply = self.emu.feed(data)
+        if reply and self.replies is not None:
+            lost = self.replies in self.lose
+            if self.replies in self.clip:
+                reply = reply[:-1]
+            self.replies += 1
+            if lost:
+                return b''
+        if reply:
+            self._late.append((time.monotonic() + self.delay, reply))
+            self.inFlight += 1
+            self.mostInFlight = max(self.mostInFlight, self.inFlight)
+        return b''
+
+    def poll(self):
+        produced = self.emu.poll()
+        while self._late and time.monotonic() >= self._late[0][0]:
+            produced += self._late.popleft()[1]
+            self.inFlight -= 1
+        return produced
+
+
+class TestPipelining(unittest.TestCase):
+    def setUp(self):
+        self.peer = Laggy(0.01)
+        self.robot = Create(LoopbackTransport(peer=self.peer), startingMode=SAFE_MODE)
+        self.peer.emu.setSensor(VOLTAGE, 15000)
+        self.peer.replies = 0
+        self.peer.mostInFlight = 0
+
+    def test_burst_overlaps_round_trips(self):
+        inFlight = []
+        self.peer.onRequest = lambda: inFlight.append(len(self.robot._pending))
+        start = time.monotonic()
+        results = self.robot.sensors_many(40, 0, [VOLTAGE, OI_MODE])
+        elapsed = time.monotonic() - start
+        self.assertEqual(len(results), 40)
+        self.assertTrue(all(d[VOLTAGE] == 15000 and d[OI_MODE] == SAFE_MODE for d in results))
+        # one round trip at a time would take 0.4 s
+        self.assertLess(elapsed, 0.25)
+        self.assertEqual(self.peer.mostInFlight, PIPELINE_DEPTH)
+        # once filled, the pipeline is topped up as each reply comes in
+        self.assertEqual(len(inFlight), 40)
+        self.assertEqual(inFlight[:PIPELINE_DEPTH], list(range(1, PIPELINE_DEPTH + 1)))
+        self.assertEqual(set(inFlight[PIPELINE_DEPTH:]), {PIPELINE_DEPTH})
+        self.assertEqual(self.robot.ser.in_waiting, 0)
+
+    def test_each_poll_is_its_own_snapshot(self):
+        results = self.robot.sensors_many(2, 0, [VOLTAGE])
+        self.assertIsNot(results[0], results[1])
+        self.assertIsNot(results[1], self.robot.sensord)
+
+    def test_interval(self):
+        start = time.monotonic()
+        results = self.robot.sensors_many(3, 0.05, [VOLTAGE])
+        self.assertGreater(time.monotonic() - start, 0.1)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(self.peer.mostInFlight, 1)
+
+    def test_lost_reply(self):
+        self.peer.lose = (2,)
+        results = self.robot.sensors_many(8, 0, [VOLTAGE])
+        # back to back, the replies were never known to be in step,
+        # so which one went missing cannot be told
+        self.assertEqual(results, [None] * 8)
+        self.assertEqual(self.robot.shortReplies, 1)
+        self.assertEqual(self.robot.sensors([VOLTAGE])[VOLTAGE], 15000)
+
+    def test_dropped_byte_spoils_only_the_polls_since_in_step(self):
+        self.peer.clip = (5,)
+        # polls further apart than a reply timeout: every reply is in
+        # before the next poll, and the clipped one times out first
+        results = self.robot.sensors_many(8, 0.08, [VOLTAGE, OI_MODE])
+        self.assertEqual(len(results), 8)
+        self.assertIsNone(results[5])
+        good = results[:5] + results[6:]
+        self.assertEqual([(d[VOLTAGE], d[OI_MODE]) for d in good],
+                         [(15000, SAFE_MODE)] * 7)
+        self.assertEqual(self.robot.shortReplies, 1)
+        d = self.robot.sensors([VOLTAGE, OI_MODE])
+        self.assertEqual((d[VOLTAGE], d[OI_MODE]), (15000, SAFE_MODE))
+        self.assertEqual(self.robot.shortReplies, 1)
+
+    def test_sensors_afterwards(self):
+        self.robot.sensors_many(5, 0, [VOLTAGE])
+        self.peer.emu.setSensor(VOLTAGE, 14000)
+        self.assertEqual(self.robot.sensors([VOLTAGE])[VOLTAGE], 14000)
+
+
 class TestModeStr(unittest.TestCase):
     def test_all_modes(self):
         self.assertEqual(modeStr(OFF_MODE), 'OFF_MODE')
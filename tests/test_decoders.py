@@ -0,0 +1,139 @@
+"""Tests for the compiled sensor decoders."""
+
+import unittest
+from unittest.mock import patch
+
+from create_serial.create import (
+    Create,
+    PASSIVE_MODE,
+    BUMPS_AND_WHEEL_DROPS,
+    LEFT_BUMP,
+    RIGHT_BUMP,
+    CENTER_WHEEL_DROP,
+    LSD_AND_OVERCURRENTS,
+    LEFT_WHEEL_OVERCURRENT,
+    RIGHT_WHEEL_OVERCURRENT,
+    BUTTONS,
+    ADVANCE_BUTTON,
+    PLAY_BUTTON,
+    CLIFF_LEFT,
+    DISTANCE,
+    VOLTAGE,
+    BATTERY_TEMP,
+    OI_MODE,
+    ENCODER_LEFT,
+    ENCODER_RIGHT,
+    POSE,
+    SENSOR_DATA_WIDTH,
+    SAFE_MODE,
+)
+from create_serial.decoders import PACKET_KINDS, LazyFrame, compileDecoder
+from create_serial.emulator import OIEmulator
+from create_serial.transport import LoopbackTransport
+
+
+def make_robot():
+    with patch('create_serial.create.time.sleep'):
+        return Create(LoopbackTransport(), startingMode=PASSIVE_MODE)
+
+
+class TestCompileDecoder(unittest.TestCase):
+    def test_size_matches_widths(self):
+        packets = tuple(range(7, 59))
+        self.assertEqual(compileDecoder(packets).size,
+                         sum(SENSOR_DATA_WIDTH[i] for i in packets))
+        self.assertEqual(len(PACKET_KINDS), len(SENSOR_DATA_WIDTH))
+
+    def test_cached(self):
+        self.assertIs(compileDecoder((OI_MODE, VOLTAGE)), compileDecoder((OI_MODE, VOLTAGE)))
+
+
+class TestDecode(unittest.TestCase):
+    def setUp(self):
+        self.robot = make_robot()
+
+    def test_bitfields_and_aliases(self):
+        self.robot._readSensorList([BUMPS_AND_WHEEL_DROPS, LSD_AND_OVERCURRENTS, BUTTONS, CLIFF_LEFT],
+                                   bytes([0b10110, 0b11000, 0b101, 2]))
+        d = self.robot.sensord
+        self.assertEqual(d[BUMPS_AND_WHEEL_DROPS], [1, 0, 1, 1, 0])
+        self.assertEqual((d[CENTER_WHEEL_DROP], d[LEFT_BUMP], d[RIGHT_BUMP]), (1, 1, 0))
+        self.assertEqual((d[LEFT_WHEEL_OVERCURRENT], d[RIGHT_WHEEL_OVERCURRENT]), (1, 1))
+        self.assertEqual(d[BUTTONS], [1, 1])
+        self.assertEqual((d[ADVANCE_BUTTON], d[PLAY_BUTTON]), (1, 1))
+        # only a byte of exactly 1 counts as set
+        self.assertEqual(d[CLIFF_LEFT], 0)
+
+    def test_bitfield_lists_are_not_shared(self):
+        self.robot._readSensorList([BUMPS_AND_WHEEL_DROPS], bytes([1]))
+        self.robot.sensord[BUMPS_AND_WHEEL_DROPS][0] = 9
+        self.robot._readSensorList([BUMPS_AND_WHEEL_DROPS], bytes([1]))
+        self.assertEqual(self.robot.sensord[BUMPS_AND_WHEEL_DROPS], [0, 0, 0, 0, 1])
+
+    def test_signed_and_unsigned(self):
+        self.robot._readSensorList([DISTANCE, VOLTAGE, BATTERY_TEMP],
+                                   bytearray([0xFF, 0xF6, 0xC3, 0x50, 0xFE]))
+        d = self.robot.sensord
+        self.assertEqual((d[DISTANCE], d[VOLTAGE], d[BATTERY_TEMP]), (-10, 50000, -2))
+
+    def test_short_reply_is_ignored(self):
+        # the missing byte could have been any of them
+        self.robot.sensord[VOLTAGE] = 1234
+        self.robot._readSensorList([OI_MODE, VOLTAGE], bytes([2, 0x3C]))
+        self.assertNotIn(OI_MODE, self.robot.sensord)
+        self.assertEqual(self.robot.sensord[VOLTAGE], 1234)
+
+    def test_encoders_update_the_pose(self):
+        robot = self.robot
+        robot._readSensorList([ENCODER_LEFT, ENCODER_RIGHT], bytes([0, 0, 0, 0]))
+        robot._readSensorList([ENCODER_LEFT, ENCODER_RIGHT], memoryview(bytes([0, 200, 0, 200])))
+        self.assertEqual((robot.leftEncoder, robot.rightEncoder), (200, 200))
+        x, y, th = robot.sensord[POSE]
+        self.assertGreater(x, 0)
+        self.assertAlmostEqual(y, 0)
+
+
+class TestLazyFrame(unittest.TestCase):
+    def setUp(self):
+        self.robot = make_robot()
+
+    def test_fields_decode_on_access(self):
+        decoder = compileDecoder((BUMPS_AND_WHEEL_DROPS, VOLTAGE, BATTERY_TEMP))
+        frame = decoder.frame(self.robot, bytes([0b10, 0x3C, 0x8C, 0xFE]))
+        self.assertIsInstance(frame, LazyFrame)
+        self.assertIsNone(frame._values)
+        self.assertEqual(frame[VOLTAGE], 0x3C8C)
+        self.assertEqual(list(frame._values), [VOLTAGE])
+        self.assertEqual(frame.batteryTemp, -2)
+        self.assertEqual(frame[LEFT_BUMP], 1)
+        self.assertEqual(frame.bumpsAndWheelDrops, [0, 0, 0, 1, 0])
+        self.assertEqual(frame.raw, bytes([0b10, 0x3C, 0x8C, 0xFE]))
+        self.assertNotIn(OI_MODE, frame)
+        with self.assertRaises(KeyError):
+            frame[OI_MODE]
+        with self.assertRaises(AttributeError):
+            frame.oiMode
+
+    def test_pose_is_integrated_eagerly(self):
+        robot = self.robot
+        decoder = compileDecoder((ENCODER_LEFT, ENCODER_RIGHT))
+        decoder.frame(robot, bytes([0, 0, 0, 0]))
+        frame = decoder.frame(robot, bytes([0, 200, 0, 200]))
+        self.assertEqual(robot.leftEncoder, 200)
+        self.assertGreater(frame.pose[0], 0)
+        self.assertEqual(frame[POSE], robot.sensord[POSE])
+        self.assertNotIn(ENCODER_LEFT, robot.sensord)
+
+    def test_read_frame(self):
+        emu = OIEmulator()
+        with patch('create_serial.create.time.sleep'):
+            robot = Create(LoopbackTransport(peer=emu), startingMode=SAFE_MODE)
+        frame = robot.readFrame([OI_MODE, VOLTAGE, LEFT_BUMP])
+        self.assertEqual(frame[OI_MODE], SAFE_MODE)
+        self.assertEqual(frame.voltage, 15500)
+        self.assertEqual(frame[LEFT_BUMP], 0)
+        self.assertEqual(len(frame.raw), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
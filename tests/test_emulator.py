@@ -0,0 +1,208 @@
+"""Tests for the Open Interface emulator."""
+
+import math
+import unittest
+from unittest.mock import patch
+
+from create_serial.create import (
+    Create,
+    PASSIVE_MODE,
+    SAFE_MODE,
+    FULL_MODE,
+    START,
+    SAFE,
+    FULL,
+    SENSORS,
+    QUERYLIST,
+    STREAM,
+    PAUSERESUME,
+    SCRIPT,
+    ENDSCRIPT,
+    WAITDIST,
+    DRIVE,
+    DRIVEDIRECT,
+    OI_MODE,
+    DISTANCE,
+    ANGLE,
+    VOLTAGE,
+    ENCODER_LEFT,
+    ENCODER_RIGHT,
+    BUMPS_AND_WHEEL_DROPS,
+    TICK_PER_MM,
+    SENSOR_DATA_WIDTH,
+)
+from create_serial.emulator import OIEmulator, PtyEmulator
+from create_serial.stream import StreamParser
+from create_serial.transport import LoopbackTransport, PosixTTYTransport
+
+
+class Clock:
+    def __init__(self):
+        self.t = 100.0
+
+    def __call__(self):
+        return self.t
+
+
+def drive(vel, radius):
+    return DRIVE + vel.to_bytes(2, 'big', signed=True) + radius.to_bytes(2, 'big', signed=True)
+
+
+def u16(b):
+    return b[0] << 8 | b[1]
+
+
+def s16(b):
+    return int.from_bytes(b, 'big', signed=True)
+
+
+def safe_emulator():
+    clock = Clock()
+    emu = OIEmulator(clock=clock)
+    emu.feed(START + SAFE)
+    return emu, clock
+
+
+class TestModes(unittest.TestCase):
+    def test_off_until_start(self):
+        emu = OIEmulator(clock=Clock())
+        self.assertEqual(emu.feed(SENSORS + bytes([OI_MODE])), b'')
+        self.assertEqual(emu.feed(START + SENSORS + bytes([OI_MODE])), bytes([PASSIVE_MODE]))
+
+    def test_safe_and_full(self):
+        emu, _ = safe_emulator()
+        self.assertEqual(emu.feed(SENSORS + bytes([OI_MODE])), bytes([SAFE_MODE]))
+        self.assertEqual(emu.feed(FULL + SENSORS + bytes([OI_MODE])), bytes([FULL_MODE]))
+
+    def test_drive_ignored_in_passive(self):
+        emu = OIEmulator(clock=Clock())
+        emu.feed(START + drive(200, 32767))
+        self.assertEqual(emu.leftVelocity, 0)
+
+    def test_wheel_drop_drops_to_passive(self):
+        emu, _ = safe_emulator()
+        emu.feed(drive(200, 32767))
+        emu.setSensor(BUMPS_AND_WHEEL_DROPS, 0x04)
+        self.assertEqual(emu.mode, PASSIVE_MODE)
+        self.assertEqual(emu.leftVelocity, 0)
+
+
+class TestSensors(unittest.TestCase):
+    def test_querylist_layout(self):
+        emu, _ = safe_emulator()
+        reply = emu.feed(QUERYLIST + bytes([3, OI_MODE, VOLTAGE, ENCODER_LEFT]))
+        self.assertEqual(len(reply), 5)
+        self.assertEqual(reply[0], SAFE_MODE)
+        self.assertEqual(u16(reply[1:3]), 15500)
+
+    def test_group_6_length(self):
+        emu, _ = safe_emulator()
+        self.assertEqual(len(emu.feed(SENSORS + bytes([6]))), 52)
+
+    def test_unknown_packet_has_no_reply(self):
+        emu, _ = safe_emulator()
+        self.assertEqual(emu.feed(SENSORS + bytes([99])), b'')
+
+    def test_commands_split_across_writes(self):
+        emu, _ = safe_emulator()
+        self.assertEqual(emu.feed(QUERYLIST + bytes([1])), b'')
+        self.assertEqual(emu.feed(bytes([OI_MODE])), bytes([SAFE_MODE]))
+
+
+class TestKinematics(unittest.TestCase):
+    def test_straight(self):
+        emu, clock = safe_emulator()
+        emu.feed(drive(100, 32767))
+        clock.t += 1.0
+        reply = emu.feed(QUERYLIST + bytes([4, DISTANCE, ANGLE, ENCODER_LEFT, ENCODER_RIGHT]))
+        self.assertEqual(s16(reply[0:2]), 100)
+        self.assertEqual(s16(reply[2:4]), 0)
+        self.assertEqual(u16(reply[4:6]), int(100 * TICK_PER_MM))
+        self.assertEqual(u16(reply[6:8]), int(100 * TICK_PER_MM))
+        self.assertAlmostEqual(emu.x, 100.0)
+        # distance resets once it has been read
+        self.assertEqual(emu.feed(SENSORS + bytes([DISTANCE])), b'\x00\x00')
+
+    def test_spin_in_place(self):
+        emu, clock = safe_emulator()
+        emu.feed(drive(100, 1))
+        clock.t += 1.0
+        self.assertAlmostEqual(emu.x, 0.0)
+        emu.feed(b'')
+        self.assertAlmostEqual(emu.th, 200.0 / 235.0)
+        angle = s16(emu.feed(SENSORS + bytes([ANGLE])))
+        self.assertEqual(angle, int(math.degrees(200.0 / 235.0)))
+
+    def test_drive_direct(self):
+        emu, clock = safe_emulator()
+        emu.feed(DRIVEDIRECT + (50).to_bytes(2, 'big') + (-50).to_bytes(2, 'big', signed=True))
+        self.assertEqual((emu.leftVelocity, emu.rightVelocity), (-50, 50))
+
+    def test_encoders_wrap(self):
+        emu, clock = safe_emulator()
+        emu.rightTicks = 65530.0
+        emu.feed(drive(100, 32767))
+        clock.t += 0.1
+        right = u16(emu.feed(SENSORS + bytes([ENCODER_RIGHT])))
+        self.assertLess(right, 65530)
+
+
+class TestScript(unittest.TestCase):
+    def test_wait_distance_holds_replies(self):
+        emu, clock = safe_emulator()
+        script = drive(100, 32767) + WAITDIST + (50).to_bytes(2, 'big') + drive(0, 1)
+        emu.feed(SCRIPT + bytes([len(script)]) + script)
+        self.assertEqual(emu.feed(ENDSCRIPT + SENSORS + bytes([OI_MODE])), b'')
+        clock.t += 0.25
+        self.assertEqual(emu.poll(), b'')
+        clock.t += 0.5
+        self.assertEqual(emu.poll(), bytes([SAFE_MODE]))
+        # it stopped exactly where the wait finished
+        self.assertAlmostEqual(emu.x, 50.0)
+        self.assertEqual(emu.leftVelocity, 0)
+
+
+class TestStream(unittest.TestCase):
+    def test_frames_every_15ms(self):
+        emu, clock = safe_emulator()
+        emu.feed(STREAM + bytes([2, OI_MODE, ENCODER_LEFT]))
+        parser = StreamParser(SENSOR_DATA_WIDTH)
+        clock.t += 0.1
+        frames = parser.feed(emu.poll())
+        self.assertEqual(len(frames), 7)   # t = 0, 15, ..., 90 ms
+        self.assertEqual(frames[0][0], [OI_MODE, ENCODER_LEFT])
+        emu.feed(PAUSERESUME + bytes([0]))
+        clock.t += 0.1
+        self.assertEqual(emu.poll(), b'')
+
+
+class TestWithCreate(unittest.TestCase):
+    @patch('create_serial.create.time.sleep')
+    def test_create_over_loopback(self, mock_sleep):
+        clock = Clock()
+        emu = OIEmulator(clock=clock)
+        robot = Create(LoopbackTransport(peer=emu), startingMode=SAFE_MODE)
+        self.assertEqual(emu.mode, SAFE_MODE)
+        robot.go_differential(10, 0)
+        robot.sensors([ENCODER_LEFT, ENCODER_RIGHT])
+        clock.t += 1.0
+        d = robot.sensors([ENCODER_LEFT, ENCODER_RIGHT, OI_MODE])
+        self.assertEqual(d[OI_MODE], SAFE_MODE)
+        x, y, th = robot.getPose()
+        self.assertAlmostEqual(x, 10.0, delta=0.1)
+        self.assertAlmostEqual(th, 0.0)
+
+
+class TestPty(unittest.TestCase):
+    def test_pty_round_trip(self):
+        with PtyEmulator() as sim:
+            port = PosixTTYTransport(sim.path, timeout=1.0)
+            try:
+                port.write(START + SENSORS + bytes([OI_MODE]))
+                self.assertEqual(port.read(1), bytes([PASSIVE_MODE]))
+            finally:
+                port.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""Tests for the NumPy sensor history."""
+
+import time
+import unittest
+from unittest.mock import patch
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from create_serial.create import (
+    Create,
+    PASSIVE_MODE,
+    SAFE_MODE,
+    BUMPS_AND_WHEEL_DROPS,
+    DISTANCE,
+    VOLTAGE,
+    OI_MODE,
+    ENCODER_LEFT,
+    ENCODER_RIGHT,
+    LEFT_BUMP,
+)
+from create_serial.emulator import OIEmulator
+from create_serial.recorder import RECORD_SENSORS
+from create_serial.transport import LoopbackTransport
+
+if np is not None:
+    from create_serial.history import SensorHistory, replyDtype
+
+
+@unittest.skipIf(np is None, 'needs numpy')
+class TestSensorHistory(unittest.TestCase):
+    def test_dtype_reads_the_reply(self):
+        dtype = replyDtype((BUMPS_AND_WHEEL_DROPS, DISTANCE, VOLTAGE), trailer=False)
+        row = np.frombuffer(bytes([0b10, 0xFF, 0xF6, 0x3C, 0x8C]), dtype=dtype)[0]
+        self.assertEqual(row['bumpsAndWheelDrops'], 2)
+        self.assertEqual(row['distance'], -10)
+        self.assertEqual(row['voltage'], 0x3C8C)
+
+    def test_ring_wraps_and_views_are_contiguous(self):
+        h = SensorHistory((OI_MODE,), capacity=4)
+        for i in range(6):
+            h.append(float(i), bytes([i]), (i, 0.0, 0.0))
+        self.assertEqual(len(h), 4)
+        rows = h.latest()
+        self.assertEqual(list(rows['t']), [2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(list(rows['oiMode']), [2, 3, 4, 5])
+        self.assertIs(rows.base, h._rows)
+        self.assertEqual(list(h.latest(2)['x']), [4.0, 5.0])
+
+    def test_time_windows(self):
+        h = SensorHistory((OI_MODE,), capacity=8)
+        for i in range(5):
+            h.append(i * 0.5, bytes([i]), (0.0, 0.0, 0.0))
+        self.assertEqual(list(h.window(1.0)['t']), [1.0, 1.5, 2.0])
+        self.assertEqual(list(h.between(0.4, 1.0)['oiMode']), [1, 2])
+        self.assertEqual(len(SensorHistory((OI_MODE,)).window(1.0)), 0)
+
+
+@unittest.skipIf(np is None, 'needs numpy')
+class TestCreateHistory(unittest.TestCase):
+    def test_polls_are_recorded(self):
+        emu = OIEmulator()
+        with patch('create_serial.create.time.sleep'):
+            robot = Create(LoopbackTransport(peer=emu), startingMode=SAFE_MODE)
+        h = robot.enableHistory([ENCODER_LEFT, ENCODER_RIGHT, VOLTAGE, LEFT_BUMP], 16)
+        robot.go_differential(10, 0)
+        for i in range(3):
+            robot.sensors([ENCODER_LEFT, ENCODER_RIGHT, VOLTAGE, LEFT_BUMP])
+        robot.sensors([OI_MODE])            # another layout: not recorded
+        robot.readFrame([ENCODER_LEFT, ENCODER_RIGHT, VOLTAGE, LEFT_BUMP])
+        rows = h.latest()
+        self.assertEqual(len(rows), 4)
+        self.assertTrue((rows['voltage'] == 15500).all())
+        self.assertTrue((np.diff(rows['t']) >= 0).all())
+        self.assertEqual(rows['x'][-1], robot.getPose()[0])
+        self.assertIs(robot.disableHistory(), h)
+
+    def test_streamed_and_polled_replies_share_the_history(self):
+        emu = OIEmulator()
+        robot = Create(LoopbackTransport(peer=emu), startingMode=SAFE_MODE)
+        h = robot.enableHistory(RECORD_SENSORS, 64)
+        # polled as group 6 and the light bumps, which brings packet 16 along
+        robot.sensors(RECORD_SENSORS)
+        self.assertEqual(len(h), 1)
+        robot.startStream(RECORD_SENSORS)
+        time.sleep(0.1)
+        robot.stopStream()
+        self.assertGreater(len(h), 3)
+        rows = h.latest()
+        self.assertTrue((rows['voltage'] == 15500).all())
+        self.assertTrue((rows['oiMode'] == SAFE_MODE).all())
+
+    def test_partial_replies_are_skipped(self):
+        with patch('create_serial.create.time.sleep'):
+            robot = Create(LoopbackTransport(), startingMode=PASSIVE_MODE)
+        h = robot.enableHistory([OI_MODE, VOLTAGE])
+        robot._readSensorList([OI_MODE, VOLTAGE], bytes([1, 2]))
+        self.assertEqual(len(h), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
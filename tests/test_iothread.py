@@ -0,0 +1,128 @@
+"""Tests for the prioritized I/O thread."""
+
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from create_serial.create import (
+    Create,
+    SAFE_MODE,
+    DRIVE,
+    LEDS,
+    SONG,
+    SENSORS,
+    OI_MODE,
+    VOLTAGE,
+    ENCODER_LEFT,
+    ENCODER_RIGHT,
+)
+from create_serial.emulator import OIEmulator
+from create_serial.iothread import (
+    PRIORITY_SAFETY,
+    PRIORITY_DRIVE,
+    PRIORITY_SENSORS,
+    PRIORITY_PERIPHERAL,
+    commandPriority,
+)
+from create_serial.transport import LoopbackTransport
+
+
+class GatedPort(LoopbackTransport):
+    """ a loopback to an emulator whose writes can be held up,
+    so the I/O thread's queue can be filled while it waits
+    """
+
+    def __init__(self, peer):
+        LoopbackTransport.__init__(self, peer=peer)
+        self.gate = threading.Event()
+        self.gate.set()
+        self.writes = []
+
+    def write(self, data):
+        self.gate.wait()
+        self.writes.append(bytes(data))
+        return LoopbackTransport.write(self, data)
+
+
+def make_robot():
+    emu = OIEmulator()
+    port = GatedPort(emu)
+    with patch('create_serial.create.time.sleep'):
+        robot = Create(port, startingMode=SAFE_MODE)
+    return robot, port, emu
+
+
+class TestCommandPriority(unittest.TestCase):
+    def test_classes(self):
+        self.assertEqual(commandPriority(DRIVE + bytes([0, 0, 0x80, 0])), PRIORITY_SAFETY)
+        self.assertEqual(commandPriority(DRIVE + bytes([0, 100, 0x80, 0])), PRIORITY_DRIVE)
+        self.assertEqual(commandPriority(bytes([131])), PRIORITY_SAFETY)
+        self.assertEqual(commandPriority(SENSORS + bytes([7])), PRIORITY_SENSORS)
+        self.assertEqual(commandPriority(LEDS + bytes([0, 0, 0])), PRIORITY_PERIPHERAL)
+        self.assertEqual(commandPriority(SONG + bytes([0, 1, 60, 8])), PRIORITY_PERIPHERAL)
+
+
+class TestIOThread(unittest.TestCase):
+    def test_stop_jumps_the_queue_and_drops_queued_drives(self):
+        robot, port, emu = make_robot()
+        io = robot.startIOThread()
+        try:
+            port.gate.clear()
+            robot.setLEDs(0, 0, 0, 0)       # taken by the thread, held at the gate
+            time.sleep(0.05)
+            robot.playSong([(60, 8)] * 16)
+            robot.go_differential(20, 0)
+            robot.go_differential(0, 0)     # a stop
+            self.assertEqual(io.depth(), 3)
+            port.gate.set()
+        finally:
+            robot.stopIOThread()
+        opcodes = [data[0] for data in port.writes[-4:]]
+        # LEDs were already on their way; then the stop, then the song
+        self.assertEqual(opcodes, [LEDS[0], DRIVE[0], SONG[0], 141])
+        self.assertEqual(emu.leftVelocity, 0)
+        stats = io.stats()
+        self.assertEqual(stats['safety']['count'], 1)
+        self.assertEqual(stats['drive']['count'], 0)
+        self.assertGreater(stats['peripheral']['max'], stats['safety']['max'])
+
+    def test_sensors_through_the_thread(self):
+        robot, port, emu = make_robot()
+        robot.startIOThread()
+        try:
+            d = robot.sensors([OI_MODE, VOLTAGE])
+            self.assertEqual(d[OI_MODE], SAFE_MODE)
+            self.assertEqual(d[VOLTAGE], 15500)
+            futures = [robot._ioThread.query([ENCODER_LEFT, ENCODER_RIGHT]) for i in range(5)]
+            for future in futures:
+                self.assertIn(ENCODER_LEFT, future.result(timeout=1.0))
+        finally:
+            robot.stopIOThread()
+        self.assertEqual(len(robot._pending), 0)
+
+    def test_move_waits_for_the_script(self):
+        robot, port, emu = make_robot()
+        robot.startIOThread()
+        try:
+            robot.move(2, 20)
+            self.assertAlmostEqual(emu.x, 20.0, delta=1.0)
+        finally:
+            robot.stopIOThread()
+
+    def test_stream_through_the_thread(self):
+        robot, port, emu = make_robot()
+        robot.startIOThread()
+        frames = []
+        try:
+            robot.startStream([OI_MODE], callback=frames.append)
+            time.sleep(0.1)
+            robot.stopStream()
+        finally:
+            robot.stopIOThread()
+        self.assertGreater(len(frames), 2)
+        self.assertEqual(robot.sensord[OI_MODE], SAFE_MODE)
+
+
+if __name__ == '__main__':
+    unittest.main()
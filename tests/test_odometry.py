@@ -0,0 +1,74 @@
+"""Tests for the vectorized odometry."""
+
+import random
+import unittest
+from unittest.mock import patch
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from create_serial.create import Create, PASSIVE_MODE
+from create_serial.transport import LoopbackTransport
+
+if np is not None:
+    from create_serial.odometry import calibrate, encoderDeltas, integrateEncoders
+
+
+def drive(n, seed=3):
+    """ encoder counts of a wandering drive, crossing the 16-bit wrap """
+    rng = random.Random(seed)
+    left, right = [65000], [200]
+    for i in range(n - 1):
+        step = rng.randrange(0, 60)
+        turn = rng.randrange(-15, 16)
+        left.append((left[-1] + step - turn) % 65536)
+        right.append((right[-1] + step + turn) % 65536)
+    return left, right
+
+
+@unittest.skipIf(np is None, 'needs numpy')
+class TestIntegrateEncoders(unittest.TestCase):
+    def test_wraparound(self):
+        self.assertEqual(list(encoderDeltas([65530, 4, 65530])), [10, -10])
+
+    def test_matches_the_per_sample_integration(self):
+        with patch('create_serial.create.time.sleep'):
+            robot = Create(LoopbackTransport(), startingMode=PASSIVE_MODE)
+        robot.setPose(5.0, -3.0, 0.5)
+        left, right = drive(500)
+        poses = []
+        for l, r in zip(left, right):
+            robot.leftEncoder, robot.rightEncoder = l, r
+            robot._integrateNextEncoderStep()
+            poses.append(robot.getPose())
+        x, y, th = integrateEncoders(left, right, start=(5.0, -3.0, 0.5))
+        for i in (0, 1, 250, 499):
+            self.assertAlmostEqual(x[i], poses[i][0], places=6)
+            self.assertAlmostEqual(y[i], poses[i][1], places=6)
+            self.assertAlmostEqual(th[i], poses[i][2], places=6)
+
+    def test_candidate_arrays(self):
+        left, right = drive(50)
+        x, y, th = integrateEncoders(left, right, wheelSpan=[230.0, 235.0, 240.0])
+        self.assertEqual(x.shape, (3, 50))
+        one = integrateEncoders(left, right, wheelSpan=235.0)
+        self.assertTrue(np.allclose(x[1], one[0]))
+
+
+@unittest.skipIf(np is None, 'needs numpy')
+class TestCalibrate(unittest.TestCase):
+    def test_finds_the_true_geometry(self):
+        left, right = drive(2000)
+        x, y, th = integrateEncoders(left, right, wheelSpan=241.0, wheelDiameter=71.0)
+        span, diameter, errors = calibrate(left, right, (x[-1], y[-1], th[-1]),
+                                           np.arange(225.0, 246.0, 1.0),
+                                           np.arange(69.0, 75.5, 0.5))
+        self.assertEqual((span, diameter), (241.0, 71.0))
+        self.assertEqual(errors.shape, (21, 13))
+        self.assertAlmostEqual(errors.min(), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,261 @@
+"""Tests for the session recorder and replayer."""
+
+import io
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from create_serial.create import (
+    Create,
+    SAFE_MODE,
+    PASSIVE_MODE,
+    SENSORS,
+    QUERYLIST,
+    STREAM,
+    SONG,
+    DRIVE,
+    ENCODER_LEFT,
+    ENCODER_RIGHT,
+    OI_MODE,
+    VOLTAGE,
+    BATTERY_CHARGE,
+)
+from create_serial.emulator import OIEmulator
+from create_serial.recorder import (
+    RESET,
+    RX,
+    TX,
+    RecordingTransport,
+    ReplayTransport,
+    SessionLog,
+    _splitCommands,
+    replaySession,
+)
+from create_serial.stream import encodeStreamFrame
+from create_serial.transport import LoopbackTransport
+
+
+class Clock:
+    def __init__(self):
+        self.t = 100.0
+
+    def __call__(self):
+        return self.t
+
+
+class Scripted:
+    """ a port that swallows writes and hands out queued replies """
+
+    timeout = 0.5
+    baudrate = 115200
+    is_open = True
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+
+    def write(self, data):
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        return len(self.replies[0]) if self.replies else 0
+
+    def read(self, size=1):
+        return self.replies.pop(0) if self.replies else b''
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class SlowToWake:
+    """ an OIEmulator that ignores the first few writes """
+
+    def __init__(self, ignored):
+        self.emu = OIEmulator()
+        self.ignored = ignored
+
+    def feed(self, data):
+        if self.ignored > 0:
+            self.ignored -= 1
+            return b''
+        return self.emu.feed(data)
+
+
+class DropsAByte:
+    """ an OIEmulator that loses the last byte of its next reply """
+
+    def __init__(self):
+        self.emu = OIEmulator()
+        self.armed = False
+
+    def feed(self, data):
+        reply = self.emu.feed(data)
+        if self.armed and reply:
+            self.armed = False
+            reply = reply[:-1]
+        return reply
+
+
+class LogTestCase(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.oilog')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+
+class TestRecording(LogTestCase):
+    def test_both_directions_in_order(self):
+        rec = RecordingTransport(LoopbackTransport(), self.path)
+        rec.write(b'\x80\x83')
+        self.assertEqual(rec.read(2), b'\x80\x83')
+        rec.write(b'\x8e\x07')
+        rec.close()
+        with SessionLog(self.path) as log:
+            records = [(d, bytes(data)) for t, d, data in log.records()]
+            times = [t for t, d, data in log.records()]
+        self.assertEqual(records, [(TX, b'\x80\x83'), (RX, b'\x80\x83'), (TX, b'\x8e\x07')])
+        self.assertEqual(times, sorted(times))
+
+    def test_large_reads_are_split(self):
+        rec = RecordingTransport(Scripted(bytes(70000)), self.path)
+        self.assertEqual(len(rec.read(70000)), 70000)
+        rec.close()
+        with SessionLog(self.path) as log:
+            sizes = [len(data) for t, d, data in log.records(RX)]
+        self.assertEqual(sizes, [65535, 4465])
+
+    def test_file_object_is_left_open(self):
+        f = io.BytesIO()
+        rec = RecordingTransport(LoopbackTransport(), f)
+        rec.write(b'\x80')
+        rec.close()
+        self.assertFalse(f.closed)
+        self.assertEqual(len(f.getvalue()), 16 + 11 + 1)
+
+    def test_reset_is_recorded(self):
+        rec = RecordingTransport(Scripted(b'\x01\x02'), self.path)
+        rec.reset_input_buffer()
+        rec.reset_input_buffer()
+        rec.close()
+        with SessionLog(self.path) as log:
+            records = [(d, bytes(data)) for t, d, data in log.records()]
+        # what was thrown away is kept, but not as received bytes
+        self.assertEqual(records, [(RESET, b'\x01\x02'), (RESET, b'')])
+
+    def test_not_a_log(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'something else entirely')
+        with self.assertRaises(ValueError):
+            SessionLog(self.path)
+
+
+class TestSplitCommands(unittest.TestCase):
+    def test_complete_and_partial(self):
+        buf = bytearray(SENSORS + bytes([7]) + QUERYLIST + bytes([2, 43, 44]) + QUERYLIST + bytes([3, 7]))
+        self.assertEqual(_splitCommands(buf), [(142, bytes([7])), (149, bytes([2, 43, 44]))])
+        self.assertEqual(buf, QUERYLIST + bytes([3, 7]))
+
+    def test_song_length(self):
+        buf = bytearray(SONG + bytes([1, 2, 60, 8, 62, 8]) + DRIVE + bytes(4))
+        self.assertEqual([op for op, payload in _splitCommands(buf)], [140, 137])
+
+
+class TestReplay(LogTestCase):
+    @patch('create_serial.create.time.sleep')
+    def test_replay_reproduces_odometry(self, mock_sleep):
+        clock = Clock()
+        emu = OIEmulator(clock=clock)
+        rec = RecordingTransport(LoopbackTransport(peer=emu), self.path)
+        robot = Create(rec, startingMode=SAFE_MODE)
+        robot.go_differential(10, 0.1)
+        for i in range(5):
+            robot.sensors([ENCODER_LEFT, ENCODER_RIGHT, OI_MODE])
+            clock.t += 0.2
+        robot.sensors(3)
+        rec.close()
+        live = robot.getPose()
+
+        replayed = Create(LoopbackTransport(), startingMode=PASSIVE_MODE)
+        seen = []
+        n = replaySession(self.path, replayed, callback=lambda t, d: seen.append(t))
+        # the five polls, the group 3 read, the readiness probe and
+        # the OI_MODE read that confirms safe mode
+        self.assertEqual(n, 8)
+        self.assertEqual(len(seen), 8)
+        for a, b in zip(replayed.getPose(), live):
+            self.assertAlmostEqual(a, b)
+        self.assertEqual(replayed.sensord[OI_MODE], SAFE_MODE)
+        self.assertEqual(replayed.sensord[VOLTAGE], robot.sensord[VOLTAGE])
+
+    def check_replay_matches(self, peer, live):
+        """ records live(robot) on a robot talking to peer, replays it
+        and checks the replay ends with the same sensor values """
+        rec = RecordingTransport(LoopbackTransport(peer=peer), self.path)
+        robot = Create(rec, startingMode=SAFE_MODE)
+        peer.emu.setSensor(VOLTAGE, 15000)
+        peer.emu.setSensor(BATTERY_CHARGE, 2000)
+        live(robot)
+        rec.close()
+
+        replayed = Create(LoopbackTransport(), startingMode=PASSIVE_MODE)
+        n = replaySession(self.path, replayed)
+        for packet in (OI_MODE, VOLTAGE, BATTERY_CHARGE):
+            self.assertEqual(replayed.sensord[packet], robot.sensord[packet])
+        return n
+
+    def test_unanswered_probes_are_dropped(self):
+        def live(robot):
+            robot.sensors([VOLTAGE, BATTERY_CHARGE])
+        n = self.check_replay_matches(SlowToWake(3), live)
+        # one probe answered, the mode confirmation and the poll
+        self.assertEqual(n, 3)
+
+    def test_short_reply_is_dropped(self):
+        peer = DropsAByte()
+        def live(robot):
+            peer.armed = True
+            robot.sensors([VOLTAGE, BATTERY_CHARGE])
+            self.assertEqual(robot.shortReplies, 1)
+            robot.sensors([VOLTAGE, BATTERY_CHARGE])
+        n = self.check_replay_matches(peer, live)
+        self.assertEqual(n, 3)
+
+    @patch('create_serial.create.time.sleep')
+    def test_stream_frames_are_decoded(self, mock_sleep):
+        frames = [encodeStreamFrame([(ENCODER_LEFT, bytes([0, 10 * i])),
+                                     (ENCODER_RIGHT, bytes([0, 10 * i]))]) for i in range(3)]
+        # a frame split across two reads
+        port = Scripted(frames[0] + frames[1][:4], frames[1][4:], frames[2])
+        rec = RecordingTransport(port, self.path)
+        rec.write(STREAM + bytes([2, ENCODER_LEFT, ENCODER_RIGHT]))
+        for i in range(3):
+            rec.read(64)
+        rec.close()
+
+        robot = Create(LoopbackTransport(), startingMode=PASSIVE_MODE)
+        self.assertEqual(replaySession(self.path, robot), 3)
+        self.assertEqual(robot.sensord[ENCODER_LEFT], 20)
+
+
+class TestReplayTransport(LogTestCase):
+    def test_serves_received_bytes(self):
+        rec = RecordingTransport(Scripted(b'\x01\x02', b'\x03'), self.path)
+        rec.write(b'\x8e\x07')
+        rec.read(2)
+        rec.read(1)
+        rec.close()
+
+        port = ReplayTransport(self.path, timeout=0.01)
+        self.assertEqual(port.write(b'\x8e\x07'), 2)
+        self.assertEqual(port.read(3), b'\x01\x02\x03')
+        self.assertTrue(port.exhausted)
+        self.assertEqual(port.read(1), b'')
+        port.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
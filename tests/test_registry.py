@@ -0,0 +1,72 @@
+"""Tests for the sensor registry."""
+
+import unittest
+from unittest.mock import patch
+
+import create_serial.create as create
+from create_serial.create import Create, PASSIVE_MODE
+from create_serial.registry import (
+    BITS,
+    PACKETS,
+    SPECS,
+    SENSOR_DATA_WIDTH,
+    PRINTED_SENSORS,
+    encodePacket,
+    encodeReply,
+    formatSensors,
+)
+from create_serial.snapshot import SensorSnapshot
+from create_serial.transport import LoopbackTransport
+
+
+class TestRegistry(unittest.TestCase):
+    def test_constants_match_the_table(self):
+        for sensornum, constant, _, _, _ in PACKETS:
+            if constant is not None:
+                self.assertEqual(getattr(create, constant), sensornum)
+        for sensornum, constant, _, _, _ in BITS:
+            self.assertEqual(getattr(create, constant), sensornum)
+        self.assertIs(create.SENSOR_DATA_WIDTH, SENSOR_DATA_WIDTH)
+
+    def test_every_packet_round_trips(self):
+        with patch('create_serial.create.time.sleep'):
+            robot = Create(LoopbackTransport(), startingMode=PASSIVE_MODE)
+        values = {}
+        for spec in SPECS.values():
+            if spec.kind == 'lower5':
+                values[spec.id] = [1, 0, 1, 1, 0]
+            elif spec.kind == 'buttons':
+                values[spec.id] = [0, 1]
+            elif spec.kind == 'bit':
+                values[spec.id] = 1
+            elif spec.signed:
+                values[spec.id] = -(spec.id * spec.width)
+            else:
+                values[spec.id] = spec.id * 37 % (256 ** spec.width)
+        packets = list(SPECS)
+        reply = encodeReply(packets, values)
+        self.assertEqual(len(reply), sum(SENSOR_DATA_WIDTH))
+        robot._readSensorList(packets, reply)
+        for sensornum, value in values.items():
+            self.assertEqual(robot.sensord[sensornum], value, SPECS[sensornum].name)
+        self.assertEqual(robot.sensord[create.LEFT_BUMP], 1)
+        self.assertEqual(robot.sensord[create.PLAY_BUTTON], 1)
+
+    def test_encode_raw_values(self):
+        self.assertEqual(encodePacket(create.DISTANCE, -2), b'\xff\xfe')
+        self.assertEqual(encodePacket(create.BUMPS_AND_WHEEL_DROPS, 0b10), b'\x02')
+        self.assertEqual(encodePacket(create.ENCODER_LEFT, 65537), b'\x00\x01')
+        self.assertEqual(encodePacket(0, 5), b'')
+
+    def test_format(self):
+        d = SensorSnapshot({create.VOLTAGE: 15000, create.LEFT_BUMP: 1,
+                            create.POSE: (1.0, 2.0, 0.5)})
+        lines = formatSensors(d)
+        self.assertEqual(lines[0], '%28s: 15000 mV' % 'VOLTAGE')
+        self.assertEqual(lines[1], '%28s: 1' % 'LEFT_BUMP')
+        self.assertEqual(len(lines), 5)
+        self.assertNotIn(16, PRINTED_SENSORS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""Tests for SensorSnapshot, the slot-based sensord."""
+
+import unittest
+from unittest.mock import patch
+
+from create_serial.create import (
+    Create,
+    PASSIVE_MODE,
+    VOLTAGE,
+    OI_MODE,
+    POSE,
+    LEFT_BUMP,
+    BUMPS_AND_WHEEL_DROPS,
+    SENSOR_GROUPS,
+)
+from create_serial.snapshot import FIELD_NAMES, SensorSnapshot
+from create_serial.transport import LoopbackTransport
+
+
+class TestSensorSnapshot(unittest.TestCase):
+    def test_reads_like_a_dict(self):
+        d = SensorSnapshot({VOLTAGE: 15000, OI_MODE: PASSIVE_MODE})
+        self.assertEqual(d[VOLTAGE], 15000)
+        self.assertEqual(d.voltage, 15000)
+        self.assertIn(OI_MODE, d)
+        self.assertNotIn(LEFT_BUMP, d)
+        self.assertIsNone(d.get(LEFT_BUMP))
+        self.assertEqual(d.get(LEFT_BUMP, 0), 0)
+        with self.assertRaises(KeyError):
+            d[LEFT_BUMP]
+        self.assertEqual(dict(d), {OI_MODE: PASSIVE_MODE, VOLTAGE: 15000})
+        self.assertEqual(d, {VOLTAGE: 15000, OI_MODE: PASSIVE_MODE})
+        self.assertEqual(len(d), 2)
+
+    def test_ids_without_a_field(self):
+        d = SensorSnapshot()
+        d[3] = 0
+        self.assertEqual(d[3], 0)
+        self.assertEqual(list(d), [3])
+        del d[3]
+        self.assertEqual(len(d), 0)
+
+    def test_copy_is_independent(self):
+        d = SensorSnapshot({VOLTAGE: 1})
+        e = d.copy()
+        d[VOLTAGE] = 2
+        self.assertEqual(e[VOLTAGE], 1)
+        self.assertIsInstance(e, SensorSnapshot)
+
+    def test_no_instance_dict(self):
+        d = SensorSnapshot()
+        self.assertFalse(hasattr(d, '__dict__'))
+        with self.assertRaises(AttributeError):
+            d.notASensor = 1
+
+    def test_every_packet_has_a_field(self):
+        for sensornum in SENSOR_GROUPS[6]:
+            self.assertIn(sensornum, FIELD_NAMES)
+        for sensornum in range(43, 52):
+            self.assertIn(sensornum, FIELD_NAMES)
+
+
+class TestDecodeIntoSnapshot(unittest.TestCase):
+    def test_decoder_fills_fields(self):
+        with patch('create_serial.create.time.sleep'):
+            robot = Create(LoopbackTransport(), startingMode=PASSIVE_MODE)
+        robot._readSensorList([BUMPS_AND_WHEEL_DROPS, VOLTAGE], bytes([0b10, 0x3C, 0x8C]))
+        d = robot.sensord
+        self.assertIsInstance(d, SensorSnapshot)
+        self.assertEqual(d.voltage, 0x3C8C)
+        self.assertEqual(d.leftBump, 1)
+        self.assertEqual(d.bumpsAndWheelDrops, [0, 0, 0, 1, 0])
+        self.assertEqual(d.pose, d[POSE])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+"""Tests for the OI stream frame parser."""
+
+import unittest
+
+from create_serial.create import (
+    SENSOR_DATA_WIDTH,
+    BUMPS_AND_WHEEL_DROPS,
+    ENCODER_LEFT,
+    ENCODER_RIGHT,
+    WALL_SIGNAL,
+)
+from create_serial.stream import StreamParser, encodeStreamFrame
+
+
+def frame():
+    return encodeStreamFrame([
+        (BUMPS_AND_WHEEL_DROPS, b'\x03'),
+        (ENCODER_LEFT, b'\x01\x02'),
+        (ENCODER_RIGHT, b'\x03\x04'),
+    ])
+
+
+class TestEncodeStreamFrame(unittest.TestCase):
+    def test_layout(self):
+        f = frame()
+        self.assertEqual(f[0], 19)
+        self.assertEqual(f[1], 8)   # 3 ids + 5 data bytes
+        self.assertEqual(len(f), 11)
+        self.assertEqual(sum(f) & 0xFF, 0)
+
+
+class TestStreamParser(unittest.TestCase):
+    def test_single_frame(self):
+        p = StreamParser(SENSOR_DATA_WIDTH)
+        frames = p.feed(frame())
+        self.assertEqual(frames, [([7, 43, 44], b'\x03\x01\x02\x03\x04')])
+        self.assertEqual(p.pending(), 0)
+
+    def test_byte_at_a_time(self):
+        p = StreamParser(SENSOR_DATA_WIDTH)
+        frames = []
+        for b in frame() * 2:
+            frames += p.feed(bytes([b]))
+        self.assertEqual(len(frames), 2)
+        self.assertEqual(p.frames, 2)
+
+    def test_resync_after_garbage(self):
+        p = StreamParser(SENSOR_DATA_WIDTH)
+        frames = p.feed(b'\x00\x13\x05\xff' + frame())
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0][0], [7, 43, 44])
+
+    def test_bad_checksum_is_dropped(self):
+        p = StreamParser(SENSOR_DATA_WIDTH)
+        bad = bytearray(frame())
+        bad[-1] ^= 0x01
+        frames = p.feed(bytes(bad) + frame())
+        self.assertEqual(len(frames), 1)
+        self.assertGreater(p.errors, 0)
+
+    def test_truncated_frame_waits_for_more(self):
+        p = StreamParser(SENSOR_DATA_WIDTH)
+        f = frame()
+        self.assertEqual(p.feed(f[:6]), [])
+        self.assertEqual(p.pending(), 6)
+        self.assertEqual(len(p.feed(f[6:])), 1)
+
+    def test_reset_drops_partial_frame(self):
+        p = StreamParser(SENSOR_DATA_WIDTH)
+        p.feed(frame()[:6])
+        p.reset()
+        self.assertEqual(p.pending(), 0)
+        self.assertEqual(p.feed(frame()[6:]), [])
+
+    def test_two_byte_packet(self):
+        p = StreamParser(SENSOR_DATA_WIDTH)
+        f = encodeStreamFrame([(WALL_SIGNAL, b'\x00\x2a')])
+        self.assertEqual(p.feed(f), [([WALL_SIGNAL], b'\x00\x2a')])
+
+
+if __name__ == '__main__':
+    unittest.main()
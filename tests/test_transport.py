@@ -0,0 +1,165 @@
+"""Tests for the transports in create_serial.transport."""
+
+import io
+import os
+import socket
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from create_serial.transport import (
+    LoopbackTransport,
+    PosixTTYTransport,
+    SerialTransport,
+    TCPTransport,
+    openTransport,
+)
+
+
+class Doubler:
+    """A loopback peer that answers every write with each byte twice."""
+
+    def feed(self, data):
+        return bytes(b for b in data for _ in range(2))
+
+
+class TestLoopback(unittest.TestCase):
+    def test_echo(self):
+        t = LoopbackTransport()
+        self.assertEqual(t.write(b'\x80\x83'), 2)
+        self.assertEqual(t.in_waiting, 2)
+        self.assertEqual(t.read(2), b'\x80\x83')
+        self.assertEqual(t.in_waiting, 0)
+
+    def test_peer_answers_writes(self):
+        t = LoopbackTransport(peer=Doubler())
+        t.write(b'\x01\x02')
+        buf = bytearray(4)
+        self.assertEqual(t.readinto(buf), 4)
+        self.assertEqual(buf, bytearray(b'\x01\x01\x02\x02'))
+
+    def test_short_read_times_out(self):
+        t = LoopbackTransport(timeout=0.05)
+        t.write(b'\x01')
+        start = time.monotonic()
+        self.assertEqual(t.read(3), b'\x01')
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+    def test_zero_timeout_returns_what_is_there(self):
+        t = LoopbackTransport(timeout=0)
+        t.write(b'\x01\x02')
+        self.assertEqual(t.read(3), b'\x01\x02')
+        self.assertEqual(t.read(1), b'')
+
+    def test_reset_input_buffer(self):
+        t = LoopbackTransport()
+        t.write(b'abc')
+        t.reset_input_buffer()
+        self.assertEqual(t.in_waiting, 0)
+
+    def test_no_fileno(self):
+        with self.assertRaises(io.UnsupportedOperation):
+            LoopbackTransport().fileno()
+
+    def test_close(self):
+        t = LoopbackTransport()
+        self.assertTrue(t.isOpen())
+        t.close()
+        self.assertFalse(t.isOpen())
+
+
+class TestPosixTTY(unittest.TestCase):
+    def setUp(self):
+        self.master, slave = os.openpty()
+        self.path = os.ttyname(slave)
+        self.slave = slave
+
+    def tearDown(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+    def test_round_trip(self):
+        t = PosixTTYTransport(self.path, 115200, timeout=0.5)
+        try:
+            t.write(b'\x8e\x07')
+            self.assertEqual(os.read(self.master, 2), b'\x8e\x07')
+            os.write(self.master, b'\x00\x01\x02')
+            self.assertEqual(t.read(3), b'\x00\x01\x02')
+            self.assertIsInstance(t.fileno(), int)
+        finally:
+            t.close()
+
+    def test_in_waiting_and_timeout(self):
+        t = PosixTTYTransport(self.path, 115200, timeout=0.05)
+        try:
+            os.write(self.master, b'\x05')
+            time.sleep(0.01)
+            self.assertEqual(t.in_waiting, 1)
+            self.assertEqual(t.read(2), b'\x05')
+        finally:
+            t.close()
+
+    def test_zero_timeout(self):
+        t = PosixTTYTransport(self.path, 115200, timeout=0)
+        try:
+            os.write(self.master, b'\x05')
+            time.sleep(0.01)
+            self.assertEqual(t.read(2), b'\x05')
+            self.assertEqual(t.read(1), b'')
+        finally:
+            t.close()
+
+    def test_bad_baud(self):
+        with self.assertRaises(ValueError):
+            PosixTTYTransport(self.path, 12345)
+
+
+class TestTCP(unittest.TestCase):
+    def test_round_trip(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        port = server.getsockname()[1]
+        accepted = []
+        th = threading.Thread(target=lambda: accepted.append(server.accept()[0]))
+        th.start()
+        t = openTransport('socket://127.0.0.1:%d' % port)
+        th.join()
+        peer = accepted[0]
+        try:
+            self.assertIsInstance(t, TCPTransport)
+            t.write(b'\x80\x83')
+            self.assertEqual(peer.recv(2), b'\x80\x83')
+            peer.sendall(b'\x01\x02\x03')
+            self.assertEqual(t.read(3), b'\x01\x02\x03')
+            self.assertEqual(t.in_waiting, 0)
+        finally:
+            t.close()
+            peer.close()
+            server.close()
+
+
+class TestOpenTransport(unittest.TestCase):
+    def test_loop(self):
+        self.assertIsInstance(openTransport('loop://'), LoopbackTransport)
+
+    def test_posix(self):
+        master, slave = os.openpty()
+        try:
+            t = openTransport('posix:' + os.ttyname(slave))
+            self.assertIsInstance(t, PosixTTYTransport)
+            t.close()
+        finally:
+            os.close(master)
+            os.close(slave)
+
+    @patch('create_serial.transport.serial.Serial')
+    def test_default_is_pyserial(self, MockSerial):
+        t = openTransport('/dev/ttyUSB0', 57600, timeout=0.2)
+        self.assertIsInstance(t, SerialTransport)
+        MockSerial.assert_called_once_with('/dev/ttyUSB0', baudrate=57600, timeout=0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()